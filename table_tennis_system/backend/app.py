@@ -5,6 +5,15 @@ from flask_cors import CORS
 from config import Config
 from models import db
 from utils.database import test_connection
+from utils.scheduler import scheduler
+from utils.booking_jobs import expire_pending_bookings, complete_elapsed_bookings, sweep_expired_holds
+from utils.occupancy import rebuild_slots
+from utils.accounts import compact_balances, upgrade_ledger
+from utils.idempotency import purge_expired_keys
+from utils.payment_stats import rollup_payment_stats
+from utils.blockouts import refund_blockout
+from utils.payment_gateway import process_callbacks, close_expired_orders
+from utils.transaction_archive import archive_history
 
 # 导入路由
 from routes.auth import auth_bp
@@ -12,11 +21,14 @@ from routes.user import user_bp
 from routes.booking import booking_bp
 from routes.payment import payment_bp
 from routes.match import match_bp
+from routes.admin import admin_bp
 
-def create_app():
-    """应用工厂函数"""
+def create_app(config=None):
+    """应用工厂函数，config 中的配置项覆盖 Config（测试时使用）"""
     app = Flask(__name__)
     app.config.from_object(Config)
+    if config:
+        app.config.update(config)
 
     # 初始化扩展
     db.init_app(app)
@@ -33,6 +45,53 @@ def create_app():
     app.register_blueprint(booking_bp)
     app.register_blueprint(payment_bp)
     app.register_blueprint(match_bp)
+    app.register_blueprint(admin_bp)
+
+    # 后台任务（多进程部署时各进程都会运行，任务本身可重复执行）
+    scheduler.register('expire_pending_bookings', expire_pending_bookings,
+                       app.config['PENDING_EXPIRY_INTERVAL'])
+    scheduler.register('complete_elapsed_bookings', complete_elapsed_bookings,
+                       app.config['BOOKING_COMPLETION_INTERVAL'])
+    scheduler.register('sweep_expired_holds', sweep_expired_holds,
+                       app.config['HOLD_SWEEP_INTERVAL'])
+    scheduler.register('compact_ledger', compact_balances,
+                       app.config['LEDGER_COMPACTION_INTERVAL'])
+    scheduler.register('purge_idempotency_keys', purge_expired_keys,
+                       app.config['IDEMPOTENCY_PURGE_INTERVAL'])
+    scheduler.register('rollup_payment_stats', rollup_payment_stats,
+                       app.config['PAYMENT_STATS_INTERVAL'])
+    scheduler.register('refund_blockout_cancellations', refund_blockout,
+                       app.config['BLOCKOUT_REFUND_INTERVAL'])
+    scheduler.register('process_payment_callbacks', process_callbacks,
+                       app.config['PAYMENT_CALLBACK_INTERVAL'])
+    scheduler.register('close_expired_payment_orders', close_expired_orders,
+                       app.config['PAYMENT_ORDER_CLOSE_INTERVAL'])
+    # 归档会删除数据，需显式开启，且归档目录必须是绝对路径
+    if app.config['ARCHIVE_ENABLED']:
+        if not os.path.isabs(app.config['ARCHIVE_DIR'] or ''):
+            raise RuntimeError('开启归档时 ARCHIVE_DIR 必须配置为绝对路径')
+        scheduler.register('archive_history', archive_history,
+                           app.config['ARCHIVE_INTERVAL'])
+    if app.config['BACKGROUND_JOBS_ENABLED'] and os.environ.get('FLASK_RUN_FROM_CLI') != 'true':
+        scheduler.start(app)
+
+    # 命令行命令（flask --app app <命令>）
+    @app.cli.command('run-jobs')
+    def run_jobs_command():
+        """在当前进程中运行全部后台任务直到中断，部署时只启动一个这样的进程"""
+        print(f'后台任务已启动: {", ".join(scheduler.jobs)}')
+        scheduler.run_forever(app)
+
+    @app.cli.command('upgrade-ledger')
+    def upgrade_ledger_command():
+        """升级前的账户接入交易流水余额，部署新版本后对外提供服务前执行一次"""
+        print(f'已升级账户: {upgrade_ledger()}')
+
+    @app.cli.command('rebuild-slots')
+    def rebuild_slots_command():
+        """按现有待确认、已确认预约重建时间片占用表，升级或导入数据后执行"""
+        conflicts = rebuild_slots()
+        print(f'时间片占用已重建，冲突预约: {conflicts or "无"}')
 
     # 错误处理
     @app.errorhandler(400)
@@ -114,6 +173,9 @@ def create_app():
 
 if __name__ == '__main__':
     app = create_app()
+    # 开发服务器是单进程，在提供服务的重载子进程中运行后台任务
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        scheduler.start(app)
 
     # 开发环境配置
     app.run(
@@ -0,0 +1,27 @@
+"""回填每日收支汇总表 payment_daily_stats
+
+用法（在 backend 目录下）:
+    python backfill_payment_stats.py                                  # 清空后从第一条交易重新汇总
+    python backfill_payment_stats.py --start 2025-01-01 --end 2025-01-31  # 只重算指定日期
+"""
+import argparse
+from datetime import date
+
+from app import create_app
+from utils.payment_stats import rebuild_payment_stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='回填每日收支汇总')
+    parser.add_argument('--start', type=date.fromisoformat, help='开始日期 YYYY-MM-DD')
+    parser.add_argument('--end', type=date.fromisoformat, help='结束日期 YYYY-MM-DD')
+    args = parser.parse_args()
+
+    app = create_app({'BACKGROUND_JOBS_ENABLED': False})
+    with app.app_context():
+        result = rebuild_payment_stats(args.start, args.end)
+        print(f'汇总交易: {result["transactions"]}, 水位: {result["watermark"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""并发余额变动压力测试
+
+多个线程对少量账户并发执行随机的扣款和加款，结束后逐个核对实时余额与交易流水：
+实时余额（快照 + 增量）= 充值 + 退款 - 扣款，且余额不能为负。默认走 utils.accounts 中的
+扣款和加款；加 --naive 参数改为不加锁读余额后直接写扣款交易作对比；加 --compact 参数
+在压测期间另起一个线程不断合并余额快照。
+需要连接 config.py 中配置的 MySQL 数据库，测试数据会在结束后删除。
+用法（在 backend 目录下）: python -m benchmarks.balance_stress [线程数] [操作总数] [账户数] [--naive] [--compact]
+"""
+import random
+import sys
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from sqlalchemy import case, func
+
+from app import create_app
+from models import db, User, Account, Transaction
+from utils.accounts import InsufficientBalance, compact_balances, credit, debit, get_balance
+
+
+def create_fixture(account_count, initial_balance):
+    tag = uuid.uuid4().hex[:8]
+    users = [
+        User(username=f'balance_{tag}_{i}', password='x', real_name=f'余额压测{i}', user_type='student')
+        for i in range(account_count)
+    ]
+    db.session.add_all(users)
+    db.session.flush()
+    for user in users:
+        credit(user.id, initial_balance, '压测初始余额', transaction_type='deposit', create_missing=True)
+    db.session.commit()
+    return [user.id for user in users]
+
+
+def cleanup(user_ids):
+    Transaction.query.filter(Transaction.user_id.in_(user_ids)).delete(synchronize_session=False)
+    Account.query.filter(Account.user_id.in_(user_ids)).delete(synchronize_session=False)
+    User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def atomic_operation(user_id, amount, is_debit):
+    if is_debit:
+        debit(user_id, amount, '压测扣款')
+    else:
+        credit(user_id, amount, '压测退款')
+
+
+def naive_operation(user_id, amount, is_debit):
+    """不加锁读取余额后写入交易，并发扣款可能扣成负数"""
+    if is_debit:
+        balance = get_balance(user_id)
+        if balance < amount:
+            raise InsufficientBalance(balance)
+    db.session.add(Transaction(user_id=user_id, transaction_type='withdraw' if is_debit else 'refund',
+                               amount=amount, payment_method='system',
+                               description='压测扣款' if is_debit else '压测退款'))
+
+
+def verify(user_ids):
+    """返回实时余额与流水不一致或为负的账户列表"""
+    signed = case((Transaction.transaction_type == 'withdraw', -Transaction.amount), else_=Transaction.amount)
+    ledger = dict(db.session.query(Transaction.user_id, func.sum(signed)).filter(
+        Transaction.user_id.in_(user_ids), Transaction.status == 'completed'
+    ).group_by(Transaction.user_id).all())
+    balances = dict(db.session.query(Account.user_id, Account.current_balance).filter(
+        Account.user_id.in_(user_ids)).all())
+
+    mismatches = []
+    for user_id in user_ids:
+        expected = Decimal(ledger.get(user_id) or 0)
+        actual = balances.get(user_id, Decimal('0'))
+        if actual != expected or actual < 0:
+            mismatches.append((user_id, actual, expected))
+    return mismatches
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    naive = '--naive' in sys.argv
+    compact = '--compact' in sys.argv
+    thread_count = int(args[0]) if len(args) > 0 else 32
+    operations = int(args[1]) if len(args) > 1 else 10000
+    account_count = int(args[2]) if len(args) > 2 else 4
+
+    app = create_app({'BACKGROUND_JOBS_ENABLED': False})
+    with app.app_context():
+        user_ids = create_fixture(account_count, Decimal('500.00'))
+
+    operation = naive_operation if naive else atomic_operation
+    counters = {'ok': 0, 'insufficient': 0, 'error': 0}
+    counters_lock = threading.Lock()
+
+    def worker(seed, count):
+        rng = random.Random(seed)
+        local = {'ok': 0, 'insufficient': 0, 'error': 0}
+        with app.app_context():
+            for _ in range(count):
+                user_id = rng.choice(user_ids)
+                amount = Decimal(rng.choice(['10.00', '25.00', '50.00', '100.00']))
+                try:
+                    operation(user_id, amount, rng.random() < 0.55)
+                    db.session.commit()
+                    local['ok'] += 1
+                except InsufficientBalance:
+                    db.session.rollback()
+                    local['insufficient'] += 1
+                except Exception:
+                    db.session.rollback()
+                    local['error'] += 1
+            db.session.remove()
+        with counters_lock:
+            for key, value in local.items():
+                counters[key] += value
+
+    done = threading.Event()
+    compactions = {'runs': 0, 'compacted': 0}
+
+    def compactor():
+        with app.app_context():
+            # 压测中单个事务只有几毫秒，缩短延迟以便合并能追上写入
+            app.config['LEDGER_COMPACTION_LAG_SECONDS'] = 1
+            while not done.is_set():
+                result = compact_balances()
+                compactions['runs'] += 1
+                compactions['compacted'] += result['compacted']
+                time.sleep(0.05)
+            db.session.remove()
+
+    try:
+        started = time.perf_counter()
+        compact_thread = threading.Thread(target=compactor) if compact else None
+        if compact_thread:
+            compact_thread.start()
+        threads = [
+            threading.Thread(target=worker, args=(i, operations // thread_count + (i < operations % thread_count)))
+            for i in range(thread_count)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        done.set()
+        if compact_thread:
+            compact_thread.join()
+
+        with app.app_context():
+            mismatches = verify(user_ids)
+
+        total = operations
+        print(f'模式: {"naive" if naive else "atomic"}, 线程数: {thread_count}, 账户数: {account_count}')
+        print(f'操作数: {total}, 耗时: {elapsed:.2f}s, 吞吐: {total / elapsed:.0f} ops/s')
+        print(f'  成功: {counters["ok"]}, 余额不足: {counters["insufficient"]}, 异常: {counters["error"]}')
+        if compact:
+            print(f'  快照合并: {compactions["runs"]} 次, 共合并 {compactions["compacted"]} 个账户')
+        print(f'余额与流水不一致或为负的账户: {len(mismatches)}')
+        for user_id, actual, expected in mismatches:
+            print(f'  用户{user_id}: 余额 {actual}, 流水合计 {expected}')
+        if mismatches and not naive:
+            raise SystemExit('账户余额与交易流水不一致')
+    finally:
+        with app.app_context():
+            cleanup(user_ids)
+
+
+if __name__ == '__main__':
+    main()
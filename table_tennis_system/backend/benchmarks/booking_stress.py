@@ -0,0 +1,134 @@
+"""并发预约压力测试
+
+多个线程同时为同一教练、同一球台、同一时间段创建预约，验证时间片占用表的唯一键
+能拒绝全部冲突请求。需要连接 config.py 中配置的 MySQL 数据库，测试数据会在结束后删除。
+用法（在 backend 目录下）: python -m benchmarks.booking_stress [线程数] [轮数]
+"""
+import sys
+import threading
+import uuid
+from datetime import date, time, timedelta
+
+from flask_jwt_extended import create_access_token
+
+from app import create_app
+from models import (db, User, Campus, CoachProfile, Table, CoachStudentRelation,
+                    Account, Booking, TableSlot, UserSlot)
+
+
+def create_fixture(student_count):
+    tag = uuid.uuid4().hex[:8]
+    campus = Campus(name=f'stress-{tag}')
+    db.session.add(campus)
+    db.session.flush()
+
+    coach = User(username=f'stress_coach_{tag}', password='x', real_name='压测教练',
+                 user_type='coach', campus_id=campus.id)
+    students = [
+        User(username=f'stress_student_{tag}_{i}', password='x', real_name=f'压测学员{i}',
+             user_type='student', campus_id=campus.id)
+        for i in range(student_count)
+    ]
+    db.session.add_all([coach] + students)
+    db.session.flush()
+
+    db.session.add(CoachProfile(user_id=coach.id, coach_level='senior', hourly_rate=100))
+    db.session.add_all([Account(user_id=s.id, balance=100000) for s in students])
+    db.session.add_all([
+        CoachStudentRelation(student_id=s.id, coach_id=coach.id, status='approved')
+        for s in students
+    ])
+    table = Table(table_number='压测', campus_id=campus.id)
+    db.session.add(table)
+    db.session.commit()
+    return campus.id, coach.id, [s.id for s in students], table.id
+
+
+def cleanup(campus_id, coach_id, student_ids, table_id):
+    user_ids = [coach_id] + student_ids
+    booking_ids = [b.id for b in Booking.query.filter(Booking.coach_id == coach_id)]
+    if booking_ids:
+        UserSlot.query.filter(UserSlot.booking_id.in_(booking_ids)).delete(synchronize_session=False)
+        TableSlot.query.filter(TableSlot.booking_id.in_(booking_ids)).delete(synchronize_session=False)
+        Booking.query.filter(Booking.id.in_(booking_ids)).delete(synchronize_session=False)
+    CoachStudentRelation.query.filter(CoachStudentRelation.coach_id == coach_id).delete(synchronize_session=False)
+    Account.query.filter(Account.user_id.in_(student_ids)).delete(synchronize_session=False)
+    CoachProfile.query.filter_by(user_id=coach_id).delete(synchronize_session=False)
+    db.session.execute(db.text('DELETE FROM system_logs WHERE user_id IN :ids').bindparams(
+        db.bindparam('ids', expanding=True)), {'ids': user_ids})
+    User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+    Table.query.filter_by(id=table_id).delete(synchronize_session=False)
+    Campus.query.filter_by(id=campus_id).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def overlapping_pairs(bookings):
+    """统计同一教练或同一球台上时间重叠的预约对数"""
+    pairs = 0
+    for i, a in enumerate(bookings):
+        for b in bookings[i + 1:]:
+            same_resource = a.coach_id == b.coach_id or (a.table_id and a.table_id == b.table_id)
+            if same_resource and a.booking_date == b.booking_date \
+                    and a.start_time < b.end_time and b.start_time < a.end_time:
+                pairs += 1
+    return pairs
+
+
+def main():
+    thread_count = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    app = create_app({'BACKGROUND_JOBS_ENABLED': False})
+    with app.app_context():
+        campus_id, coach_id, student_ids, table_id = create_fixture(thread_count)
+        tokens = [create_access_token(identity=sid) for sid in student_ids]
+
+    try:
+        statuses = {}
+        statuses_lock = threading.Lock()
+        for round_no in range(rounds):
+            booking_date = (date.today() + timedelta(days=2 + round_no)).isoformat()
+            barrier = threading.Barrier(thread_count)
+
+            def worker(token, offset):
+                client = app.test_client()
+                # 错开 15 分钟制造部分重叠
+                start = time(10, (offset % 4) * 15)
+                barrier.wait()
+                response = client.post('/api/booking/create', json={
+                    'coach_id': coach_id,
+                    'date': booking_date,
+                    'start_time': start.isoformat(),
+                    'end_time': time(11, (offset % 4) * 15).isoformat(),
+                    'table_id': table_id
+                }, headers={'Authorization': f'Bearer {token}'})
+                key = 'success' if response.get_json().get('success') else response.get_json().get('message')
+                with statuses_lock:
+                    statuses[key] = statuses.get(key, 0) + 1
+
+            threads = [threading.Thread(target=worker, args=(token, i)) for i, token in enumerate(tokens)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        with app.app_context():
+            bookings = Booking.query.filter(
+                Booking.coach_id == coach_id,
+                Booking.status.in_(['pending', 'confirmed'])
+            ).all()
+            double_bookings = overlapping_pairs(bookings)
+
+        print(f'线程数: {thread_count}, 轮数: {rounds}')
+        for key, count in sorted(statuses.items(), key=lambda item: -item[1]):
+            print(f'  {key}: {count}')
+        print(f'成功预约: {len(bookings)}, 重复预约: {double_bookings}')
+        if double_bookings:
+            raise SystemExit('发现重复预约')
+    finally:
+        with app.app_context():
+            cleanup(campus_id, coach_id, student_ids, table_id)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""并发取消次数限制测试
+
+同一学员的多个已确认预约被多个线程同时取消，验证成功取消的数量不超过
+MONTHLY_CANCEL_LIMIT，且 cancellation_limits 中的计数与实际取消数一致。
+需要连接 config.py 中配置的 MySQL 数据库，测试数据会在结束后删除。
+不需要 MySQL 的同类检查见 tests/test_cancel_limits.py（python -m pytest 运行）。
+用法（在 backend 目录下）: python -m benchmarks.cancel_limit_stress [线程数]
+"""
+import sys
+import threading
+from datetime import date, time, timedelta
+
+from flask_jwt_extended import create_access_token
+
+from app import create_app
+from models import db, Booking, CancellationLimit, Transaction
+from utils.cancel_limits import current_year_month
+from utils.occupancy import occupy_slots
+from benchmarks.booking_stress import create_fixture, cleanup
+
+
+def create_bookings(coach_id, student_id, campus_id, count):
+    """为学员创建 count 个已确认预约，日期均在 24 小时之后"""
+    bookings = []
+    for i in range(count):
+        booking = Booking(
+            student_id=student_id, coach_id=coach_id, campus_id=campus_id,
+            booking_date=date.today() + timedelta(days=3 + i // 10),
+            start_time=time(8 + i % 10), end_time=time(9 + i % 10),
+            lesson_fee=100, status='confirmed'
+        )
+        db.session.add(booking)
+        bookings.append(booking)
+    db.session.flush()
+    occupy_slots(bookings, table=False)
+    db.session.commit()
+    return [booking.id for booking in bookings]
+
+
+def main():
+    thread_count = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+
+    app = create_app({'BACKGROUND_JOBS_ENABLED': False})
+    with app.app_context():
+        campus_id, coach_id, student_ids, table_id = create_fixture(1)
+        student_id = student_ids[0]
+        booking_ids = create_bookings(coach_id, student_id, campus_id, thread_count)
+        token = create_access_token(identity=student_id)
+        limit = app.config['MONTHLY_CANCEL_LIMIT']
+
+    try:
+        statuses = {}
+        statuses_lock = threading.Lock()
+        barrier = threading.Barrier(thread_count)
+
+        def worker(booking_id):
+            client = app.test_client()
+            barrier.wait()
+            response = client.post(f'/api/booking/{booking_id}/cancel', json={'reason': '压测'},
+                                   headers={'Authorization': f'Bearer {token}'})
+            key = 'success' if response.get_json().get('success') else response.get_json().get('message')
+            with statuses_lock:
+                statuses[key] = statuses.get(key, 0) + 1
+
+        threads = [threading.Thread(target=worker, args=(booking_id,)) for booking_id in booking_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with app.app_context():
+            cancelled = Booking.query.filter(
+                Booking.id.in_(booking_ids), Booking.status == 'cancelled').count()
+            record = CancellationLimit.query.filter_by(
+                user_id=student_id, year_month=current_year_month()).first()
+            counted = record.cancellation_count if record else 0
+
+        print(f'线程数: {thread_count}, 每月上限: {limit}')
+        for key, count in sorted(statuses.items(), key=lambda item: -item[1]):
+            print(f'  {key}: {count}')
+        print(f'实际取消: {cancelled}, 计数: {counted}')
+        if cancelled > limit or cancelled != counted:
+            raise SystemExit('取消次数限制被突破')
+    finally:
+        with app.app_context():
+            CancellationLimit.query.filter_by(user_id=student_id).delete(synchronize_session=False)
+            Transaction.query.filter_by(user_id=student_id).delete(synchronize_session=False)
+            db.session.commit()
+            cleanup(campus_id, coach_id, student_ids, table_id)
+
+
+if __name__ == '__main__':
+    main()
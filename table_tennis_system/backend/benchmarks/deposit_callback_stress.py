@@ -0,0 +1,176 @@
+"""支付回调风暴压力测试
+
+为一批用户创建待支付的在线充值，再由多个线程把每个订单的回调乱序重复投递到回调接口
+（部分订单支付失败），同时另起一个线程不断批量处理回调。结束后核对：每个订单只入账一次、
+失败订单不入账、没有遗留的待处理回调，且收支统计与直接扫描交易表的结果一致。
+需要连接 config.py 中配置的 MySQL 数据库，测试数据会在结束后删除。
+用法（在 backend 目录下）: python -m benchmarks.deposit_callback_stress [线程数] [订单数] [每个回调重复次数]
+"""
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import func
+
+from app import create_app
+from models import db, User, Account, Transaction, GatewayCallback
+from utils.accounts import credit
+from utils.payment_gateway import process_callbacks, sign
+from utils.payment_stats import payment_statistics, rebuild_payment_stats, rollup_payment_stats
+
+
+def create_fixture(order_count):
+    tag = uuid.uuid4().hex[:8]
+    users = [User(username=f'callback_{tag}_{i}', password='x', real_name=f'回调压测{i}', user_type='student')
+             for i in range(max(order_count // 4, 1))]
+    db.session.add_all(users)
+    db.session.flush()
+    rng = random.Random(0)
+    orders = []
+    for i in range(order_count):
+        user = users[i % len(users)]
+        amount = Decimal(rng.choice(['50.00', '100.00', '200.00']))
+        transaction = credit(user.id, amount, '回调压测充值', transaction_type='deposit',
+                             payment_method=rng.choice(['wechat', 'alipay']), status='pending', create_missing=True)
+        db.session.flush()
+        orders.append({'transaction_id': transaction.id, 'user_id': user.id, 'amount': amount,
+                       'trade_status': 'failed' if rng.random() < 0.1 else 'success'})
+    db.session.commit()
+    return [user.id for user in users], orders
+
+
+def cleanup(user_ids):
+    transaction_ids = db.session.query(Transaction.id).filter(Transaction.user_id.in_(user_ids))
+    GatewayCallback.query.filter(GatewayCallback.transaction_id.in_(transaction_ids)).delete(synchronize_session=False)
+    Transaction.query.filter(Transaction.user_id.in_(user_ids)).delete(synchronize_session=False)
+    Account.query.filter(Account.user_id.in_(user_ids)).delete(synchronize_session=False)
+    User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+    db.session.commit()
+    # 压测交易已计入每日汇总，删除后重算当天的汇总
+    today = datetime.utcnow().date()
+    rebuild_payment_stats(today, today)
+
+
+def callback_params(order):
+    params = {
+        'notify_id': f'stress-{order["transaction_id"]}',
+        'out_trade_no': str(order['transaction_id']),
+        'trade_no': uuid.uuid4().hex,
+        'amount': str(order['amount']),
+        'trade_status': order['trade_status']
+    }
+    params['sign'] = sign(params)
+    return params
+
+
+def verify(user_ids, orders):
+    """返回问题列表：订单状态不符、余额与成功订单合计不符、遗留待处理回调"""
+    problems = []
+    statuses = dict(db.session.query(Transaction.id, Transaction.status).filter(
+        Transaction.id.in_([order['transaction_id'] for order in orders])))
+    expected_balance = {}
+    for order in orders:
+        expected = 'completed' if order['trade_status'] == 'success' else 'failed'
+        if statuses.get(order['transaction_id']) != expected:
+            problems.append(f'订单 {order["transaction_id"]}: 状态 {statuses.get(order["transaction_id"])}, 应为 {expected}')
+        if expected == 'completed':
+            expected_balance[order['user_id']] = expected_balance.get(order['user_id'], Decimal('0')) + order['amount']
+
+    balances = dict(db.session.query(Account.user_id, Account.current_balance).filter(Account.user_id.in_(user_ids)))
+    for user_id in user_ids:
+        if Decimal(balances.get(user_id) or 0) != expected_balance.get(user_id, Decimal('0')):
+            problems.append(f'用户 {user_id}: 余额 {balances.get(user_id)}, 应为 {expected_balance.get(user_id, 0)}')
+
+    pending = GatewayCallback.query.filter(GatewayCallback.result == 'pending').count()
+    if pending:
+        problems.append(f'遗留待处理回调 {pending} 条')
+
+    stats = payment_statistics()
+    summarized = sum(entry['total'] for (campus, transaction_type), entry in stats.items()
+                     if transaction_type == 'deposit')
+    scanned = db.session.query(func.coalesce(func.sum(Transaction.amount), 0)).filter(
+        Transaction.transaction_type == 'deposit', Transaction.status == 'completed').scalar()
+    if Decimal(summarized) != Decimal(scanned):
+        problems.append(f'收支统计充值合计 {summarized}, 交易表合计 {scanned}')
+    return problems
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    thread_count = int(args[0]) if len(args) > 0 else 16
+    order_count = int(args[1]) if len(args) > 1 else 2000
+    duplicates = int(args[2]) if len(args) > 2 else 5
+
+    app = create_app({'BACKGROUND_JOBS_ENABLED': False})
+    with app.app_context():
+        user_ids, orders = create_fixture(order_count)
+        # 让增量汇总越过全部待支付订单，入账时需要把它们补进每日汇总
+        app.config['PAYMENT_STATS_LAG_SECONDS'] = 0
+        rollup_payment_stats()
+        deliveries = [callback_params(order) for order in orders for _ in range(duplicates)]
+    random.Random(1).shuffle(deliveries)
+
+    counters = {'accepted': 0, 'rejected': 0}
+    counters_lock = threading.Lock()
+
+    def sender(chunk):
+        client = app.test_client()
+        local = {'accepted': 0, 'rejected': 0}
+        for params in chunk:
+            response = client.post('/api/payment/gateway/notify', json=params)
+            local['accepted' if response.get_data(as_text=True) == 'success' else 'rejected'] += 1
+        with counters_lock:
+            for key, value in local.items():
+                counters[key] += value
+
+    done = threading.Event()
+    processed = {'runs': 0, 'credited': 0}
+
+    def processor():
+        with app.app_context():
+            while not done.is_set():
+                result = process_callbacks()
+                processed['runs'] += 1
+                processed['credited'] += result['credited']
+                time.sleep(0.05)
+            db.session.remove()
+
+    try:
+        started = time.perf_counter()
+        process_thread = threading.Thread(target=processor)
+        process_thread.start()
+        threads = [threading.Thread(target=sender, args=(deliveries[i::thread_count],)) for i in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        done.set()
+        process_thread.join()
+        with app.app_context():
+            final = process_callbacks()
+            processed['credited'] += final['credited']
+        elapsed = time.perf_counter() - started
+
+        with app.app_context():
+            problems = verify(user_ids, orders)
+
+        print(f'线程数: {thread_count}, 订单数: {order_count}, 每个回调重复: {duplicates}')
+        print(f'回调投递: {len(deliveries)}, 耗时: {elapsed:.2f}s, 吞吐: {len(deliveries) / elapsed:.0f} 次/s')
+        print(f'  接受: {counters["accepted"]}, 拒绝: {counters["rejected"]}')
+        print(f'  批量处理: {processed["runs"]} 次, 入账订单: {processed["credited"]}')
+        print(f'问题: {len(problems)}')
+        for problem in problems[:20]:
+            print(f'  {problem}')
+        if problems:
+            raise SystemExit('回调处理结果与预期不一致')
+    finally:
+        with app.app_context():
+            cleanup(user_ids)
+
+
+if __name__ == '__main__':
+    main()
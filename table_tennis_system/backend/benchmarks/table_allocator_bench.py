@@ -0,0 +1,96 @@
+"""球台分配策略对比
+
+按随机顺序到达的预约请求依次分配球台，比较首次适配（utils.table_allocator 采用的策略）与
+最佳适配（选两侧空闲碎片最小的球台）的接受率和球台利用率。
+用法（在 backend 目录下）: python -m benchmarks.table_allocator_bench [球台数] [请求数] [天数] [evening|uniform]
+"""
+import random
+import sys
+from bisect import bisect_left
+
+from utils.table_allocator import first_fit_table
+from utils.table_index import TableTimeline
+
+OPEN_SECONDS = 8 * 3600
+CLOSE_SECONDS = 22 * 3600
+
+
+def gap_cost(timeline, start, end):
+    """将 [start, end) 放入球台后两侧留下的空闲碎片总长度，无法放入时返回 None"""
+    idx = bisect_left(timeline.starts, end)
+    if idx and timeline.max_ends[idx - 1] > start:
+        return None
+    prev_end = timeline.max_ends[idx - 1] if idx else OPEN_SECONDS
+    next_start = timeline.starts[idx] if idx < len(timeline.starts) else CLOSE_SECONDS
+    return max(0, start - prev_end) + max(0, next_start - end)
+
+
+def best_fit_table(timelines, start, end):
+    """对照组：选出碎片最小的球台，相同时取 id 较小者"""
+    best = None
+    for table_id, timeline in timelines:
+        cost = gap_cost(timeline, start, end)
+        if cost is not None and (best is None or cost < best[0]):
+            best = (cost, table_id)
+    return best[1] if best else None
+
+
+def generate_requests(count, rng, workload='evening'):
+    """生成一天的请求
+
+    evening: 晚间时段更集中，整点或半点开始，时长 1 到 2 小时；
+    uniform: 全天均匀分布，按 15 分钟对齐，时长 30 分钟到 2 小时。
+    """
+    requests = []
+    for _ in range(count):
+        if workload == 'uniform':
+            start = rng.randrange(OPEN_SECONDS, 21 * 3600 + 1, 900)
+            duration = rng.choice([1800, 2700, 3600, 5400, 7200])
+        else:
+            if rng.random() < 0.6:
+                start = rng.randrange(17 * 3600, 20 * 3600 + 1, 1800)
+            else:
+                start = rng.randrange(OPEN_SECONDS, 20 * 3600 + 1, 1800)
+            duration = rng.choice([3600, 3600, 5400, 7200])
+        requests.append((start, min(start + duration, CLOSE_SECONDS)))
+    return requests
+
+
+def simulate(strategy, table_count, requests):
+    timelines = [(table_id, TableTimeline()) for table_id in range(1, table_count + 1)]
+    lookup = dict(timelines)
+    accepted = booked = 0
+    for booking_id, (start, end) in enumerate(requests):
+        table_id = strategy(timelines, start, end)
+        if table_id is None:
+            continue
+        lookup[table_id].add(start, end, booking_id)
+        accepted += 1
+        booked += end - start
+    return accepted, booked
+
+
+def main():
+    table_count = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    request_count = int(sys.argv[2]) if len(sys.argv) > 2 else 150
+    days = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    workload = sys.argv[4] if len(sys.argv) > 4 else 'evening'
+
+    capacity = table_count * (CLOSE_SECONDS - OPEN_SECONDS)
+    totals = {'首次适配': [0, 0], '最佳适配': [0, 0]}
+    rng = random.Random(2025)
+    for _ in range(days):
+        requests = generate_requests(request_count, rng, workload)
+        for name, strategy in (('首次适配', first_fit_table), ('最佳适配', best_fit_table)):
+            accepted, booked = simulate(strategy, table_count, requests)
+            totals[name][0] += accepted
+            totals[name][1] += booked
+
+    print(f'球台数: {table_count}, 每天请求数: {request_count}, 模拟天数: {days}, 需求分布: {workload}')
+    for name, (accepted, booked) in totals.items():
+        print(f'{name}: 接受率 {accepted * 100 / (request_count * days):.2f}%, '
+              f'球台利用率 {booked * 100 / (capacity * days):.2f}%')
+
+
+if __name__ == '__main__':
+    main()
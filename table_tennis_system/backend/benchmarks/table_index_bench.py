@@ -0,0 +1,117 @@
+"""球台占用索引基准测试
+
+在内存中生成某校区一天 10k 条预约（默认 1000 张球台，同一球台的预约互不重叠），比较索引查询与逐条扫描的延迟，
+并校验两者结果一致。
+用法（在 backend 目录下）: python -m benchmarks.table_index_bench [预约数] [球台数]
+"""
+import random
+import statistics
+import sys
+import time
+from datetime import date, time as dtime
+
+from flask import Flask
+
+from utils.table_index import TableOccupancyIndex, to_seconds
+
+
+def generate_bookings(count, table_count, seed=42):
+    """生成同一球台互不重叠的随机预约 (booking_id, table_id, start_time, end_time)
+
+    每张球台从 8:00 起依次排课到 22:00，再从全部课程中随机抽取 count 条；
+    球台数不足以排下 count 条预约时退出。
+    """
+    rng = random.Random(seed)
+    lessons = []
+    for table_id in range(1, table_count + 1):
+        cursor = 8 * 3600
+        while True:
+            start = cursor + rng.choice([0, 0, 900, 1800])
+            end = start + rng.choice([1800, 3600, 5400])
+            if end > 22 * 3600:
+                break
+            lessons.append((table_id, start, end))
+            cursor = end
+    if len(lessons) < count:
+        raise SystemExit(f'{table_count} 张球台一天最多排下 {len(lessons)} 条预约，请增加球台数')
+
+    rows = []
+    for booking_id, (table_id, start, end) in enumerate(rng.sample(lessons, count), start=1):
+        rows.append((booking_id, table_id, _to_time(start), _to_time(end)))
+    return rows
+
+
+def check_no_overlap(rows):
+    """校验生成的预约在同一球台上没有重叠"""
+    by_table = {}
+    for _, table_id, start, end in rows:
+        by_table.setdefault(table_id, []).append((to_seconds(start), to_seconds(end)))
+    for table_id, intervals in by_table.items():
+        intervals.sort()
+        for (_, prev_end), (start, _) in zip(intervals, intervals[1:]):
+            if start < prev_end:
+                raise SystemExit(f'球台 {table_id} 的预约重叠')
+
+
+def _to_time(seconds):
+    return dtime(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+def scan_free_tables(table_ids, rows, start, end):
+    """对照组：逐条扫描当天全部预约"""
+    occupied = {
+        table_id for _, table_id, s, e in rows
+        if to_seconds(s) < end and to_seconds(e) > start
+    }
+    return [table_id for table_id in table_ids if table_id not in occupied]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    table_count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    queries = 2000
+
+    app = Flask(__name__)
+    app.config['TABLE_INDEX_TTL'] = 3600
+    with app.app_context():
+        rows = generate_bookings(count, table_count)
+        check_no_overlap(rows)
+        tables = [(table_id, {'id': table_id}) for table_id in range(1, table_count + 1)]
+        table_ids = [table_id for table_id, _ in tables]
+
+        index = TableOccupancyIndex()
+        started = time.perf_counter()
+        index.load_day(1, date.today(), tables, rows)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        rng = random.Random(7)
+        index_samples, scan_samples = [], []
+        for _ in range(queries):
+            start = rng.randrange(8 * 3600, 22 * 3600, 900)
+            end = start + rng.choice([1800, 3600, 5400])
+
+            t0 = time.perf_counter()
+            free = index.free_tables(1, date.today(), _to_time(start), _to_time(end))
+            index_samples.append((time.perf_counter() - t0) * 1e6)
+
+            t0 = time.perf_counter()
+            expected = scan_free_tables(table_ids, rows, start, end)
+            scan_samples.append((time.perf_counter() - t0) * 1e6)
+
+            if [item['id'] for item in free] != expected:
+                raise SystemExit(f'结果不一致: {start}-{end}')
+
+    print(f'预约数: {count}, 球台数: {table_count}, 查询次数: {queries}')
+    print(f'索引构建耗时: {build_ms:.1f} ms')
+    for name, samples in (('索引查询', index_samples), ('逐条扫描', scan_samples)):
+        print(f'{name}: 平均 {statistics.mean(samples):.1f} us, '
+              f'p50 {percentile(samples, 0.5):.1f} us, p99 {percentile(samples, 0.99):.1f} us')
+
+
+if __name__ == '__main__':
+    main()
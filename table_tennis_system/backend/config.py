@@ -25,4 +25,77 @@ class Config:
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
     # 分页配置
-    PER_PAGE = 10
\ No newline at end of file
+    PER_PAGE = 10
+
+    # 球台占用索引配置（秒），超时后从数据库重新加载
+    TABLE_INDEX_TTL = int(os.environ.get('TABLE_INDEX_TTL') or 60)
+
+    # 教练课表缓存配置
+    SCHEDULE_CACHE_TTL = int(os.environ.get('SCHEDULE_CACHE_TTL') or 60)   # 缓存有效期（秒）
+    SCHEDULE_CACHE_MAX_WEEKS = 5000  # 进程内最多缓存的 (教练, 周) 条目数，超出时丢弃最早加载的
+    SCHEDULE_MAX_DAYS = 92           # 课表查询的最大日期跨度
+
+    # 预约时间片配置
+    BOOKING_SLOT_MINUTES = 30       # 空闲时间查询的时间片粒度（15 或 30 分钟）
+    BOOKING_OPEN_HOUR = 8           # 营业开始时间
+    BOOKING_CLOSE_HOUR = 22         # 营业结束时间
+    FREE_SLOT_MAX_DAYS = 56         # 空闲时间查询的最大日期跨度
+    OCCUPANCY_SLOT_MINUTES = 15     # 时间片占用表粒度，新建预约的起止时间必须对齐时间片
+    BOOKING_SERIES_MAX_WEEKS = 26   # 系列预约最多周数
+    SLOT_HOLD_TTL_SECONDS = 300     # 预约向导中时间片保留的有效期（秒）
+    SLOT_HOLD_MAX_ACTIVE = 3        # 每个学员同时持有的保留上限
+    WAITLIST_PROMOTE_SCAN = 20      # 预约取消时最多检查的候补数量
+    MONTHLY_CANCEL_LIMIT = 3        # 学员每月最多取消预约次数（教练取消不计入）
+    CANCEL_LIMIT_CACHE_TTL = 300    # 取消次数进程内缓存有效期（秒）
+    IDEMPOTENCY_KEY_TTL_HOURS = 24  # 幂等键保存时长（小时），期间重放的请求直接返回原响应
+    COACH_BLOCKOUT_MAX_DAYS = 60    # 单次教练请假的最大天数
+
+    # 后台任务配置
+    # 后台任务只应在一个进程中运行：多进程部署（如 gunicorn 多个 worker）保持关闭，另起一个
+    # `flask --app app run-jobs` 进程专门运行；开启时 create_app() 在本进程启动后台任务，
+    # 但 flask 命令行命令和 reconcile_accounts.py 等脚本始终不启动，避免与运行中的任务竞争
+    BACKGROUND_JOBS_ENABLED = (os.environ.get('BACKGROUND_JOBS_ENABLED') or 'false').lower() == 'true'
+    BOOKING_JOB_BATCH_SIZE = 500            # 批量任务每批处理的预约数
+    REFUND_CHUNK_SIZE = 500                 # 批量退款每批处理的行数
+    PENDING_BOOKING_TTL_HOURS = int(os.environ.get('PENDING_BOOKING_TTL_HOURS') or 48)
+    PENDING_EXPIRY_INTERVAL = 300           # 待确认预约过期检查间隔（秒）
+    BOOKING_COMPLETION_INTERVAL = 600       # 已结束课程自动完成间隔（秒）
+    HOLD_SWEEP_INTERVAL = 30                # 过期时间片保留回收间隔（秒）
+    LEDGER_COMPACTION_INTERVAL = 300        # 余额快照合并间隔（秒）
+    LEDGER_COMPACTION_BATCH_SIZE = 500      # 每批合并的账户数
+    LEDGER_COMPACTION_LAG_SECONDS = 60      # 只合并写入超过该秒数的交易
+    IDEMPOTENCY_PURGE_INTERVAL = 3600       # 过期幂等键清理间隔（秒）
+    PAYMENT_STATS_INTERVAL = 60             # 每日收支汇总增量更新间隔（秒）
+    PAYMENT_STATS_BATCH_SIZE = 5000         # 每批汇总的交易数
+    PAYMENT_STATS_LAG_SECONDS = 60          # 只汇总写入超过该秒数的交易，更新的交易在查询时实时累加
+    BLOCKOUT_REFUND_INTERVAL = 300          # 教练请假未完成退款的补偿间隔（秒）
+    PAYMENT_CALLBACK_INTERVAL = 5           # 支付回调批量入账间隔（秒）
+    PAYMENT_CALLBACK_BATCH_SIZE = 500       # 每批处理的支付回调数
+    PAYMENT_ORDER_CLOSE_INTERVAL = 60       # 超时未支付充值订单的关闭间隔（秒）
+    ARCHIVE_INTERVAL = 86400                # 旧交易和系统日志归档间隔（秒）
+
+    # 支付网关配置（开发环境使用 mock_gateway.py 启动的本地模拟网关）
+    PAYMENT_GATEWAY_URL = os.environ.get('PAYMENT_GATEWAY_URL') or 'http://127.0.0.1:5050'
+    PAYMENT_GATEWAY_SECRET = os.environ.get('PAYMENT_GATEWAY_SECRET') or 'dev-gateway-secret'
+    PAYMENT_GATEWAY_TIMEOUT = 5             # 调用网关下单的超时（秒）
+    PAYMENT_NOTIFY_URL = os.environ.get('PAYMENT_NOTIFY_URL') or 'http://127.0.0.1:5000/api/payment/gateway/notify'
+    PAYMENT_ORDER_TIMEOUT_MINUTES = 30      # 在线充值超过该时间未支付则关闭订单
+
+    # 数据导出配置
+    EXPORT_BATCH_SIZE = 1000                # 流式导出每批从服务端游标读取的行数
+
+    # 统计配置
+    REVENUE_SERIES_MAX_DAYS = 1100          # 收支趋势单次查询的最大天数
+
+    # 归档配置
+    TRANSACTION_HOT_MONTHS = 12             # 交易表保留最近的整月数，更早的月份归档到压缩文件
+    SYSTEM_LOG_HOT_MONTHS = 6               # 系统日志保留最近的整月数
+    # 归档会删除交易表和系统日志中的数据，默认关闭；开启时 ARCHIVE_DIR 必须是绝对路径
+    ARCHIVE_ENABLED = (os.environ.get('ARCHIVE_ENABLED') or 'false').lower() == 'true'
+    ARCHIVE_BATCH_SIZE = 1000               # 归档时每批读取和删除的行数
+    ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR')
+
+    # 对账配置
+    RECONCILIATION_CHUNK_SIZE = 2000        # 每个对账任务覆盖的账户数
+    RECONCILIATION_WORKERS = 4              # 并行对账的工作线程数
+    RECONCILIATION_REPORT_DIR = os.environ.get('RECONCILIATION_REPORT_DIR') or 'reports'
@@ -0,0 +1,143 @@
+"""本地模拟支付网关，用于开发和测试异步充值流程
+
+用法（在 backend 目录下）:
+    python mock_gateway.py                                   # 监听 5050 端口，打开返回的支付链接后发送回调
+    python mock_gateway.py --auto-pay                        # 下单后自动支付
+    python mock_gateway.py --auto-pay --duplicates 5 --fail-rate 0.1 --latency-ms 0-3000
+                                                             # 回调风暴：每个通知乱序并发投递 5 次，10% 支付失败
+
+签名密钥默认与 config.py 中的 PAYMENT_GATEWAY_SECRET 一致。和真实网关一样，回调在收到 success
+之前按指数退避重试。支付链接加 ?result=failed 可模拟支付失败。
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.request
+import uuid
+
+from flask import Flask, jsonify, request
+from config import Config
+from utils.payment_gateway import sign, verify
+
+
+def parse_range(value):
+    """把 "200-1000" 或 "500" 形式的毫秒数解析为秒数区间"""
+    low, _, high = value.partition('-')
+    return int(low) / 1000, int(high or low) / 1000
+
+
+class MockGateway:
+    def __init__(self, secret, public_url, order_latency, callback_latency, duplicates, fail_rate, auto_pay, retries):
+        self.secret = secret
+        self.public_url = public_url
+        self.order_latency = order_latency
+        self.callback_latency = callback_latency
+        self.duplicates = duplicates
+        self.fail_rate = fail_rate
+        self.auto_pay = auto_pay
+        self.retries = retries
+        self.orders = {}
+        self.lock = threading.Lock()
+
+    def deliver(self, notify_url, params):
+        """投递一次回调，直到后端返回 success 或重试次数用完"""
+        body = json.dumps(params).encode('utf-8')
+        for attempt in range(self.retries + 1):
+            time.sleep(random.uniform(*self.callback_latency))
+            try:
+                req = urllib.request.Request(notify_url, data=body, headers={'Content-Type': 'application/json'})
+                with urllib.request.urlopen(req, timeout=10) as response:
+                    if response.read().decode('utf-8').strip() == 'success':
+                        return True
+            except OSError:
+                pass
+            time.sleep(min(2 ** attempt, 30))
+        print(f'回调投递失败: 订单 {params["out_trade_no"]}')
+        return False
+
+    def pay(self, order, trade_status=None):
+        """完成支付并发送回调；同一通知由多个线程重复投递，模拟网关重试和回调风暴"""
+        if trade_status is None:
+            trade_status = 'failed' if random.random() < self.fail_rate else 'success'
+        order['status'] = trade_status
+        params = {
+            'notify_id': uuid.uuid4().hex,
+            'out_trade_no': order['out_trade_no'],
+            'trade_no': order['trade_no'],
+            'amount': order['amount'],
+            'trade_status': trade_status
+        }
+        params['sign'] = sign(params, self.secret)
+        for _ in range(self.duplicates):
+            threading.Thread(target=self.deliver, args=(order['notify_url'], params), daemon=True).start()
+
+
+def create_gateway_app(gateway):
+    app = Flask(__name__)
+
+    @app.route('/orders', methods=['POST'])
+    def create_order():
+        params = request.get_json(silent=True) or {}
+        if not verify(params, gateway.secret):
+            return jsonify({'error': 'invalid sign'}), 400
+        time.sleep(random.uniform(*gateway.order_latency))
+
+        order = {
+            'trade_no': uuid.uuid4().hex,
+            'out_trade_no': params['out_trade_no'],
+            'amount': params['amount'],
+            'notify_url': params['notify_url'],
+            'status': 'created'
+        }
+        with gateway.lock:
+            gateway.orders[order['trade_no']] = order
+        if gateway.auto_pay:
+            threading.Thread(target=gateway.pay, args=(order,), daemon=True).start()
+
+        response = {
+            'trade_no': order['trade_no'],
+            'out_trade_no': order['out_trade_no'],
+            'pay_url': f'{gateway.public_url}/pay/{order["trade_no"]}'
+        }
+        response['sign'] = sign(response, gateway.secret)
+        return jsonify(response)
+
+    @app.route('/pay/<trade_no>', methods=['GET', 'POST'])
+    def pay(trade_no):
+        """模拟用户完成支付"""
+        with gateway.lock:
+            order = gateway.orders.get(trade_no)
+            if not order:
+                return '订单不存在', 404
+            if order['status'] != 'created':
+                return '订单已支付', 409
+            order['status'] = 'paying'
+        gateway.pay(order, 'failed' if request.args.get('result') == 'failed' else 'success')
+        return '支付完成，可以关闭此页面'
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟支付网关')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--secret', default=Config.PAYMENT_GATEWAY_SECRET, help='签名密钥')
+    parser.add_argument('--order-latency-ms', default='20-100', help='下单响应延迟（毫秒，可写区间）')
+    parser.add_argument('--latency-ms', default='200-1000', help='每次回调投递前的延迟（毫秒，可写区间）')
+    parser.add_argument('--duplicates', type=int, default=1, help='每个通知并发投递的次数')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='自动支付时支付失败的比例')
+    parser.add_argument('--retries', type=int, default=5, help='未收到 success 时的重试次数')
+    parser.add_argument('--auto-pay', action='store_true', help='下单后自动支付')
+    args = parser.parse_args()
+
+    gateway = MockGateway(args.secret, f'http://{args.host}:{args.port}',
+                          parse_range(args.order_latency_ms), parse_range(args.latency_ms),
+                          max(args.duplicates, 1), args.fail_rate, args.auto_pay, args.retries)
+    create_gateway_app(gateway).run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -52,7 +52,7 @@ class User(db.Model):
     user_type = db.Column(db.String(20), nullable=False)
     campus_id = db.Column(db.Integer, db.ForeignKey('campus.id'))
     status = db.Column(db.String(20), default='active')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # 关系
@@ -182,6 +182,39 @@ class Table(db.Model):
             'campus': self.campus.to_dict() if self.campus else None
         }
 
+# 系列预约模型（每周固定时间的多次课程，创建时一次性预付）
+class BookingSeries(db.Model):
+    __tablename__ = 'booking_series'
+
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    coach_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    campus_id = db.Column(db.Integer, db.ForeignKey('campus.id'), nullable=False)
+    table_id = db.Column(db.Integer, db.ForeignKey('tables.id'))
+    weekday = db.Column(db.SmallInteger, nullable=False)
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+    first_date = db.Column(db.Date, nullable=False)
+    occurrences = db.Column(db.Integer, nullable=False)
+    total_fee = db.Column(db.Numeric(10, 2), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'student_id': self.student_id,
+            'coach_id': self.coach_id,
+            'campus_id': self.campus_id,
+            'table_id': self.table_id,
+            'weekday': self.weekday,
+            'start_time': self.start_time.isoformat() if self.start_time else None,
+            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'first_date': self.first_date.isoformat() if self.first_date else None,
+            'occurrences': self.occurrences,
+            'total_fee': float(self.total_fee),
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
 # 预约模型
 class Booking(db.Model):
     __tablename__ = 'bookings'
@@ -196,7 +229,8 @@ class Booking(db.Model):
     end_time = db.Column(db.Time, nullable=False)
     lesson_fee = db.Column(db.Numeric(10, 2), nullable=False)
     status = db.Column(db.String(20), default='pending')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    series_id = db.Column(db.Integer, db.ForeignKey('booking_series.id'), index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     confirm_time = db.Column(db.DateTime)
 
     # 关系
@@ -204,6 +238,7 @@ class Booking(db.Model):
     coach = db.relationship('User', foreign_keys=[coach_id])
     campus = db.relationship('Campus', backref='bookings')
     table = db.relationship('Table', backref='bookings')
+    series = db.relationship('BookingSeries', backref='bookings')
 
     def to_dict(self):
         return {
@@ -217,6 +252,7 @@ class Booking(db.Model):
             'end_time': self.end_time.isoformat() if self.end_time else None,
             'lesson_fee': float(self.lesson_fee),
             'status': self.status,
+            'series_id': self.series_id,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'confirm_time': self.confirm_time.isoformat() if self.confirm_time else None,
             'student': self.student.to_dict() if self.student else None,
@@ -224,13 +260,157 @@ class Booking(db.Model):
             'table': self.table.to_dict() if self.table else None
         }
 
-# 账户模型
+# 球台时间片占用模型（唯一约束保证同一球台同一时间片只能被一个预约占用）
+class TableSlot(db.Model):
+    __tablename__ = 'table_slots'
+    __table_args__ = (
+        db.UniqueConstraint('table_id', 'slot_date', 'slot', name='unique_table_slot'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    table_id = db.Column(db.Integer, db.ForeignKey('tables.id', ondelete='CASCADE'), nullable=False)
+    slot_date = db.Column(db.Date, nullable=False)
+    slot = db.Column(db.SmallInteger, nullable=False)
+    booking_id = db.Column(db.Integer, db.ForeignKey('bookings.id', ondelete='CASCADE'), index=True)
+    hold_id = db.Column(db.Integer, db.ForeignKey('slot_holds.id', ondelete='CASCADE'), index=True)
+
+# 用户时间片占用模型（教练和学员同一时间片只能有一个预约，教练请假时段由 block_id 占用）
+class UserSlot(db.Model):
+    __tablename__ = 'user_slots'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'slot_date', 'slot', name='unique_user_slot'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    slot_date = db.Column(db.Date, nullable=False)
+    slot = db.Column(db.SmallInteger, nullable=False)
+    booking_id = db.Column(db.Integer, db.ForeignKey('bookings.id', ondelete='CASCADE'), index=True)
+    hold_id = db.Column(db.Integer, db.ForeignKey('slot_holds.id', ondelete='CASCADE'), index=True)
+    block_id = db.Column(db.Integer, db.ForeignKey('coach_blockouts.id', ondelete='CASCADE'), index=True)
+
+# 时间片保留模型（预约向导中短时间锁定教练、学员和球台的时间段）
+class SlotHold(db.Model):
+    __tablename__ = 'slot_holds'
+
+    id = db.Column(db.Integer, primary_key=True)
+    token = db.Column(db.String(64), unique=True, nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    coach_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    campus_id = db.Column(db.Integer, db.ForeignKey('campus.id'), nullable=False)
+    table_id = db.Column(db.Integer, db.ForeignKey('tables.id'))
+    booking_date = db.Column(db.Date, nullable=False)
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'token': self.token,
+            'student_id': self.student_id,
+            'coach_id': self.coach_id,
+            'campus_id': self.campus_id,
+            'table_id': self.table_id,
+            'booking_date': self.booking_date.isoformat() if self.booking_date else None,
+            'start_time': self.start_time.isoformat() if self.start_time else None,
+            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None
+        }
+
+# 候补模型（教练某天某时间窗口已约满时排队，有预约取消后按先后顺序自动转为预约）
+class WaitlistEntry(db.Model):
+    __tablename__ = 'booking_waitlist'
+    __table_args__ = (
+        db.Index('idx_waitlist_coach_date', 'coach_id', 'booking_date', 'status'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    coach_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    campus_id = db.Column(db.Integer, db.ForeignKey('campus.id'), nullable=False)
+    booking_date = db.Column(db.Date, nullable=False)
+    window_start = db.Column(db.Time, nullable=False)
+    window_end = db.Column(db.Time, nullable=False)
+    duration_minutes = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.Enum('waiting', 'promoted', 'cancelled'), default='waiting')
+    booking_id = db.Column(db.Integer, db.ForeignKey('bookings.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    promoted_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'student_id': self.student_id,
+            'coach_id': self.coach_id,
+            'campus_id': self.campus_id,
+            'booking_date': self.booking_date.isoformat() if self.booking_date else None,
+            'window_start': self.window_start.isoformat() if self.window_start else None,
+            'window_end': self.window_end.isoformat() if self.window_end else None,
+            'duration_minutes': self.duration_minutes,
+            'status': self.status,
+            'booking_id': self.booking_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'promoted_at': self.promoted_at.isoformat() if self.promoted_at else None
+        }
+
+# 教练请假模型（日期范围内每天 start_time 至 end_time 不可预约，创建时取消并退款重叠的预约）
+class CoachBlockout(db.Model):
+    __tablename__ = 'coach_blockouts'
+
+    id = db.Column(db.Integer, primary_key=True)
+    coach_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    campus_id = db.Column(db.Integer, db.ForeignKey('campus.id'))
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False)
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+    reason = db.Column(db.String(255))
+    status = db.Column(db.Enum('active', 'lifted'), default='active')
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('idx_blockout_coach_date', 'coach_id', 'start_date', 'end_date'),
+    )
+
+    coach = db.relationship('User', foreign_keys=[coach_id])
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'coach_id': self.coach_id,
+            'coach_name': self.coach.real_name if self.coach else None,
+            'campus_id': self.campus_id,
+            'start_date': self.start_date.isoformat() if self.start_date else None,
+            'end_date': self.end_date.isoformat() if self.end_date else None,
+            'start_time': self.start_time.isoformat() if self.start_time else None,
+            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'reason': self.reason,
+            'status': self.status,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+# 请假取消的预约（记录每个被取消的预约及其退款状态，退款分批进行，中断后可继续）
+class BlockoutCancellation(db.Model):
+    __tablename__ = 'blockout_cancellations'
+
+    id = db.Column(db.Integer, primary_key=True)
+    blockout_id = db.Column(db.Integer, db.ForeignKey('coach_blockouts.id', ondelete='CASCADE'), nullable=False, index=True)
+    booking_id = db.Column(db.Integer, db.ForeignKey('bookings.id', ondelete='CASCADE'), nullable=False, unique=True)
+    refund_status = db.Column(db.Enum('none', 'pending', 'refunded'), default='none')  # none 表示无需退款
+
+# 账户模型（balance 为余额快照，只包含 id 不超过 ledger_position 的交易，实时余额见 current_balance；
+# 升级前创建的账户 snapshot_at 为空，需先运行 flask upgrade-ledger）
 class Account(db.Model):
     __tablename__ = 'accounts'
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), unique=True, nullable=False)
     balance = db.Column(db.Numeric(10, 2), default=0.00)
+    ledger_position = db.Column(db.Integer, nullable=False, default=0)
+    snapshot_at = db.Column(db.DateTime, default=datetime.utcnow)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -238,7 +418,7 @@ class Account(db.Model):
         return {
             'id': self.id,
             'user_id': self.user_id,
-            'balance': float(self.balance),
+            'balance': float(self.current_balance),
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
@@ -254,7 +434,7 @@ class Transaction(db.Model):
     status = db.Column(db.Enum('pending', 'completed', 'failed'), default='completed')
     description = db.Column(db.String(255))
     related_booking_id = db.Column(db.Integer, db.ForeignKey('bookings.id'))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
     # 关系
     user = db.relationship('User', backref='transactions')
@@ -273,6 +453,123 @@ class Transaction(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+# 交易对余额的影响：扣款为负，充值和退款为正
+signed_amount = db.case(
+    (Transaction.transaction_type == 'withdraw', -Transaction.amount),
+    else_=Transaction.amount
+)
+
+# 实时余额 = 余额快照 + 快照之后已完成交易的合计
+Account.current_balance = db.column_property(
+    Account.balance + db.func.coalesce(
+        db.select(db.func.sum(signed_amount)).where(
+            Transaction.user_id == Account.user_id,
+            Transaction.id > Account.ledger_position,
+            Transaction.status == 'completed'
+        ).correlate_except(Transaction).scalar_subquery(),
+        0
+    )
+)
+
+# 对账记录模型（每次核对余额快照与交易流水的运行结果，增量对账从上一次完成的水位继续）
+class ReconciliationRun(db.Model):
+    __tablename__ = 'reconciliation_runs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    mode = db.Column(db.Enum('full', 'incremental'), nullable=False)
+    status = db.Column(db.Enum('running', 'completed', 'failed'), default='running')
+    transaction_watermark = db.Column(db.Integer, nullable=False, default=0)  # 本次核对的最大交易 id
+    accounts_checked = db.Column(db.Integer, default=0)
+    mismatch_count = db.Column(db.Integer, default=0)
+    report_path = db.Column(db.String(255))
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'mode': self.mode,
+            'status': self.status,
+            'transaction_watermark': self.transaction_watermark,
+            'accounts_checked': self.accounts_checked,
+            'mismatch_count': self.mismatch_count,
+            'report_path': self.report_path,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+# 每日收支汇总模型（按日期、校区、交易类型和支付方式累计已完成交易，校区为 0 表示用户未分配校区）
+class PaymentDailyStat(db.Model):
+    __tablename__ = 'payment_daily_stats'
+    __table_args__ = (
+        db.UniqueConstraint('stat_date', 'campus_id', 'transaction_type', 'payment_method', name='unique_daily_stat'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    stat_date = db.Column(db.Date, nullable=False)
+    campus_id = db.Column(db.Integer, nullable=False, default=0, index=True)
+    transaction_type = db.Column(db.Enum('deposit', 'withdraw', 'refund'), nullable=False)
+    payment_method = db.Column(db.Enum('wechat', 'alipay', 'offline', 'system'), nullable=False)
+    total_amount = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    transaction_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# 汇总水位模型（记录各汇总任务已处理到的最大交易 id）
+class AggregateWatermark(db.Model):
+    __tablename__ = 'aggregate_watermarks'
+
+    name = db.Column(db.String(50), primary_key=True)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# 交易归档模型（整月的旧交易移到磁盘上的压缩文件，交易表只保留之后的月份）
+class TransactionArchive(db.Model):
+    __tablename__ = 'transaction_archives'
+
+    id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Date, unique=True, nullable=False)  # 归档月份的第一天
+    file_path = db.Column(db.String(255), nullable=False)
+    file_size = db.Column(db.BigInteger, nullable=False)
+    checksum = db.Column(db.String(64), nullable=False)      # 文件的 SHA-256
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+    first_transaction_id = db.Column(db.Integer)
+    last_transaction_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    segments = db.relationship('TransactionArchiveSegment', backref='archive', cascade='all, delete-orphan')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'month': self.month.strftime('%Y-%m') if self.month else None,
+            'file_path': self.file_path,
+            'file_size': self.file_size,
+            'checksum': self.checksum,
+            'row_count': self.row_count,
+            'first_transaction_id': self.first_transaction_id,
+            'last_transaction_id': self.last_transaction_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+# 交易归档分段模型（归档文件中每个用户的交易是一段独立的 gzip 数据，按偏移量直接读取）
+class TransactionArchiveSegment(db.Model):
+    __tablename__ = 'transaction_archive_segments'
+    __table_args__ = (
+        db.UniqueConstraint('archive_id', 'user_id', name='unique_archive_user'),
+        db.Index('idx_segment_user', 'user_id', 'archive_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    archive_id = db.Column(db.Integer, db.ForeignKey('transaction_archives.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    byte_offset = db.Column(db.BigInteger, nullable=False)
+    byte_length = db.Column(db.Integer, nullable=False)
+    row_count = db.Column(db.Integer, nullable=False)
+    deposit_count = db.Column(db.Integer, nullable=False, default=0)
+    withdraw_count = db.Column(db.Integer, nullable=False, default=0)
+    refund_count = db.Column(db.Integer, nullable=False, default=0)
+    net_amount = db.Column(db.Numeric(12, 2), nullable=False, default=0)  # 已完成交易对余额的影响合计，对账时计入
+
 # 比赛模型
 class Match(db.Model):
     __tablename__ = 'matches'
@@ -283,7 +580,8 @@ class Match(db.Model):
     registration_start = db.Column(db.DateTime, nullable=False)
     registration_end = db.Column(db.DateTime, nullable=False)
     registration_fee = db.Column(db.Numeric(10, 2), default=30.00)
-    status = db.Column(db.Enum('upcoming', 'registration', 'ongoing', 'completed'), default='upcoming')
+    campus_id = db.Column(db.Integer, db.ForeignKey('campus.id'), index=True)
+    status = db.Column(db.Enum('upcoming', 'registration', 'ongoing', 'completed', 'cancelled'), default='upcoming')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def to_dict(self):
@@ -294,6 +592,7 @@ class Match(db.Model):
             'registration_start': self.registration_start.isoformat() if self.registration_start else None,
             'registration_end': self.registration_end.isoformat() if self.registration_end else None,
             'registration_fee': float(self.registration_fee),
+            'campus_id': self.campus_id,
             'status': self.status,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
@@ -307,7 +606,7 @@ class MatchRegistration(db.Model):
     student_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     group_name = db.Column(db.Enum('group_a', 'group_b', 'group_c'), nullable=False)
     registration_time = db.Column(db.DateTime, default=datetime.utcnow)
-    payment_status = db.Column(db.Enum('pending', 'paid'), default='pending')
+    payment_status = db.Column(db.Enum('pending', 'paid', 'refunded'), default='pending')
 
     # 关系
     match = db.relationship('Match', backref='registrations')
@@ -357,6 +656,62 @@ class Evaluation(db.Model):
             'evaluated': self.evaluated.to_dict() if self.evaluated else None
         }
 
+# 取消次数限制模型（按用户、月份累计取消次数）
+class CancellationLimit(db.Model):
+    __tablename__ = 'cancellation_limits'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'year_month', name='unique_user_month'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    year_month = db.Column(db.String(7), nullable=False, index=True)  # 格式: YYYY-MM
+    cancellation_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'year_month': self.year_month,
+            'cancellation_count': self.cancellation_count
+        }
+
+# 幂等键模型（保存带 Idempotency-Key 请求的指纹和成功响应，重放时直接返回，过期后清理）
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'idempotency_key', name='unique_user_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    idempotency_key = db.Column(db.String(64), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)  # 请求方法、路径和请求体的 SHA-256
+    status_code = db.Column(db.Integer)                     # 为空表示请求仍在处理中
+    response_body = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+# 支付网关回调模型（回调只落库不处理，由后台任务批量入账；notify_id 唯一，重复投递的回调只保存一次）
+class GatewayCallback(db.Model):
+    __tablename__ = 'gateway_callbacks'
+    __table_args__ = (
+        db.Index('idx_callback_result', 'result', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    notify_id = db.Column(db.String(64), unique=True, nullable=False)
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transactions.id'), nullable=False)
+    gateway_trade_no = db.Column(db.String(64))
+    trade_status = db.Column(db.Enum('success', 'failed'), nullable=False)
+    amount = db.Column(db.Numeric(10, 2), nullable=False)
+    payload = db.Column(db.Text)
+    # pending 待处理；credited 已入账；failed 支付失败；ignored 交易已处理过；rejected 与订单不符
+    result = db.Column(db.Enum('pending', 'credited', 'failed', 'ignored', 'rejected'), default='pending')
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
+
 # 系统日志模型
 class SystemLog(db.Model):
     __tablename__ = 'system_logs'
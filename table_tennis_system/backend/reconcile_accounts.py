@@ -0,0 +1,35 @@
+"""核对账户余额与交易流水
+
+用法（在 backend 目录下）:
+    python reconcile_accounts.py                 # 全量对账
+    python reconcile_accounts.py --incremental   # 只核对上次对账后有变化的账户
+    python reconcile_accounts.py --workers 8 --chunk-size 5000
+
+差异写入 RECONCILIATION_REPORT_DIR 下的 CSV 报告；发现差异时以退出码 1 结束，便于定时任务告警。
+"""
+import argparse
+import sys
+
+from app import create_app
+from utils.reconciliation import reconcile_accounts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='核对账户余额与交易流水')
+    parser.add_argument('--incremental', action='store_true', help='只核对上次对账之后有变化的账户')
+    parser.add_argument('--workers', type=int, help='并行工作线程数')
+    parser.add_argument('--chunk-size', type=int, help='每个任务覆盖的账户数')
+    args = parser.parse_args()
+
+    app = create_app({'BACKGROUND_JOBS_ENABLED': False})
+    with app.app_context():
+        run = reconcile_accounts(incremental=args.incremental, workers=args.workers, chunk_size=args.chunk_size)
+        elapsed = (run.finished_at - run.started_at).total_seconds()
+        print(f'对账模式: {run.mode}, 交易水位: {run.transaction_watermark}')
+        print(f'核对账户: {run.accounts_checked}, 差异: {run.mismatch_count}, 耗时: {elapsed:.1f}s')
+        print(f'报告: {run.report_path}')
+        return 1 if run.mismatch_count else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
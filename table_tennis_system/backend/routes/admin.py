@@ -0,0 +1,89 @@
+from flask import Blueprint, Response, current_app, request, stream_with_context
+from utils.auth import require_auth, log_action, success_response, error_response
+from utils.scheduler import scheduler
+from utils.export import (EXPORT_FORMATS, booking_export_query, transaction_export_query,
+                          user_export_query, stream_export)
+from utils.transaction_archive import hot_start
+from datetime import datetime
+
+admin_bp = Blueprint('admin', __name__, url_prefix='/api/admin')
+
+@admin_bp.route('/jobs', methods=['GET'])
+@require_auth(['super_admin'])
+def get_jobs(current_user):
+    """获取后台任务运行状态"""
+    try:
+        return success_response(scheduler.status())
+    except Exception as e:
+        return error_response(f'获取后台任务状态失败: {str(e)}')
+
+@admin_bp.route('/jobs/<name>/run', methods=['POST'])
+@require_auth(['super_admin'])
+def run_job(current_user, name):
+    """立即执行一次后台任务"""
+    try:
+        job = scheduler.run(current_app._get_current_object(), name)
+        if job is None:
+            return error_response('任务不存在', 404)
+
+        log_action(current_user.id, 'run_job', f'手动执行后台任务: {name}')
+
+        if job.last_error:
+            return error_response(f'任务执行失败: {job.last_error}')
+        return success_response(job.to_dict(), '任务已执行')
+
+    except Exception as e:
+        return error_response(f'执行后台任务失败: {str(e)}')
+
+@admin_bp.route('/export/<resource>', methods=['GET'])
+@require_auth(['campus_admin', 'super_admin'])
+def export_data(current_user, resource):
+    """流式导出预约、交易或用户数据（CSV 或 NDJSON）"""
+    try:
+        fmt = request.args.get('format', 'csv')
+        if fmt not in EXPORT_FORMATS:
+            return error_response('不支持的导出格式')
+
+        # 校区管理员只能导出自己校区的数据
+        if current_user.user_type == 'campus_admin':
+            campus_id = current_user.campus_id
+        else:
+            campus_id = request.args.get('campus_id', type=int)
+
+        # 起止日期都包含在内
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        try:
+            start_date = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else None
+            end_date = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else None
+        except ValueError:
+            return error_response('日期格式错误，应为YYYY-MM-DD')
+        if start_date and end_date and start_date > end_date:
+            return error_response('开始日期不能晚于结束日期')
+
+        if resource == 'bookings':
+            stmt = booking_export_query(campus_id, request.args.get('status'), start_date, end_date)
+        elif resource == 'transactions':
+            # 已归档的月份不在交易表中，导出范围不能早于交易表保留的第一天
+            boundary = hot_start()
+            if boundary and (not start_date or start_date < boundary):
+                return error_response(f'{boundary.isoformat()} 之前的交易已归档，无法导出，'
+                                      f'请将开始日期设为 {boundary.isoformat()} 或之后')
+            stmt = transaction_export_query(campus_id, request.args.get('type'), start_date, end_date)
+        elif resource == 'users':
+            stmt = user_export_query(campus_id, request.args.get('user_type'), request.args.get('status'))
+        else:
+            return error_response('不支持的导出类型', 404)
+
+        log_action(current_user.id, 'export_data', f'导出数据: {resource}.{fmt}', request.remote_addr)
+
+        filename = f'{resource}_{datetime.now().strftime("%Y%m%d%H%M%S")}.{fmt}'
+        chunks = stream_export(stmt, fmt, current_app.config['EXPORT_BATCH_SIZE'])
+        return Response(
+            stream_with_context(chunks),
+            content_type=EXPORT_FORMATS[fmt],
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+
+    except Exception as e:
+        return error_response(f'导出数据失败: {str(e)}')
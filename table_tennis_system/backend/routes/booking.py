@@ -1,12 +1,123 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, make_response
 from flask_jwt_extended import jwt_required
-from models import Booking, Table, CoachStudentRelation, Account, Transaction, User, db
-from utils.auth import require_auth, log_action, success_response, error_response, paginate_query
+from models import Booking, BookingSeries, SlotHold, WaitlistEntry, CoachBlockout, Table, CoachStudentRelation, Account, Transaction, User, db
+from utils.auth import require_auth, log_action, success_response, error_response, paginate_query, paginate_request
+from utils.table_index import table_index, to_seconds
+from utils.slot_bitmap import build_busy_masks, find_free_starts, interval_mask, hours_mask, popcount
+from utils.occupancy import (SlotConflict, occupy_slots, release_slots, claim_status, transfer_hold_slots,
+                             on_slot_boundary, slot_boundary_error)
+from utils.slot_holds import HoldError, create_hold, find_hold, release_hold, occupy_reclaiming, holds_released
+from utils.blockouts import (DAY_START, DAY_END, overlapping_blockouts, blocked_dates, blockout_busy_rows,
+                             apply_blockout, refund_blockout, lift_blockout)
+from utils.schedule_cache import schedule_cache
+from utils.booking_events import booking_changed, bookings_changed
+from utils.cancel_limits import cancel_limiter, current_year_month
+from utils.accounts import InsufficientBalance, debit, credit, ensure_ledger_migrated
+from utils.idempotency import idempotent
+from utils.table_allocator import assign_table, repack_campus_day
 from datetime import datetime, date, time, timedelta
-from sqlalchemy import and_, or_
+from decimal import Decimal
+from sqlalchemy import and_, or_, insert
 
 booking_bp = Blueprint('booking', __name__, url_prefix='/api/booking')
 
+def calculate_lesson_fee(coach, start_time_obj, end_time_obj):
+    """按教练课时费和课程时长计算费用"""
+    start_datetime = datetime.combine(date.today(), start_time_obj)
+    end_datetime = datetime.combine(date.today(), end_time_obj)
+    duration_hours = (end_datetime - start_datetime).total_seconds() / 3600
+    return float(coach.coach_profile.hourly_rate) * duration_hours
+
+def promote_waitlist(freed):
+    """预约取消后，在同一事务中按候补先后顺序把能放进空出时间段的候补转为已确认预约并扣费
+
+    候补按加入顺序依次排在空出时间段内，余额不足、师生关系失效或本人时间冲突的候补会被跳过。
+    返回新建的预约列表，调用方提交后负责同步索引和记录日志。
+    """
+    if datetime.combine(freed.booking_date, freed.start_time) <= datetime.now():
+        return []
+
+    entries = WaitlistEntry.query.filter(
+        WaitlistEntry.coach_id == freed.coach_id,
+        WaitlistEntry.booking_date == freed.booking_date,
+        WaitlistEntry.status == 'waiting',
+        WaitlistEntry.window_start < freed.end_time,
+        WaitlistEntry.window_end > freed.start_time
+    ).order_by(WaitlistEntry.id).limit(
+        current_app.config['WAITLIST_PROMOTE_SCAN']).with_for_update().all()
+
+    coach = freed.coach
+    cursor, freed_end = to_seconds(freed.start_time), to_seconds(freed.end_time)
+    slot_seconds = current_app.config['OCCUPANCY_SLOT_MINUTES'] * 60
+    promoted = []
+    for entry in entries:
+        # 升级前的预约可能未对齐时间片，转正的预约从下一个时间片边界开始
+        start = -(-max(cursor, to_seconds(entry.window_start)) // slot_seconds) * slot_seconds
+        end = start + entry.duration_minutes * 60
+        if end > min(freed_end, to_seconds(entry.window_end)):
+            continue
+
+        relation = CoachStudentRelation.query.filter_by(
+            student_id=entry.student_id,
+            coach_id=entry.coach_id,
+            status='approved'
+        ).first()
+        if not relation:
+            continue
+
+        start_time_obj = time(start // 3600, start % 3600 // 60)
+        end_time_obj = time(end // 3600, end % 3600 // 60)
+        lesson_fee = Decimal(str(round(calculate_lesson_fee(coach, start_time_obj, end_time_obj), 2)))
+
+        # 候补学员本人在该时间段已有其他预约或余额不足时跳过
+        try:
+            with db.session.begin_nested():
+                booking = Booking(
+                    student_id=entry.student_id,
+                    coach_id=entry.coach_id,
+                    campus_id=entry.campus_id,
+                    booking_date=entry.booking_date,
+                    start_time=start_time_obj,
+                    end_time=end_time_obj,
+                    lesson_fee=lesson_fee,
+                    status='confirmed',
+                    confirm_time=datetime.utcnow()
+                )
+                db.session.add(booking)
+                db.session.flush()
+                occupy_slots(booking)
+                debit(entry.student_id, lesson_fee, f'课时费扣除 - 教练: {coach.real_name} (候补转正)',
+                      related_booking_id=booking.id)
+        except (SlotConflict, InsufficientBalance):
+            continue
+
+        # 优先使用被取消预约空出的球台（内存索引要在提交后才同步）
+        try:
+            with db.session.begin_nested():
+                booking.table_id = freed.table_id
+                db.session.flush()
+                occupy_slots(booking, schedule=False)
+        except SlotConflict:
+            booking.table_id = None
+        if not booking.table_id:
+            assign_table(booking)
+
+        entry.status = 'promoted'
+        entry.booking_id = booking.id
+        entry.promoted_at = datetime.utcnow()
+        promoted.append(booking)
+        cursor = end
+
+    return promoted
+
+def waitlist_promoted(promoted):
+    """候补转正提交后同步索引并记录日志"""
+    for booking in promoted:
+        booking_changed(booking)
+        log_action(booking.student_id, 'waitlist_promoted',
+                  f'候补转为预约: 教练{booking.coach.real_name}, 日期{booking.booking_date}, '
+                  f'时间{booking.start_time}-{booking.end_time}')
+
 @booking_bp.route('/tables', methods=['GET'])
 @require_auth(['student', 'coach'])
 def get_available_tables(current_user):
@@ -20,34 +131,18 @@ def get_available_tables(current_user):
         if not all([campus_id, booking_date, start_time, end_time]):
             return error_response('校区、日期和时间段为必填项')
 
-        # 获取所有球台
-        all_tables = Table.query.filter_by(
-            campus_id=campus_id,
-            status='available'
-        ).all()
-
-        # 检查时间段冲突的预约
-        occupied_tables = db.session.query(Booking.table_id).filter(
-            and_(
-                Booking.booking_date == booking_date,
-                Booking.status.in_(['pending', 'confirmed']),
-                or_(
-                    and_(Booking.start_time <= start_time, Booking.end_time > start_time),
-                    and_(Booking.start_time < end_time, Booking.end_time >= end_time),
-                    and_(Booking.start_time >= start_time, Booking.end_time <= end_time)
-                )
-            )
-        ).all()
+        booking_date_obj = datetime.strptime(booking_date, '%Y-%m-%d').date()
+        start_time_obj = datetime.strptime(start_time, '%H:%M:%S').time()
+        end_time_obj = datetime.strptime(end_time, '%H:%M:%S').time()
 
-        occupied_table_ids = [table[0] for table in occupied_tables if table[0]]
+        if start_time_obj >= end_time_obj:
+            return error_response('结束时间必须晚于开始时间')
 
-        # 过滤可用球台
-        available_tables = [
-            table for table in all_tables
-            if table.id not in occupied_table_ids
-        ]
+        # 从内存占用索引中查询空闲球台
+        available_tables = table_index.free_tables(
+            campus_id, booking_date_obj, start_time_obj, end_time_obj)
 
-        return success_response([table.to_dict() for table in available_tables])
+        return success_response(available_tables)
 
     except Exception as e:
         return error_response(f'获取可用球台失败: {str(e)}')
@@ -60,51 +155,348 @@ def get_coach_schedule(current_user, coach_id):
         start_date = request.args.get('start_date', date.today().isoformat())
         end_date = request.args.get('end_date', (date.today() + timedelta(days=7)).isoformat())
 
-        # 获取教练的预约记录
-        bookings = Booking.query.filter(
-            and_(
-                Booking.coach_id == coach_id,
-                Booking.booking_date >= start_date,
-                Booking.booking_date <= end_date,
-                Booking.status.in_(['pending', 'confirmed'])
-            )
-        ).order_by(Booking.booking_date, Booking.start_time).all()
-
-        # 按日期组织课表
-        schedule = {}
-        current_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+        start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date()
         end_date_obj = datetime.strptime(end_date, '%Y-%m-%d').date()
 
-        while current_date <= end_date_obj:
-            date_str = current_date.isoformat()
-            schedule[date_str] = []
+        if start_date_obj > end_date_obj:
+            return error_response('结束日期必须晚于开始日期')
+        if (end_date_obj - start_date_obj).days >= current_app.config['SCHEDULE_MAX_DAYS']:
+            return error_response(f'查询范围不能超过{current_app.config["SCHEDULE_MAX_DAYS"]}天')
 
-            # 添加该日期的预约
-            for booking in bookings:
-                if booking.booking_date == current_date:
-                    schedule[date_str].append({
-                        'booking_id': booking.id,
-                        'start_time': booking.start_time.isoformat(),
-                        'end_time': booking.end_time.isoformat(),
-                        'status': booking.status,
-                        'student_name': booking.student.real_name if booking.student else None,
-                        'table_number': booking.table.table_number if booking.table else None
-                    })
+        # 从按周物化的课表缓存中读取，未命中的周一次查询加载
+        schedule, etag = schedule_cache.get_range(coach_id, start_date_obj, end_date_obj)
 
-            current_date += timedelta(days=1)
+        # 课表未变化时返回 304
+        if etag in request.if_none_match:
+            response = make_response('', 304)
+            response.set_etag(etag)
+            return response
 
-        return success_response({
+        response = success_response({
             'coach_id': coach_id,
             'schedule': schedule
         })
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
 
     except Exception as e:
         return error_response(f'获取教练课表失败: {str(e)}')
 
+@booking_bp.route('/free-slots/<int:coach_id>', methods=['GET'])
+@require_auth(['student', 'coach'])
+def get_coach_free_slots(current_user, coach_id):
+    """查询教练在日期范围内所有可预约的开始时间"""
+    try:
+        tomorrow = date.today() + timedelta(days=1)
+        start_date = request.args.get('from', tomorrow.isoformat())
+        end_date = request.args.get('to', (tomorrow + timedelta(days=13)).isoformat())
+        duration = request.args.get('duration', 60, type=int)
+        slot_minutes = request.args.get('slot', current_app.config['BOOKING_SLOT_MINUTES'], type=int)
+        # 学员默认同时排除自己已有的预约
+        include_self = request.args.get('include_self', 'true').lower() != 'false'
+
+        if slot_minutes not in (15, 30):
+            return error_response('时间片粒度只能是15或30分钟')
+        if not duration or duration <= 0:
+            return error_response('课程时长必须大于0')
+        if duration % current_app.config['OCCUPANCY_SLOT_MINUTES']:
+            return error_response(f'课程时长必须是{current_app.config["OCCUPANCY_SLOT_MINUTES"]}分钟的整数倍')
+
+        start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date()
+        end_date_obj = datetime.strptime(end_date, '%Y-%m-%d').date()
+
+        # 预约日期不能是今天或过去日期
+        start_date_obj = max(start_date_obj, tomorrow)
+        if start_date_obj > end_date_obj:
+            return error_response('结束日期必须晚于开始日期')
+        if (end_date_obj - start_date_obj).days >= current_app.config['FREE_SLOT_MAX_DAYS']:
+            return error_response(f'查询范围不能超过{current_app.config["FREE_SLOT_MAX_DAYS"]}天')
+
+        coach = User.query.filter_by(id=coach_id, user_type='coach').first()
+        if not coach:
+            return error_response('教练不存在', 404)
+
+        # 与创建预约的冲突检查一致：教练或学员本人的待确认、已确认预约均视为占用
+        owner_filter = Booking.coach_id == coach_id
+        if include_self and current_user.user_type == 'student':
+            owner_filter = or_(owner_filter, Booking.student_id == current_user.id)
+
+        rows = db.session.query(
+            Booking.booking_date, Booking.start_time, Booking.end_time
+        ).filter(
+            owner_filter,
+            Booking.booking_date >= start_date_obj,
+            Booking.booking_date <= end_date_obj,
+            Booking.status.in_(['pending', 'confirmed'])
+        ).all()
+
+        # 其他学员正在预约向导中保留的时间段同样视为占用
+        hold_filter = SlotHold.coach_id == coach_id
+        if include_self and current_user.user_type == 'student':
+            hold_filter = or_(hold_filter, SlotHold.student_id == current_user.id)
+        rows += db.session.query(
+            SlotHold.booking_date, SlotHold.start_time, SlotHold.end_time
+        ).filter(
+            hold_filter,
+            SlotHold.booking_date >= start_date_obj,
+            SlotHold.booking_date <= end_date_obj,
+            SlotHold.expires_at > datetime.utcnow()
+        ).all()
+
+        # 教练请假时段不可预约
+        rows += blockout_busy_rows(coach_id, start_date_obj, end_date_obj)
+
+        busy_masks = build_busy_masks(rows, slot_minutes)
+        free_starts = find_free_starts(
+            busy_masks, start_date_obj, end_date_obj, duration, slot_minutes,
+            current_app.config['BOOKING_OPEN_HOUR'], current_app.config['BOOKING_CLOSE_HOUR'])
+
+        return success_response({
+            'coach_id': coach_id,
+            'duration': duration,
+            'slot_minutes': slot_minutes,
+            'slots': {
+                day.isoformat(): [start.isoformat() for start in starts]
+                for day, starts in free_starts.items()
+            }
+        })
+
+    except ValueError:
+        return error_response('日期格式错误，应为YYYY-MM-DD')
+    except Exception as e:
+        return error_response(f'获取空闲时间失败: {str(e)}')
+
+@booking_bp.route('/hold', methods=['POST'])
+@require_auth(['student'])
+def create_slot_hold(current_user):
+    """短时间保留教练、球台和时间段，返回创建预约时使用的保留令牌"""
+    try:
+        data = request.get_json()
+        coach_id = data.get('coach_id')
+        booking_date = data.get('date')
+        start_time = data.get('start_time')
+        end_time = data.get('end_time')
+        table_id = data.get('table_id')
+
+        if not all([coach_id, booking_date, start_time, end_time]):
+            return error_response('教练、日期、开始时间和结束时间为必填项')
+
+        relation = CoachStudentRelation.query.filter_by(
+            student_id=current_user.id,
+            coach_id=coach_id,
+            status='approved'
+        ).first()
+        if not relation:
+            return error_response('您还未选择该教练，请先建立师生关系')
+
+        booking_date_obj = datetime.strptime(booking_date, '%Y-%m-%d').date()
+        if booking_date_obj <= date.today():
+            return error_response('预约日期不能是今天或过去日期')
+
+        start_time_obj = datetime.strptime(start_time, '%H:%M:%S').time()
+        end_time_obj = datetime.strptime(end_time, '%H:%M:%S').time()
+        if start_time_obj >= end_time_obj:
+            return error_response('结束时间必须晚于开始时间')
+        if not on_slot_boundary(start_time_obj, end_time_obj):
+            return error_response(slot_boundary_error())
+
+        coach = User.query.get(coach_id)
+        if not coach or not coach.coach_profile:
+            return error_response('教练信息不存在')
+
+        if table_id and not Table.query.get(table_id):
+            return error_response('球台不存在')
+
+        if blocked_dates(coach.id, [booking_date_obj], start_time_obj, end_time_obj):
+            return error_response('教练该时间段请假，不可预约')
+
+        active_holds = SlotHold.query.filter(
+            SlotHold.student_id == current_user.id,
+            SlotHold.expires_at > datetime.utcnow()
+        ).count()
+        if active_holds >= current_app.config['SLOT_HOLD_MAX_ACTIVE']:
+            return error_response('保留的时间段过多，请先完成或释放已有保留')
+
+        # 时间片占用表的唯一键负责冲突检查，与尚未回收的过期保留冲突时自动回收
+        try:
+            hold = create_hold(current_user.id, coach.id, coach.campus_id, booking_date_obj,
+                               start_time_obj, end_time_obj, table_id)
+        except SlotConflict as conflict:
+            db.session.rollback()
+            if conflict.resource == 'table':
+                return error_response('该球台在此时间段已被占用')
+            return error_response('该时间段已有预约冲突')
+
+        # 未指定球台时同样按首次适配选定一张球台一并保留
+        if not table_id:
+            assign_table(hold)
+
+        db.session.commit()
+        table_index.sync_hold(hold)
+
+        return success_response(hold.to_dict(), '时间段已保留，请在有效期内提交预约')
+
+    except Exception as e:
+        db.session.rollback()
+        return error_response(f'保留时间段失败: {str(e)}')
+
+@booking_bp.route('/hold/<token>', methods=['DELETE'])
+@require_auth(['student'])
+def release_slot_hold(current_user, token):
+    """提前释放时间段保留"""
+    try:
+        try:
+            hold = find_hold(token, current_user.id, lock=True)
+        except HoldError as e:
+            return error_response(str(e), 404)
+
+        release_hold(hold)
+        db.session.commit()
+        table_index.sync_hold(hold, active=False)
+
+        return success_response(None, '保留已释放')
+
+    except Exception as e:
+        db.session.rollback()
+        return error_response(f'释放保留失败: {str(e)}')
+
+@booking_bp.route('/waitlist', methods=['POST'])
+@require_auth(['student'])
+def join_waitlist(current_user):
+    """加入教练某天某时间窗口的候补队列，有预约取消时自动转为已确认预约并扣费"""
+    try:
+        data = request.get_json()
+        coach_id = data.get('coach_id')
+        booking_date = data.get('date')
+        start_time = data.get('start_time')
+        end_time = data.get('end_time')
+
+        if not all([coach_id, booking_date, start_time, end_time]):
+            return error_response('教练、日期、开始时间和结束时间为必填项')
+
+        relation = CoachStudentRelation.query.filter_by(
+            student_id=current_user.id,
+            coach_id=coach_id,
+            status='approved'
+        ).first()
+        if not relation:
+            return error_response('您还未选择该教练，请先建立师生关系')
+
+        booking_date_obj = datetime.strptime(booking_date, '%Y-%m-%d').date()
+        if booking_date_obj <= date.today():
+            return error_response('预约日期不能是今天或过去日期')
+
+        start_time_obj = datetime.strptime(start_time, '%H:%M:%S').time()
+        end_time_obj = datetime.strptime(end_time, '%H:%M:%S').time()
+        if start_time_obj >= end_time_obj:
+            return error_response('结束时间必须晚于开始时间')
+        if not on_slot_boundary(start_time_obj, end_time_obj):
+            return error_response(slot_boundary_error())
+
+        window_minutes = (to_seconds(end_time_obj) - to_seconds(start_time_obj)) // 60
+        duration = int(data.get('duration', window_minutes))
+        if duration <= 0 or duration > window_minutes:
+            return error_response('课程时长必须大于0且不超过时间窗口')
+        if duration % current_app.config['OCCUPANCY_SLOT_MINUTES']:
+            return error_response(f'课程时长必须是{current_app.config["OCCUPANCY_SLOT_MINUTES"]}分钟的整数倍')
+
+        coach = User.query.get(coach_id)
+        if not coach or not coach.coach_profile:
+            return error_response('教练信息不存在')
+
+        if blocked_dates(coach.id, [booking_date_obj], start_time_obj, end_time_obj):
+            return error_response('教练该时间段请假，不可候补')
+
+        existing = WaitlistEntry.query.filter_by(
+            student_id=current_user.id,
+            coach_id=coach_id,
+            booking_date=booking_date_obj,
+            window_start=start_time_obj,
+            window_end=end_time_obj,
+            status='waiting'
+        ).first()
+        if existing:
+            return error_response('您已在该时间段的候补队列中')
+
+        entry = WaitlistEntry(
+            student_id=current_user.id,
+            coach_id=coach.id,
+            campus_id=coach.campus_id,
+            booking_date=booking_date_obj,
+            window_start=start_time_obj,
+            window_end=end_time_obj,
+            duration_minutes=duration
+        )
+        db.session.add(entry)
+        db.session.commit()
+
+        # 排在前面的同日候补数量
+        ahead = WaitlistEntry.query.filter(
+            WaitlistEntry.coach_id == coach.id,
+            WaitlistEntry.booking_date == booking_date_obj,
+            WaitlistEntry.status == 'waiting',
+            WaitlistEntry.window_start < end_time_obj,
+            WaitlistEntry.window_end > start_time_obj,
+            WaitlistEntry.id < entry.id
+        ).count()
+
+        log_action(current_user.id, 'join_waitlist',
+                  f'加入候补: 教练{coach.real_name}, 日期{booking_date}, 时间{start_time}-{end_time}',
+                  request.remote_addr)
+
+        result = entry.to_dict()
+        result['position'] = ahead + 1
+        return success_response(result, '已加入候补队列，有空位时将自动为您预约')
+
+    except Exception as e:
+        db.session.rollback()
+        return error_response(f'加入候补失败: {str(e)}')
+
+@booking_bp.route('/waitlist', methods=['GET'])
+@require_auth(['student'])
+def get_my_waitlist(current_user):
+    """获取我的候补记录"""
+    try:
+        status = request.args.get('status')
+
+        query = WaitlistEntry.query.filter_by(student_id=current_user.id)
+        if status:
+            query = query.filter(WaitlistEntry.status == status)
+        entries = query.order_by(WaitlistEntry.booking_date.desc(), WaitlistEntry.id.desc()).all()
+
+        return success_response([entry.to_dict() for entry in entries])
+
+    except Exception as e:
+        return error_response(f'获取候补记录失败: {str(e)}')
+
+@booking_bp.route('/waitlist/<int:entry_id>', methods=['DELETE'])
+@require_auth(['student'])
+def leave_waitlist(current_user, entry_id):
+    """退出候补队列"""
+    try:
+        # 条件更新，与候补转正并发时只有一个会成功
+        updated = WaitlistEntry.query.filter_by(
+            id=entry_id,
+            student_id=current_user.id,
+            status='waiting'
+        ).update({'status': 'cancelled'}, synchronize_session=False)
+        if not updated:
+            db.session.rollback()
+            return error_response('候补记录不存在或已处理', 404)
+
+        db.session.commit()
+        return success_response(message='已退出候补队列')
+
+    except Exception as e:
+        db.session.rollback()
+        return error_response(f'退出候补失败: {str(e)}')
+
 @booking_bp.route('/create', methods=['POST'])
 @require_auth(['student'])
+@idempotent
 def create_booking(current_user):
-    """创建课程预约"""
+    """创建课程预约（可携带保留令牌 hold_token，直接使用已保留的时间段）"""
     try:
         data = request.get_json()
         coach_id = data.get('coach_id')
@@ -113,6 +505,19 @@ def create_booking(current_user):
         end_time = data.get('end_time')
         table_id = data.get('table_id')
 
+        # 兑换保留：时间段和球台以保留为准，冲突检查已在保留时完成
+        hold = None
+        if data.get('hold_token'):
+            try:
+                hold = find_hold(data['hold_token'], current_user.id, lock=True)
+            except HoldError as e:
+                return error_response(str(e))
+            coach_id = hold.coach_id
+            booking_date = hold.booking_date.isoformat()
+            start_time = hold.start_time.isoformat()
+            end_time = hold.end_time.isoformat()
+            table_id = hold.table_id
+
         # 验证必填字段
         if not all([coach_id, booking_date, start_time, end_time]):
             return error_response('教练、日期、开始时间和结束时间为必填项')
@@ -137,25 +542,24 @@ def create_booking(current_user):
 
         if start_time_obj >= end_time_obj:
             return error_response('结束时间必须晚于开始时间')
+        if not on_slot_boundary(start_time_obj, end_time_obj):
+            return error_response(slot_boundary_error())
 
         # 计算课时费
         coach = User.query.get(coach_id)
         if not coach or not coach.coach_profile:
             return error_response('教练信息不存在')
 
-        # 计算时长（小时）
-        start_datetime = datetime.combine(date.today(), start_time_obj)
-        end_datetime = datetime.combine(date.today(), end_time_obj)
-        duration_hours = (end_datetime - start_datetime).total_seconds() / 3600
-        lesson_fee = float(coach.coach_profile.hourly_rate) * duration_hours
+        lesson_fee = calculate_lesson_fee(coach, start_time_obj, end_time_obj)
 
         # 检查账户余额
         account = Account.query.filter_by(user_id=current_user.id).first()
-        if not account or account.balance < lesson_fee:
-            return error_response(f'账户余额不足，需要{lesson_fee}元，当前余额{account.balance if account else 0}元')
+        ensure_ledger_migrated(account)
+        if not account or account.current_balance < lesson_fee:
+            return error_response(f'账户余额不足，需要{lesson_fee}元，当前余额{account.current_balance if account else 0}元')
 
         # 检查时间冲突
-        existing_booking = Booking.query.filter(
+        existing_booking = None if hold else Booking.query.filter(
             and_(
                 or_(Booking.student_id == current_user.id, Booking.coach_id == coach_id),
                 Booking.booking_date == booking_date,
@@ -171,8 +575,11 @@ def create_booking(current_user):
         if existing_booking:
             return error_response('该时间段已有预约冲突')
 
+        if not hold and blocked_dates(coach.id, [booking_date_obj], start_time_obj, end_time_obj):
+            return error_response('教练该时间段请假，不可预约')
+
         # 验证球台可用性
-        if table_id:
+        if table_id and not hold:
             table = Table.query.get(table_id)
             if not table:
                 return error_response('球台不存在')
@@ -207,7 +614,30 @@ def create_booking(current_user):
         )
 
         db.session.add(booking)
+        db.session.flush()
+
+        if hold:
+            # 保留占用的时间片直接转给预约
+            transfer_hold_slots(hold.id, booking.id)
+            db.session.delete(hold)
+        else:
+            # 同一事务内写入时间片占用记录，并发请求的冲突由唯一键拒绝
+            try:
+                occupy_reclaiming(booking)
+            except SlotConflict as conflict:
+                db.session.rollback()
+                if conflict.resource == 'table':
+                    return error_response('该球台在此时间段已被占用')
+                return error_response('该时间段已有预约冲突')
+
+        # 未指定球台时按首次适配自动分配，无空闲球台则留待管理员分配
+        if not table_id:
+            assign_table(booking)
+
         db.session.commit()
+        if hold:
+            table_index.sync_hold(hold, active=False)
+        booking_changed(booking)
 
         # 记录日志
         log_action(current_user.id, 'create_booking',
@@ -220,6 +650,174 @@ def create_booking(current_user):
         db.session.rollback()
         return error_response(f'创建预约失败: {str(e)}')
 
+@booking_bp.route('/series/create', methods=['POST'])
+@require_auth(['student'])
+def create_booking_series(current_user):
+    """创建系列预约（每周固定时间，连续多周），一次性预付全部课时费"""
+    try:
+        data = request.get_json()
+        coach_id = data.get('coach_id')
+        start_date = data.get('start_date')
+        start_time = data.get('start_time')
+        end_time = data.get('end_time')
+        weeks = data.get('weeks')
+        table_id = data.get('table_id')
+
+        if not all([coach_id, start_date, start_time, end_time, weeks]):
+            return error_response('教练、开始日期、开始时间、结束时间和周数为必填项')
+
+        weeks = int(weeks)
+        max_weeks = current_app.config['BOOKING_SERIES_MAX_WEEKS']
+        if weeks < 1 or weeks > max_weeks:
+            return error_response(f'周数必须在1到{max_weeks}之间')
+
+        # 验证师生关系
+        relation = CoachStudentRelation.query.filter_by(
+            student_id=current_user.id,
+            coach_id=coach_id,
+            status='approved'
+        ).first()
+        if not relation:
+            return error_response('您还未选择该教练，请先建立师生关系')
+
+        start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date()
+        weekday = data.get('weekday', start_date_obj.weekday())
+        if weekday not in range(7):
+            return error_response('星期取值必须在0（周一）到6（周日）之间')
+
+        # 第一次课为开始日期当天或之后的第一个指定星期
+        first_date = start_date_obj + timedelta(days=(weekday - start_date_obj.weekday()) % 7)
+        if first_date <= date.today():
+            return error_response('预约日期不能是今天或过去日期')
+        occurrence_dates = [first_date + timedelta(weeks=i) for i in range(weeks)]
+
+        start_time_obj = datetime.strptime(start_time, '%H:%M:%S').time()
+        end_time_obj = datetime.strptime(end_time, '%H:%M:%S').time()
+        if start_time_obj >= end_time_obj:
+            return error_response('结束时间必须晚于开始时间')
+        if not on_slot_boundary(start_time_obj, end_time_obj):
+            return error_response(slot_boundary_error())
+
+        coach = User.query.get(coach_id)
+        if not coach or not coach.coach_profile:
+            return error_response('教练信息不存在')
+
+        if table_id and not Table.query.get(table_id):
+            return error_response('球台不存在')
+
+        lesson_fee = Decimal(str(round(calculate_lesson_fee(coach, start_time_obj, end_time_obj), 2)))
+        total_fee = lesson_fee * weeks
+
+        account = Account.query.filter_by(user_id=current_user.id).first()
+        ensure_ledger_migrated(account)
+        if not account or account.current_balance < total_fee:
+            return error_response(f'账户余额不足，需要{total_fee}元，当前余额{account.current_balance if account else 0}元')
+
+        # 一次查询检查所有日期的学员、教练、球台冲突
+        owner_filter = or_(Booking.student_id == current_user.id, Booking.coach_id == coach_id)
+        if table_id:
+            owner_filter = or_(owner_filter, Booking.table_id == table_id)
+        conflicts = db.session.query(
+            Booking.id, Booking.booking_date, Booking.start_time, Booking.end_time,
+            Booking.student_id, Booking.coach_id, Booking.table_id
+        ).filter(
+            owner_filter,
+            Booking.booking_date.in_(occurrence_dates),
+            Booking.status.in_(['pending', 'confirmed']),
+            Booking.start_time < end_time_obj,
+            Booking.end_time > start_time_obj
+        ).order_by(Booking.booking_date).all()
+        blocked = blocked_dates(coach.id, occurrence_dates, start_time_obj, end_time_obj)
+
+        if conflicts or blocked:
+            report = [{
+                'date': day.isoformat(),
+                'booking_id': None,
+                'start_time': start_time_obj.isoformat(),
+                'end_time': end_time_obj.isoformat(),
+                'reason': '教练该时间段请假'
+            } for day in blocked]
+            for row in conflicts:
+                if row.student_id == current_user.id or row.coach_id == int(coach_id):
+                    reason = '该时间段已有预约冲突'
+                else:
+                    reason = '该球台在此时间段已被占用'
+                report.append({
+                    'date': row.booking_date.isoformat(),
+                    'booking_id': row.id,
+                    'start_time': row.start_time.isoformat(),
+                    'end_time': row.end_time.isoformat(),
+                    'reason': reason
+                })
+            return error_response(f'{len({item["date"] for item in report})}次课程存在时间冲突',
+                                  data={'conflicts': report})
+
+        series = BookingSeries(
+            student_id=current_user.id,
+            coach_id=coach_id,
+            campus_id=coach.campus_id,
+            table_id=table_id,
+            weekday=weekday,
+            start_time=start_time_obj,
+            end_time=end_time_obj,
+            first_date=first_date,
+            occurrences=weeks,
+            total_fee=total_fee
+        )
+        db.session.add(series)
+        db.session.flush()
+
+        # 批量插入全部预约
+        db.session.execute(insert(Booking), [{
+            'student_id': current_user.id,
+            'coach_id': coach_id,
+            'campus_id': coach.campus_id,
+            'table_id': table_id,
+            'booking_date': occurrence_date,
+            'start_time': start_time_obj,
+            'end_time': end_time_obj,
+            'lesson_fee': lesson_fee,
+            'status': 'pending',
+            'series_id': series.id,
+            'created_at': datetime.utcnow()
+        } for occurrence_date in occurrence_dates])
+        bookings = Booking.query.filter_by(series_id=series.id).order_by(Booking.booking_date).all()
+
+        try:
+            occupy_reclaiming(bookings)
+        except SlotConflict as conflict:
+            db.session.rollback()
+            if conflict.resource == 'table':
+                return error_response('该球台在此时间段已被占用')
+            return error_response('该时间段已有预约冲突')
+
+        # 一次性扣除全部课时费（余额在检查后被并发扣减时整体回滚）
+        try:
+            debit(current_user.id, total_fee, f'系列课时费预付 - 教练: {coach.real_name}, 共{weeks}次',
+                  related_booking_id=bookings[0].id)
+        except InsufficientBalance as e:
+            db.session.rollback()
+            return error_response(f'账户余额不足，需要{total_fee}元，当前余额{e.balance}元')
+        db.session.commit()
+
+        for booking in bookings:
+            booking_changed(booking)
+
+        log_action(current_user.id, 'create_booking_series',
+                  f'创建系列预约: 教练{coach.real_name}, 首次{first_date}, 共{weeks}次, 时间{start_time}-{end_time}',
+                  request.remote_addr)
+
+        result = series.to_dict()
+        result['booking_ids'] = [booking.id for booking in bookings]
+        return success_response(result, '系列预约已提交，等待教练确认')
+
+    except ValueError:
+        db.session.rollback()
+        return error_response('日期或时间格式错误')
+    except Exception as e:
+        db.session.rollback()
+        return error_response(f'创建系列预约失败: {str(e)}')
+
 @booking_bp.route('/<int:booking_id>/confirm', methods=['POST'])
 @require_auth(['coach'])
 def confirm_booking(current_user, booking_id):
@@ -238,35 +836,38 @@ def confirm_booking(current_user, booking_id):
         if not booking:
             return error_response('预约不存在或已处理', 404)
 
-        if confirm:
-            # 确认预约，扣除学员账户余额
-            account = Account.query.filter_by(user_id=booking.student_id).first()
-            if not account or account.balance < booking.lesson_fee:
-                return error_response('学员账户余额不足，无法确认预约')
-
-            # 扣费
-            account.balance -= booking.lesson_fee
-            account.updated_at = datetime.utcnow()
-
-            # 记录交易
-            transaction = Transaction(
-                user_id=booking.student_id,
-                transaction_type='withdraw',
-                amount=booking.lesson_fee,
-                payment_method='system',
-                description=f'课时费扣除 - 教练: {current_user.real_name}',
-                related_booking_id=booking.id
-            )
-            db.session.add(transaction)
+        # 系列预约在创建时已预付课时费
+        prepaid = booking.series_id is not None
 
-            booking.status = 'confirmed'
-            booking.confirm_time = datetime.utcnow()
+        if confirm:
+            # 条件更新状态，并发确认时只有一个请求会扣费
+            if not claim_status(booking, 'pending', 'confirmed', confirm_time=datetime.utcnow()):
+                db.session.rollback()
+                return error_response('预约不存在或已处理', 404)
+
+            if not prepaid:
+                # 扣除学员账户余额（条件更新，余额不足时回滚确认）
+                try:
+                    debit(booking.student_id, booking.lesson_fee,
+                          f'课时费扣除 - 教练: {current_user.real_name}', related_booking_id=booking.id)
+                except InsufficientBalance:
+                    db.session.rollback()
+                    return error_response('学员账户余额不足，无法确认预约')
             message = '预约已确认'
         else:
-            booking.status = 'cancelled'
+            if not claim_status(booking, 'pending', 'cancelled'):
+                db.session.rollback()
+                return error_response('预约不存在或已处理', 404)
+            release_slots(booking.id)
+
+            # 退还系列预约预付的课时费
+            if prepaid:
+                credit(booking.student_id, booking.lesson_fee,
+                       f'系列预约拒绝退费 - 教练: {current_user.real_name}', related_booking_id=booking.id)
             message = f'预约已拒绝: {reason}'
 
         db.session.commit()
+        booking_changed(booking)
 
         # 记录日志
         action_desc = f'{"确认" if confirm else "拒绝"}预约: 学员{booking.student.real_name}, 原因: {reason if not confirm else "无"}'
@@ -306,36 +907,47 @@ def cancel_booking(current_user, booking_id):
         if time_diff.total_seconds() < 24 * 3600:  # 24小时
             return error_response('预约开始前24小时内无法取消')
 
-        # TODO: 检查当月取消次数限制（暂时跳过）
-
-        # 取消预约
-        booking.status = 'cancelled'
+        # 学员取消时检查当月取消次数限制（教练取消不计入）：缓存显示已用完时直接拒绝，否则在事务内原子加一后判断
+        limit = cancel_limiter.limit()
+        year_month = current_year_month()
+        cancel_count = None
+        if current_user.user_type == 'student':
+            if cancel_limiter.is_exhausted(booking.student_id):
+                return error_response(f'本月取消次数已达上限（{limit}次）')
+            cancel_count = cancel_limiter.consume(booking.student_id, year_month)
+            if cancel_count > limit:
+                db.session.rollback()
+                cancel_limiter.remember(booking.student_id, year_month, cancel_count - 1)
+                return error_response(f'本月取消次数已达上限（{limit}次）')
+
+        # 取消预约（条件更新，防止并发取消重复退费）
+        if not claim_status(booking, 'confirmed', 'cancelled'):
+            db.session.rollback()
+            return error_response('预约不存在或无权限操作', 404)
+        release_slots(booking.id)
 
         # 退费
-        account = Account.query.filter_by(user_id=booking.student_id).first()
-        if account:
-            account.balance += booking.lesson_fee
-            account.updated_at = datetime.utcnow()
-
-            # 记录退费交易
-            transaction = Transaction(
-                user_id=booking.student_id,
-                transaction_type='refund',
-                amount=booking.lesson_fee,
-                payment_method='system',
-                description=f'预约取消退费 - 教练: {booking.coach.real_name}',
-                related_booking_id=booking.id
-            )
-            db.session.add(transaction)
+        credit(booking.student_id, booking.lesson_fee,
+               f'预约取消退费 - 教练: {booking.coach.real_name}', related_booking_id=booking.id)
+
+        # 空出的时间段在同一事务中分配给候补学员
+        promoted = promote_waitlist(booking)
 
         db.session.commit()
+        if cancel_count is not None:
+            cancel_limiter.remember(booking.student_id, year_month, cancel_count)
+        booking_changed(booking)
+        waitlist_promoted(promoted)
 
         # 记录日志
         log_action(current_user.id, 'cancel_booking',
                   f'取消预约: {booking.student.real_name} - {booking.coach.real_name}, 原因: {reason}',
                   request.remote_addr)
 
-        return success_response(message='预约已取消，课时费已退回')
+        return success_response({
+            'monthly_cancellations': cancel_count,
+            'monthly_limit': limit
+        }, '预约已取消，课时费已退回')
 
     except Exception as e:
         db.session.rollback()
@@ -407,8 +1019,12 @@ def complete_booking(current_user, booking_id):
             return error_response('预约不存在或无权限操作', 404)
 
         # 标记预约为已完成
-        booking.status = 'completed'
+        if not claim_status(booking, 'confirmed', 'completed'):
+            db.session.rollback()
+            return error_response('预约不存在或无权限操作', 404)
+        release_slots(booking.id)
         db.session.commit()
+        booking_changed(booking)
 
         # 记录日志
         log_action(current_user.id, 'complete_booking',
@@ -424,10 +1040,8 @@ def complete_booking(current_user, booking_id):
 @booking_bp.route('/admin/all-bookings', methods=['GET'])
 @require_auth(['campus_admin', 'super_admin'])
 def get_all_bookings_admin(current_user):
-    """管理员获取所有预约记录"""
+    """管理员获取所有预约记录（传 after 参数时使用游标分页）"""
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
         status = request.args.get('status')
         campus_id = request.args.get('campus_id', type=int)
         date = request.args.get('date')
@@ -450,13 +1064,169 @@ def get_all_bookings_admin(current_user):
         query = query.order_by(Booking.created_at.desc())
 
         # 分页查询
-        result = paginate_query(query, page, per_page)
+        result = paginate_request(query, Booking, 20)
 
         return success_response(result)
 
     except Exception as e:
         return error_response(f'获取预约列表失败: {str(e)}')
 
+@booking_bp.route('/admin/occupancy', methods=['GET'])
+@require_auth(['campus_admin', 'super_admin'])
+def get_campus_occupancy_admin(current_user):
+    """管理员获取校区球台占用矩阵（球台 × 时间片）及利用率"""
+    try:
+        campus_id = request.args.get('campus_id', type=int)
+        start_date = request.args.get('date', date.today().isoformat())
+        days = request.args.get('days', 1, type=int)
+        slot_minutes = request.args.get('slot', current_app.config['BOOKING_SLOT_MINUTES'], type=int)
+
+        # 校区管理员只能查看自己校区
+        if current_user.user_type == 'campus_admin':
+            campus_id = current_user.campus_id
+
+        if not campus_id:
+            return error_response('校区为必填项')
+        if slot_minutes not in (15, 30, 60):
+            return error_response('时间片粒度只能是15、30或60分钟')
+        if not days or days < 1 or days > 7:
+            return error_response('天数必须在1到7之间')
+
+        start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date()
+        end_date_obj = start_date_obj + timedelta(days=days - 1)
+
+        open_hour = current_app.config['BOOKING_OPEN_HOUR']
+        close_hour = current_app.config['BOOKING_CLOSE_HOUR']
+        slot_seconds = slot_minutes * 60
+        first_slot = open_hour * 3600 // slot_seconds
+        slots_per_day = (close_hour - open_hour) * 3600 // slot_seconds
+        opening = hours_mask(open_hour, close_hour, slot_minutes)
+
+        tables = db.session.query(Table.id, Table.table_number, Table.status).filter(
+            Table.campus_id == campus_id
+        ).order_by(Table.id).all()
+        table_pos = {table.id: pos for pos, table in enumerate(tables)}
+
+        # 一次查询取出范围内所有占用区间，只投影需要的列
+        rows = db.session.query(
+            Booking.table_id, Booking.booking_date, Booking.start_time, Booking.end_time
+        ).join(
+            Table, Table.id == Booking.table_id
+        ).filter(
+            Table.campus_id == campus_id,
+            Booking.booking_date >= start_date_obj,
+            Booking.booking_date <= end_date_obj,
+            Booking.status.in_(['pending', 'confirmed', 'completed'])
+        ).all()
+
+        # grid[day][table] 为整数位图，第 i 位表示营业开始后的第 i 个时间片
+        grid = [[0] * len(tables) for _ in range(days)]
+        for table_id, booking_date_value, start_time_value, end_time_value in rows:
+            mask = interval_mask(to_seconds(start_time_value), to_seconds(end_time_value), slot_minutes)
+            day_pos = (booking_date_value - start_date_obj).days
+            grid[day_pos][table_pos[table_id]] |= (mask & opening) >> first_slot
+
+        slots_per_hour = 60 // slot_minutes
+        hour_masks = [
+            ((1 << slots_per_hour) - 1) << (h * slots_per_hour)
+            for h in range(close_hour - open_hour)
+        ]
+        table_used = [0] * len(tables)
+        hour_used = [0] * len(hour_masks)
+        for day_masks in grid:
+            for pos, mask in enumerate(day_masks):
+                table_used[pos] += popcount(mask)
+                for h, hour_mask in enumerate(hour_masks):
+                    hour_used[h] += popcount(mask & hour_mask)
+
+        table_capacity = slots_per_day * days
+        hour_capacity = slots_per_hour * len(tables) * days
+
+        return success_response({
+            'campus_id': campus_id,
+            'start_date': start_date_obj.isoformat(),
+            'days': days,
+            'slot_minutes': slot_minutes,
+            'open_hour': open_hour,
+            'close_hour': close_hour,
+            'slots_per_day': slots_per_day,
+            'tables': [
+                {'id': table.id, 'table_number': table.table_number, 'status': table.status}
+                for table in tables
+            ],
+            # 每天一行，每张球台一个十六进制位图（最低位为营业开始的第一个时间片）
+            'grid': {
+                (start_date_obj + timedelta(days=day_pos)).isoformat(): [format(mask, 'x') for mask in day_masks]
+                for day_pos, day_masks in enumerate(grid)
+            },
+            'utilization': {
+                'by_table': [
+                    round(used * 100 / table_capacity, 2) if table_capacity else 0
+                    for used in table_used
+                ],
+                'by_hour': {
+                    f'{open_hour + h:02d}:00': round(used * 100 / hour_capacity, 2) if hour_capacity else 0
+                    for h, used in enumerate(hour_used)
+                },
+                'overall': round(sum(table_used) * 100 / (table_capacity * len(tables)), 2) if tables else 0
+            }
+        })
+
+    except ValueError:
+        return error_response('日期格式错误，应为YYYY-MM-DD')
+    except Exception as e:
+        return error_response(f'获取球台占用情况失败: {str(e)}')
+
+@booking_bp.route('/admin/repack', methods=['POST'])
+@require_auth(['campus_admin', 'super_admin'])
+def repack_tables_admin(current_user):
+    """管理员按首次适配重新分配某校区某天的球台"""
+    try:
+        data = request.get_json()
+        campus_id = data.get('campus_id')
+        booking_date = data.get('date')
+        include_assigned = bool(data.get('include_assigned', False))
+
+        # 校区管理员只能操作自己校区
+        if current_user.user_type == 'campus_admin':
+            campus_id = current_user.campus_id
+
+        if not campus_id or not booking_date:
+            return error_response('校区和日期为必填项')
+
+        booking_date_obj = datetime.strptime(booking_date, '%Y-%m-%d').date()
+
+        try:
+            assignments = repack_campus_day(campus_id, booking_date_obj, include_assigned)
+        except SlotConflict:
+            db.session.rollback()
+            return error_response('球台占用已变化，请稍后重试')
+
+        db.session.commit()
+        table_index.invalidate(campus_id, booking_date_obj)
+        for coach_id, in db.session.query(Booking.coach_id).filter(
+                Booking.id.in_(list(assignments))).distinct():
+            schedule_cache.invalidate(coach_id, booking_date_obj)
+
+        unassigned = [booking_id for booking_id, table_id in assignments.items() if table_id is None]
+
+        log_action(current_user.id, 'admin_repack_tables',
+                  f'重新分配球台: 校区{campus_id}, 日期{booking_date}, 共{len(assignments)}个预约, 未分配{len(unassigned)}个',
+                  request.remote_addr)
+
+        return success_response({
+            'campus_id': campus_id,
+            'date': booking_date_obj.isoformat(),
+            'assignments': {str(booking_id): table_id for booking_id, table_id in assignments.items()},
+            'unassigned': unassigned
+        }, '球台已重新分配')
+
+    except ValueError:
+        return error_response('日期格式错误，应为YYYY-MM-DD')
+    except Exception as e:
+        db.session.rollback()
+        return error_response(f'重新分配球台失败: {str(e)}')
+
 @booking_bp.route('/<int:booking_id>/approve', methods=['POST'])
 @require_auth(['campus_admin', 'super_admin'])
 def approve_booking_admin(current_user, booking_id):
@@ -473,30 +1243,25 @@ def approve_booking_admin(current_user, booking_id):
         if booking.status != 'pending':
             return error_response('只能确认待处理的预约')
 
-        # 检查学员账户余额
-        account = Account.query.filter_by(user_id=booking.student_id).first()
-        if not account or account.balance < booking.lesson_fee:
-            return error_response('学员账户余额不足，无法确认预约')
-
-        # 扣费
-        account.balance -= booking.lesson_fee
-        account.updated_at = datetime.utcnow()
-
-        # 记录交易
-        transaction = Transaction(
-            user_id=booking.student_id,
-            transaction_type='withdraw',
-            amount=booking.lesson_fee,
-            payment_method='system',
-            description=f'课时费扣除 - 教练: {booking.coach.real_name} (管理员确认)',
-            related_booking_id=booking.id
-        )
-        db.session.add(transaction)
+        # 系列预约在创建时已预付课时费
+        prepaid = booking.series_id is not None
 
-        booking.status = 'confirmed'
-        booking.confirm_time = datetime.utcnow()
+        # 条件更新状态，与教练确认并发时只有一个请求会扣费
+        if not claim_status(booking, 'pending', 'confirmed', confirm_time=datetime.utcnow()):
+            db.session.rollback()
+            return error_response('只能确认待处理的预约')
+
+        if not prepaid:
+            # 扣费（条件更新，余额不足时回滚确认）
+            try:
+                debit(booking.student_id, booking.lesson_fee,
+                      f'课时费扣除 - 教练: {booking.coach.real_name} (管理员确认)', related_booking_id=booking.id)
+            except InsufficientBalance:
+                db.session.rollback()
+                return error_response('学员账户余额不足，无法确认预约')
 
         db.session.commit()
+        booking_changed(booking)
 
         # 记录日志
         log_action(current_user.id, 'admin_approve_booking',
@@ -528,26 +1293,26 @@ def cancel_booking_admin(current_user, booking_id):
         if booking.status == 'cancelled':
             return error_response('预约已被取消')
 
-        # 退费（如果已经扣费）
-        if booking.status == 'confirmed':
-            account = Account.query.filter_by(user_id=booking.student_id).first()
-            if account:
-                account.balance += booking.lesson_fee
-                account.updated_at = datetime.utcnow()
-
-                # 记录退费交易
-                transaction = Transaction(
-                    user_id=booking.student_id,
-                    transaction_type='refund',
-                    amount=booking.lesson_fee,
-                    payment_method='system',
-                    description=f'预约取消退费 - 教练: {booking.coach.real_name} (管理员取消)',
-                    related_booking_id=booking.id
-                )
-                db.session.add(transaction)
+        # 条件更新状态，状态在读取后被并发修改时放弃本次取消
+        previous_status = booking.status
+        if not claim_status(booking, previous_status, 'cancelled'):
+            db.session.rollback()
+            return error_response('预约状态已变化，请刷新后重试')
+        release_slots(booking.id)
+
+        # 退费（如果已经扣费，系列预约在待确认时即已预付）
+        if previous_status == 'confirmed' or (previous_status == 'pending' and booking.series_id):
+            credit(booking.student_id, booking.lesson_fee,
+                   f'预约取消退费 - 教练: {booking.coach.real_name} (管理员取消)', related_booking_id=booking.id)
+
+        # 空出的时间段在同一事务中分配给候补学员
+        promoted = []
+        if previous_status in ('pending', 'confirmed'):
+            promoted = promote_waitlist(booking)
 
-        booking.status = 'cancelled'
         db.session.commit()
+        booking_changed(booking)
+        waitlist_promoted(promoted)
 
         # 记录日志
         log_action(current_user.id, 'admin_cancel_booking',
@@ -558,4 +1323,158 @@ def cancel_booking_admin(current_user, booking_id):
 
     except Exception as e:
         db.session.rollback()
-        return error_response(f'取消预约失败: {str(e)}')
\ No newline at end of file
+        return error_response(f'取消预约失败: {str(e)}')
+
+@booking_bp.route('/admin/blockouts', methods=['POST'])
+@require_auth(['campus_admin', 'super_admin'])
+def create_coach_blockout(current_user):
+    """登记教练请假：批量取消并退款请假时段内的预约，之后该时段不可预约"""
+    try:
+        data = request.get_json()
+        coach_id = data.get('coach_id')
+        start_date = data.get('start_date')
+        end_date = data.get('end_date', start_date)
+        reason = data.get('reason', '教练请假')
+
+        if not all([coach_id, start_date, end_date]):
+            return error_response('教练、开始日期和结束日期为必填项')
+
+        coach = User.query.filter_by(id=coach_id, user_type='coach').first()
+        if not coach:
+            return error_response('教练不存在', 404)
+        if current_user.user_type == 'campus_admin' and coach.campus_id != current_user.campus_id:
+            return error_response('权限不足', 403)
+
+        start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date()
+        end_date_obj = datetime.strptime(end_date, '%Y-%m-%d').date()
+        if start_date_obj > end_date_obj:
+            return error_response('结束日期不能早于开始日期')
+        if (end_date_obj - start_date_obj).days >= current_app.config['COACH_BLOCKOUT_MAX_DAYS']:
+            return error_response(f'请假范围不能超过{current_app.config["COACH_BLOCKOUT_MAX_DAYS"]}天')
+
+        # 不指定时间时整天请假
+        start_time_obj = datetime.strptime(data['start_time'], '%H:%M:%S').time() if data.get('start_time') else DAY_START
+        end_time_obj = datetime.strptime(data['end_time'], '%H:%M:%S').time() if data.get('end_time') else DAY_END
+        if start_time_obj >= end_time_obj:
+            return error_response('结束时间必须晚于开始时间')
+        if not on_slot_boundary(start_time_obj) or (end_time_obj != DAY_END and not on_slot_boundary(end_time_obj)):
+            return error_response(slot_boundary_error())
+
+        if overlapping_blockouts(coach.id, start_date_obj, end_date_obj, start_time_obj, end_time_obj).first():
+            return error_response('与该教练已有的请假时段重叠')
+
+        blockout = CoachBlockout(
+            coach_id=coach.id,
+            campus_id=coach.campus_id,
+            start_date=start_date_obj,
+            end_date=end_date_obj,
+            start_time=start_time_obj,
+            end_time=end_time_obj,
+            reason=reason,
+            created_by=current_user.id
+        )
+        db.session.add(blockout)
+        db.session.flush()
+
+        # 一个短事务内完成批量取消和时间片占用，退款随后分批写入
+        try:
+            bookings, holds = apply_blockout(blockout)
+        except SlotConflict:
+            db.session.rollback()
+            return error_response('该时间段有新的预约正在提交，请稍后重试')
+        db.session.commit()
+        bookings_changed(bookings)
+        holds_released(holds)
+
+        def report(done, total):
+            current_app.logger.info(f'教练请假 {blockout.id} 退款进度: {done}/{total}')
+
+        refunds = refund_blockout(blockout.id, progress=report)
+
+        log_action(current_user.id, 'create_coach_blockout',
+                  f'登记教练请假: 教练{coach.real_name}, {start_date_obj}至{end_date_obj} '
+                  f'{start_time_obj}-{end_time_obj}, 取消预约{len(bookings)}个, 原因: {reason}',
+                  request.remote_addr)
+
+        result = blockout.to_dict()
+        result.update({'cancelled_bookings': len(bookings), 'refunded': refunds['refunded']})
+        return success_response(result, '请假已登记，受影响的预约已取消并退款')
+
+    except ValueError:
+        return error_response('日期或时间格式错误，应为YYYY-MM-DD和HH:MM:SS')
+    except Exception as e:
+        db.session.rollback()
+        return error_response(f'登记教练请假失败: {str(e)}')
+
+@booking_bp.route('/admin/blockouts', methods=['GET'])
+@require_auth(['campus_admin', 'super_admin'])
+def get_coach_blockouts(current_user):
+    """获取教练请假列表（管理员）"""
+    try:
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', 10, type=int)
+        coach_id = request.args.get('coach_id', type=int)
+        status = request.args.get('status', 'active')
+
+        query = CoachBlockout.query
+        if current_user.user_type == 'campus_admin':
+            query = query.filter(CoachBlockout.campus_id == current_user.campus_id)
+        if coach_id:
+            query = query.filter(CoachBlockout.coach_id == coach_id)
+        if status:
+            query = query.filter(CoachBlockout.status == status)
+
+        query = query.order_by(CoachBlockout.start_date.desc(), CoachBlockout.id.desc())
+        return success_response(paginate_query(query, page, per_page))
+
+    except Exception as e:
+        return error_response(f'获取请假列表失败: {str(e)}')
+
+@booking_bp.route('/admin/blockouts/<int:blockout_id>', methods=['DELETE'])
+@require_auth(['campus_admin', 'super_admin'])
+def lift_coach_blockout(current_user, blockout_id):
+    """撤销教练请假，时间段重新开放预约（已取消的预约不会恢复）"""
+    try:
+        blockout = CoachBlockout.query.get(blockout_id)
+        if not blockout:
+            return error_response('请假记录不存在', 404)
+        if current_user.user_type == 'campus_admin' and blockout.campus_id != current_user.campus_id:
+            return error_response('权限不足', 403)
+        if blockout.status != 'active':
+            return error_response('请假已撤销')
+
+        lift_blockout(blockout)
+        db.session.commit()
+
+        log_action(current_user.id, 'lift_coach_blockout',
+                  f'撤销教练请假: 教练{blockout.coach.real_name}, {blockout.start_date}至{blockout.end_date}',
+                  request.remote_addr)
+
+        return success_response(blockout.to_dict(), '请假已撤销')
+
+    except Exception as e:
+        db.session.rollback()
+        return error_response(f'撤销请假失败: {str(e)}')
+
+@booking_bp.route('/admin/table-index/check', methods=['GET'])
+@require_auth(['campus_admin', 'super_admin'])
+def check_table_index_admin(current_user):
+    """管理员校验球台占用索引与数据库是否一致"""
+    try:
+        campus_id = request.args.get('campus_id', type=int)
+        booking_date = request.args.get('date')
+
+        # 校区管理员只能校验自己校区
+        if current_user.user_type == 'campus_admin':
+            campus_id = current_user.campus_id
+
+        if not campus_id or not booking_date:
+            return error_response('校区和日期为必填项')
+
+        booking_date_obj = datetime.strptime(booking_date, '%Y-%m-%d').date()
+        report = table_index.check_consistency(campus_id, booking_date_obj)
+
+        return success_response(report)
+
+    except Exception as e:
+        return error_response(f'校验球台索引失败: {str(e)}')
\ No newline at end of file
@@ -1,8 +1,12 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required
 from models import Match, MatchRegistration, Account, Transaction, User, db
 from utils.auth import require_auth, log_action, success_response, error_response, paginate_query
+from utils.accounts import InsufficientBalance, debit
+from utils.idempotency import idempotent
+from utils.refunds import refund_in_chunks
 from datetime import datetime, date
+from sqlalchemy import literal, null
 from decimal import Decimal
 
 match_bp = Blueprint('match', __name__, url_prefix='/api/match')
@@ -129,6 +133,7 @@ def create_match(current_user):
 
 @match_bp.route('/<int:match_id>/register', methods=['POST'])
 @require_auth(['student'])
+@idempotent
 def register_match(current_user, match_id):
     """学员报名比赛"""
     try:
@@ -161,26 +166,13 @@ def register_match(current_user, match_id):
         if existing_registration:
             return error_response('您已报名该比赛')
 
-        # 检查账户余额
-        account = Account.query.filter_by(user_id=current_user.id).first()
-        if not account or account.balance < match.registration_fee:
+        # 扣费（条件更新，余额不足时不扣款）
+        try:
+            debit(current_user.id, match.registration_fee, f'比赛报名费 - {match.name}')
+        except InsufficientBalance:
+            db.session.rollback()
             return error_response(f'账户余额不足，需要{match.registration_fee}元报名费')
 
-        # 扣费
-        account.balance -= match.registration_fee
-        account.updated_at = datetime.utcnow()
-
-        # 记录交易
-        transaction = Transaction(
-            user_id=current_user.id,
-            transaction_type='withdraw',
-            amount=match.registration_fee,
-            payment_method='system',
-            description=f'比赛报名费 - {match.name}',
-            status='completed'
-        )
-        db.session.add(transaction)
-
         # 创建报名记录
         registration = MatchRegistration(
             match_id=match_id,
@@ -427,45 +419,41 @@ def cancel_match_admin(current_user, match_id):
         if current_user.user_type == 'campus_admin' and match.campus_id != current_user.campus_id:
             return error_response('权限不足', 403)
 
-        if match.status == 'cancelled':
+        paid = MatchRegistration.query.filter_by(match_id=match_id, payment_status='paid')
+        if match.status == 'cancelled' and not paid.first():
             return error_response('比赛已被取消')
 
-        # 退费给已报名的学员
-        registrations = MatchRegistration.query.filter_by(
-            match_id=match_id,
-            payment_status='paid'
-        ).all()
-
-        for registration in registrations:
-            # 退还报名费
-            account = Account.query.filter_by(user_id=registration.student_id).first()
-            if account:
-                account.balance += match.registration_fee
-                account.updated_at = datetime.utcnow()
-
-                # 记录退费交易
-                transaction = Transaction(
-                    user_id=registration.student_id,
-                    transaction_type='refund',
-                    amount=match.registration_fee,
-                    payment_method='system',
-                    description=f'比赛取消退费 - {match.name} (管理员取消)',
-                    status='completed'
-                )
-                db.session.add(transaction)
-
-            # 更新报名状态
-            registration.payment_status = 'refunded'
-
+        # 先关闭比赛，不再接受报名；之前中断的取消再次调用时继续退还剩余报名费
         match.status = 'cancelled'
         db.session.commit()
 
+        # 退还报名费：分批用 INSERT ... SELECT 写入退费交易并批量更新报名状态，每批单独提交
+        source = db.session.query(
+            MatchRegistration.id.label('key'),
+            MatchRegistration.student_id.label('user_id'),
+            literal(match.registration_fee).label('amount'),
+            literal(f'比赛取消退费 - {match.name} (管理员取消)').label('description'),
+            null().label('related_booking_id')
+        ).filter(
+            MatchRegistration.match_id == match_id,
+            MatchRegistration.payment_status == 'paid'
+        )
+
+        def mark_refunded(keys):
+            MatchRegistration.query.filter(MatchRegistration.id.in_(keys)).update(
+                {'payment_status': 'refunded'}, synchronize_session=False)
+
+        def report(done, total):
+            current_app.logger.info(f'比赛 {match_id} 退费进度: {done}/{total}')
+
+        result = refund_in_chunks(source.statement, mark_refunded, progress=report)
+
         # 记录日志
         log_action(current_user.id, 'cancel_match',
-                  f'管理员取消比赛: {match.name}, 原因: {reason}',
+                  f'管理员取消比赛: {match.name}, 原因: {reason}, 退费 {result["refunded"]} 笔',
                   request.remote_addr)
 
-        return success_response(message='比赛已取消，报名费已退还')
+        return success_response({'refunded': result['refunded']}, '比赛已取消，报名费已退还')
 
     except Exception as e:
         db.session.rollback()
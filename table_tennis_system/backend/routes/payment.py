@@ -1,12 +1,25 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required
-from models import Account, Transaction, User, db
-from utils.auth import require_auth, log_action, success_response, error_response, paginate_query
-from datetime import datetime
+from models import Account, Campus, Transaction, User, db
+from utils.auth import require_auth, log_action, success_response, error_response, paginate_query, paginate_request
+from utils.accounts import LedgerNotMigrated, credit, ensure_ledger_migrated, get_balance
+from utils.idempotency import idempotent
+from utils.payment_stats import payment_statistics, daily_totals, coach_daily_totals, revenue_series
+from utils.payment_gateway import ONLINE_METHODS, GatewayError, create_order, record_callback, verify
+from utils.transaction_archive import user_transactions_page
+from utils.statement_budget import statement_budget
+from datetime import datetime, timedelta
 from decimal import Decimal
 
 payment_bp = Blueprint('payment', __name__, url_prefix='/api/payment')
 
+# 收支趋势各时间桶未指定开始日期时的默认跨度
+REVENUE_DEFAULT_SPANS = {
+    'day': timedelta(days=30),
+    'week': timedelta(weeks=12),
+    'month': timedelta(days=365)
+}
+
 @payment_bp.route('/account', methods=['GET'])
 @require_auth(['student'])
 def get_account_info(current_user):
@@ -19,13 +32,17 @@ def get_account_info(current_user):
             db.session.add(account)
             db.session.commit()
 
+        ensure_ledger_migrated(account)
         return success_response(account.to_dict())
 
+    except LedgerNotMigrated as e:
+        return error_response(str(e), 503)
     except Exception as e:
         return error_response(f'获取账户信息失败: {str(e)}')
 
 @payment_bp.route('/deposit', methods=['POST'])
 @require_auth(['student'])
+@idempotent
 def deposit(current_user):
     """账户充值"""
     try:
@@ -38,37 +55,33 @@ def deposit(current_user):
 
         amount = Decimal(str(amount))
 
-        # 获取或创建账户
-        account = Account.query.filter_by(user_id=current_user.id).first()
-        if not account:
-            account = Account(user_id=current_user.id, balance=0.00)
-            db.session.add(account)
-            db.session.flush()
-
-        # 模拟支付处理（在实际项目中这里会调用第三方支付API）
-        if payment_method in ['wechat', 'alipay']:
-            # 模拟在线支付成功
-            payment_status = 'completed'
-            description = f'{payment_method}充值'
-        else:
-            # 线下支付需要管理员确认
-            payment_status = 'completed'  # 简化处理，直接成功
-            description = '线下充值'
-
-        # 更新账户余额
-        account.balance += amount
-        account.updated_at = datetime.utcnow()
-
-        # 记录交易
-        transaction = Transaction(
-            user_id=current_user.id,
-            transaction_type='deposit',
-            amount=amount,
-            payment_method=payment_method,
-            status=payment_status,
-            description=description
-        )
-        db.session.add(transaction)
+        if payment_method in ONLINE_METHODS:
+            # 在线支付先创建待支付交易并向网关下单，支付结果由网关回调后批量入账
+            transaction = credit(current_user.id, amount, f'{payment_method}充值', transaction_type='deposit',
+                                 payment_method=payment_method, status='pending', create_missing=True)
+            db.session.commit()
+            try:
+                order = create_order(transaction)
+            except GatewayError as e:
+                transaction.status = 'failed'
+                db.session.commit()
+                current_app.logger.warning(f'充值订单 {transaction.id} 下单失败: {e}')
+                return error_response('支付渠道暂不可用，请稍后重试', 503)
+
+            log_action(current_user.id, 'deposit',
+                      f'创建充值订单: {amount}元, 支付方式: {payment_method}, 订单号: {transaction.id}',
+                      request.remote_addr)
+
+            return success_response({
+                'transaction_id': transaction.id,
+                'status': transaction.status,
+                'pay_url': order.get('pay_url'),
+                'new_balance': float(get_balance(current_user.id))
+            }, '充值订单已创建，请完成支付')
+
+        # 线下支付简化处理，直接成功；交易追加后余额由流水得出，账户不存在时创建
+        transaction = credit(current_user.id, amount, '线下充值', transaction_type='deposit',
+                             payment_method=payment_method, create_missing=True)
         db.session.commit()
 
         # 记录日志
@@ -78,32 +91,40 @@ def deposit(current_user):
 
         return success_response({
             'transaction_id': transaction.id,
-            'new_balance': float(account.balance)
+            'status': transaction.status,
+            'new_balance': float(get_balance(current_user.id))
         }, '充值成功')
 
     except Exception as e:
         db.session.rollback()
         return error_response(f'充值失败: {str(e)}')
 
+@payment_bp.route('/gateway/notify', methods=['POST'])
+def gateway_notify():
+    """支付网关异步回调：验签后落库即返回，由后台任务批量入账；返回 success 后网关停止重试"""
+    params = request.get_json(silent=True) or request.form.to_dict()
+    if not verify(params):
+        return 'fail', 400
+    try:
+        record_callback(params)
+    except ValueError:
+        return 'fail', 400
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f'保存支付回调失败: {e}')
+        return 'fail', 500
+    return 'success'
+
 @payment_bp.route('/transactions', methods=['GET'])
 @require_auth(['student'])
 def get_transactions(current_user):
-    """获取交易记录"""
+    """获取交易记录（翻到早期月份时自动读取归档）"""
     try:
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
         transaction_type = request.args.get('type')
 
-        # 构建查询
-        query = Transaction.query.filter_by(user_id=current_user.id)
-
-        if transaction_type:
-            query = query.filter(Transaction.transaction_type == transaction_type)
-
-        query = query.order_by(Transaction.created_at.desc())
-
-        # 分页查询
-        result = paginate_query(query, page, per_page)
+        result = user_transactions_page(current_user.id, transaction_type, page, per_page)
 
         return success_response(result)
 
@@ -115,70 +136,124 @@ def get_transactions(current_user):
 def get_payment_statistics(current_user):
     """获取收费统计（管理员）"""
     try:
-        # 获取统计数据
-        stats = {}
-
-        # 总收入
-        total_income = db.session.query(
-            db.func.sum(Transaction.amount)
-        ).filter(
-            Transaction.transaction_type == 'deposit',
-            Transaction.status == 'completed'
-        ).scalar() or 0
-
-        # 总支出（课时费）
-        total_expense = db.session.query(
-            db.func.sum(Transaction.amount)
-        ).filter(
-            Transaction.transaction_type == 'withdraw',
-            Transaction.status == 'completed'
-        ).scalar() or 0
-
-        # 今日收入
-        today = datetime.now().date()
-        today_income = db.session.query(
-            db.func.sum(Transaction.amount)
-        ).filter(
-            Transaction.transaction_type == 'deposit',
-            Transaction.status == 'completed',
-            db.func.date(Transaction.created_at) == today
-        ).scalar() or 0
-
-        # 本月收入
-        this_month_start = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        this_month_income = db.session.query(
-            db.func.sum(Transaction.amount)
-        ).filter(
-            Transaction.transaction_type == 'deposit',
-            Transaction.status == 'completed',
-            Transaction.created_at >= this_month_start
-        ).scalar() or 0
-
-        stats = {
-            'total_income': float(total_income),
-            'total_expense': float(total_expense),
-            'net_income': float(total_income - total_expense),
-            'today_income': float(today_income),
-            'this_month_income': float(this_month_income)
-        }
+        # 校区管理员只能查看本校区，超级管理员可按 campus_id 筛选
+        if current_user.user_type == 'campus_admin':
+            campus_id = current_user.campus_id
+        else:
+            campus_id = request.args.get('campus_id', type=int)
+
+        totals = payment_statistics(campus_id=campus_id)
+        campus_ids = sorted({campus for campus, _ in totals})
+        names = dict(db.session.query(Campus.id, Campus.name).filter(Campus.id.in_(campus_ids)).all())
+
+        def summarize(keys):
+            """汇总若干 (校区, 交易类型) 的收入和支出"""
+            deposit = {name: sum(totals[key][name] for key in keys if key[1] == 'deposit')
+                       for name in ('total', 'today', 'month')}
+            withdraw = sum(totals[key]['total'] for key in keys if key[1] == 'withdraw')
+            return {
+                'total_income': float(deposit['total']),
+                'total_expense': float(withdraw),
+                'net_income': float(deposit['total'] - withdraw),
+                'today_income': float(deposit['today']),
+                'this_month_income': float(deposit['month'])
+            }
+
+        stats = summarize(list(totals))
+        stats['campus_breakdown'] = [
+            dict(campus_id=campus, campus_name=names.get(campus, '未分配校区'),
+                 **summarize([key for key in totals if key[0] == campus]))
+            for campus in campus_ids
+        ]
 
         return success_response(stats)
 
     except Exception as e:
         return error_response(f'获取统计数据失败: {str(e)}')
 
+@payment_bp.route('/revenue-series', methods=['GET'])
+@require_auth(['campus_admin', 'super_admin'])
+def get_revenue_series(current_user):
+    """按日、周或月统计充值、退款和课时费的时间序列，以列式数组返回（管理员）"""
+    try:
+        bucket = request.args.get('bucket', 'day')
+        if bucket not in REVENUE_DEFAULT_SPANS:
+            return error_response('bucket 只能是 day、week 或 month')
+
+        end_date = request.args.get('end')
+        end_date = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else datetime.now().date()
+        start_date = request.args.get('start')
+        start_date = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date \
+            else end_date - REVENUE_DEFAULT_SPANS[bucket]
+        if start_date > end_date:
+            return error_response('开始日期不能晚于结束日期')
+        if (end_date - start_date).days > current_app.config['REVENUE_SERIES_MAX_DAYS']:
+            return error_response(f'时间范围不能超过{current_app.config["REVENUE_SERIES_MAX_DAYS"]}天')
+
+        # 校区管理员只能查看本校区，超级管理员可按 campus_id 筛选
+        if current_user.user_type == 'campus_admin':
+            campus_id = current_user.campus_id
+        else:
+            campus_id = request.args.get('campus_id', type=int)
+
+        coach_id = request.args.get('coach_id', type=int)
+        if coach_id:
+            coach = User.query.filter_by(id=coach_id, user_type='coach').first()
+            if not coach or (current_user.user_type == 'campus_admin' and coach.campus_id != campus_id):
+                return error_response('教练不存在或无权限查看')
+            totals = coach_daily_totals(start_date, end_date, coach_id, campus_id)
+        else:
+            totals = daily_totals(start_date, end_date, campus_id)
+
+        series = revenue_series(totals, start_date, end_date, bucket)
+        series.update({'campus_id': campus_id, 'coach_id': coach_id})
+        return success_response(series)
+
+    except ValueError:
+        return error_response('日期格式错误，应为YYYY-MM-DD')
+    except Exception as e:
+        return error_response(f'获取收支趋势失败: {str(e)}')
+
+def _transaction_with_user(row):
+    """交易列表投影行转换为字典，格式与 Transaction.to_dict() 相同并附带用户信息"""
+    item = {
+        'id': row.id,
+        'user_id': row.user_id,
+        'transaction_type': row.transaction_type,
+        'amount': float(row.amount),
+        'payment_method': row.payment_method,
+        'status': row.status,
+        'description': row.description,
+        'related_booking_id': row.related_booking_id,
+        'created_at': row.created_at.isoformat() if row.created_at else None
+    }
+    if row.username is not None:
+        item['user'] = {
+            'id': row.user_id,
+            'username': row.username,
+            'real_name': row.real_name
+        }
+    return item
+
 @payment_bp.route('/admin/transactions', methods=['GET'])
 @require_auth(['campus_admin', 'super_admin'])
+@statement_budget(2)
 def get_all_transactions(current_user):
-    """获取所有交易记录（管理员）"""
+    """获取所有交易记录（管理员，传 after 参数时使用游标分页）
+
+    只读取交易表，已归档月份的交易不在结果中，需按用户通过归档查询。
+    """
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
         transaction_type = request.args.get('type')
         user_id = request.args.get('user_id', type=int)
 
-        # 构建查询
-        query = Transaction.query
+        # 交易和用户列一次连接查询取出，语句数与每页行数无关
+        query = db.session.query(
+            Transaction.id, Transaction.user_id, Transaction.transaction_type, Transaction.amount,
+            Transaction.payment_method, Transaction.status, Transaction.description,
+            Transaction.related_booking_id, Transaction.created_at,
+            User.username, User.real_name
+        ).outerjoin(User, User.id == Transaction.user_id)
 
         if transaction_type:
             query = query.filter(Transaction.transaction_type == transaction_type)
@@ -188,22 +263,12 @@ def get_all_transactions(current_user):
 
         # 校区管理员只能看到自己校区的交易
         if current_user.user_type == 'campus_admin':
-            query = query.join(User).filter(User.campus_id == current_user.campus_id)
+            query = query.filter(User.campus_id == current_user.campus_id)
 
         query = query.order_by(Transaction.created_at.desc())
 
         # 分页查询
-        result = paginate_query(query, page, per_page)
-
-        # 添加用户信息
-        for item in result['items']:
-            transaction = Transaction.query.get(item['id'])
-            if transaction and transaction.user:
-                item['user'] = {
-                    'id': transaction.user.id,
-                    'username': transaction.user.username,
-                    'real_name': transaction.user.real_name
-                }
+        result = paginate_request(query, Transaction, serialize=_transaction_with_user)
 
         return success_response(result)
 
@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
 from models import User, CoachProfile, Campus, CoachStudentRelation, db
-from utils.auth import require_auth, log_action, success_response, error_response, paginate_query
+from utils.auth import require_auth, log_action, success_response, error_response, paginate_query, paginate_request
 from datetime import datetime
 
 user_bp = Blueprint('user', __name__, url_prefix='/api/user')
@@ -543,10 +543,8 @@ def assign_campus_admin(current_user, user_id):
 @user_bp.route('/all', methods=['GET'])
 @require_auth(['super_admin'])
 def get_all_users(current_user):
-    """获取所有用户列表（超级管理员）"""
+    """获取所有用户列表（超级管理员，传 after 参数时使用游标分页）"""
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
         user_type = request.args.get('user_type')
         status = request.args.get('status')
         search = request.args.get('search')
@@ -560,7 +558,7 @@ def get_all_users(current_user):
         if search:
             query = query.filter(User.username.like(f'%{search}%') | User.real_name.like(f'%{search}%'))
 
-        result = paginate_query(query, page, per_page)
+        result = paginate_request(query, User)
 
         return success_response(result)
 
@@ -9,7 +9,7 @@ def seed_database():
     Seeds the database with initial data.
     This script will drop all existing tables and recreate them.
     """
-    app = create_app()
+    app = create_app({'BACKGROUND_JOBS_ENABLED': False})
     with app.app_context():
         print("Dropping all tables...")
         db.drop_all()
@@ -0,0 +1,63 @@
+import pytest
+from flask_jwt_extended import create_access_token
+
+from app import create_app
+from models import db, Account, Campus, CoachProfile, User
+from utils.cancel_limits import cancel_limiter
+from utils.table_index import table_index
+
+
+@pytest.fixture
+def app(tmp_path):
+    """使用临时 SQLite 数据库的测试应用，不启动后台任务"""
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "test.db"}',
+        'BACKGROUND_JOBS_ENABLED': False,
+        'ARCHIVE_DIR': str(tmp_path / 'archives')
+    })
+    # 进程内缓存按 id 索引，每个测试使用新数据库，需要清空
+    table_index.invalidate()
+    cancel_limiter.invalidate()
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def campus(app):
+    campus = Campus(name='测试校区')
+    db.session.add(campus)
+    db.session.commit()
+    return campus
+
+
+@pytest.fixture
+def make_user(campus):
+    """创建用户；学员同时创建账户，教练同时创建教练资料"""
+    def make(username, user_type, balance=0, hourly_rate=100):
+        user = User(username=username, password='x', real_name=username, user_type=user_type,
+                    campus_id=campus.id)
+        db.session.add(user)
+        db.session.flush()
+        if user_type == 'student':
+            db.session.add(Account(user_id=user.id, balance=balance))
+        if user_type == 'coach':
+            db.session.add(CoachProfile(user_id=user.id, coach_level='senior', hourly_rate=hourly_rate))
+        db.session.commit()
+        return user
+    return make
+
+
+@pytest.fixture
+def auth_headers(app):
+    """生成带 JWT 的请求头"""
+    def headers(user):
+        return {'Authorization': f'Bearer {create_access_token(identity=user.id)}'}
+    return headers
@@ -0,0 +1,88 @@
+import threading
+from datetime import date, time, timedelta
+
+import pytest
+
+from models import db, Booking, CancellationLimit
+from utils.cancel_limits import current_year_month
+from utils.occupancy import occupy_slots
+
+
+@pytest.fixture
+def coach(make_user):
+    return make_user('coach', 'coach')
+
+
+@pytest.fixture
+def student(make_user):
+    return make_user('student', 'student')
+
+
+def create_bookings(coach, student, count):
+    """为学员创建 count 个已确认预约，日期均在 24 小时之后"""
+    bookings = [Booking(
+        student_id=student.id, coach_id=coach.id, campus_id=student.campus_id,
+        booking_date=date.today() + timedelta(days=3 + i // 10),
+        start_time=time(8 + i % 10), end_time=time(9 + i % 10),
+        lesson_fee=100, status='confirmed'
+    ) for i in range(count)]
+    db.session.add_all(bookings)
+    db.session.flush()
+    occupy_slots(bookings, table=False)
+    db.session.commit()
+    return [booking.id for booking in bookings]
+
+
+def cancellation_count(user_id):
+    record = CancellationLimit.query.filter_by(user_id=user_id, year_month=current_year_month()).first()
+    return record.cancellation_count if record else 0
+
+
+def test_parallel_cancels_never_exceed_limit(app, auth_headers, coach, student):
+    thread_count = 12
+    limit = app.config['MONTHLY_CANCEL_LIMIT']
+    booking_ids = create_bookings(coach, student, thread_count)
+    headers = auth_headers(student)
+
+    results = []
+    results_lock = threading.Lock()
+    barrier = threading.Barrier(thread_count)
+
+    def worker(booking_id):
+        client = app.test_client()
+        barrier.wait()
+        response = client.post(f'/api/booking/{booking_id}/cancel', json={'reason': '并发测试'}, headers=headers)
+        with results_lock:
+            results.append(response.get_json())
+
+    threads = [threading.Thread(target=worker, args=(booking_id,)) for booking_id in booking_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    db.session.expire_all()
+    cancelled = Booking.query.filter(Booking.id.in_(booking_ids), Booking.status == 'cancelled').count()
+    succeeded = [result for result in results if result['success']]
+    assert len(results) == thread_count
+    assert len(succeeded) == cancelled == limit
+    assert all(result['message'] == f'本月取消次数已达上限（{limit}次）'
+               for result in results if not result['success'])
+    assert cancellation_count(student.id) == limit
+
+
+def test_coach_cancellation_not_counted(app, client, auth_headers, coach, student):
+    limit = app.config['MONTHLY_CANCEL_LIMIT']
+    booking_ids = create_bookings(coach, student, limit + 1)
+
+    response = client.post(f'/api/booking/{booking_ids[0]}/cancel', json={'reason': '教练有事'},
+                           headers=auth_headers(coach))
+    assert response.get_json()['success']
+    assert cancellation_count(coach.id) == 0
+    assert cancellation_count(student.id) == 0
+
+    # 学员仍有完整的本月取消次数
+    for booking_id in booking_ids[1:]:
+        response = client.post(f'/api/booking/{booking_id}/cancel', json={}, headers=auth_headers(student))
+        assert response.get_json()['success']
+    assert cancellation_count(student.id) == limit
@@ -0,0 +1,98 @@
+from decimal import Decimal
+
+import pytest
+
+from models import db, Account, Transaction
+from utils.accounts import (InsufficientBalance, LedgerNotMigrated, compact_balances, credit, debit,
+                            get_balance)
+
+
+@pytest.fixture
+def student(make_user):
+    return make_user('student', 'student')
+
+
+def account_of(user):
+    db.session.expire_all()
+    return Account.query.filter_by(user_id=user.id).one()
+
+
+def test_balance_is_snapshot_plus_tail(app, student):
+    app.config['LEDGER_COMPACTION_LAG_SECONDS'] = 0
+    credit(student.id, 300, '充值', transaction_type='deposit')
+    debit(student.id, 120, '课时费')
+    credit(student.id, 20, '退款')
+    db.session.commit()
+    assert account_of(student).balance == 0
+    assert account_of(student).current_balance == Decimal('200')
+
+    result = compact_balances()
+    account = account_of(student)
+    assert result['compacted'] == 1
+    assert account.balance == Decimal('200')
+    assert account.ledger_position == db.session.query(db.func.max(Transaction.id)).scalar()
+    assert account.current_balance == Decimal('200')
+
+    # 合并之后的交易计入快照之后的部分
+    debit(student.id, 50, '课时费')
+    db.session.commit()
+    account = account_of(student)
+    assert account.balance == Decimal('200')
+    assert account.current_balance == get_balance(student.id) == Decimal('150')
+
+    assert compact_balances()['compacted'] == 1
+    assert account_of(student).balance == Decimal('150')
+    assert compact_balances()['compacted'] == 0
+
+
+def test_pending_transaction_not_compacted(app, student):
+    app.config['LEDGER_COMPACTION_LAG_SECONDS'] = 0
+    credit(student.id, 100, '充值', transaction_type='deposit')
+    pending = credit(student.id, 500, '在线充值', transaction_type='deposit', status='pending')
+    credit(student.id, 30, '退款')
+    db.session.commit()
+
+    compact_balances()
+    account = account_of(student)
+    assert account.ledger_position == pending.id - 1
+    assert account.current_balance == Decimal('130')
+
+    pending.status = 'completed'
+    db.session.commit()
+    assert account_of(student).current_balance == Decimal('630')
+    compact_balances()
+    assert account_of(student).balance == Decimal('630')
+
+
+def test_debit_on_empty_balance_refused(student):
+    with pytest.raises(InsufficientBalance) as refused:
+        debit(student.id, 1, '课时费')
+    assert refused.value.balance == 0
+    db.session.rollback()
+    assert Transaction.query.count() == 0
+
+
+def test_debit_beyond_balance_refused(student):
+    credit(student.id, 100, '充值', transaction_type='deposit')
+    db.session.commit()
+    with pytest.raises(InsufficientBalance) as refused:
+        debit(student.id, Decimal('100.01'), '课时费')
+    assert refused.value.balance == Decimal('100')
+    db.session.rollback()
+
+    debit(student.id, 100, '课时费')
+    db.session.commit()
+    assert get_balance(student.id) == 0
+
+
+def test_legacy_account_refused(student):
+    credit(student.id, 100, '充值', transaction_type='deposit')
+    account = account_of(student)
+    account.snapshot_at = None
+    account.balance = 100
+    db.session.commit()
+
+    with pytest.raises(LedgerNotMigrated):
+        get_balance(student.id)
+    with pytest.raises(LedgerNotMigrated):
+        compact_balances()
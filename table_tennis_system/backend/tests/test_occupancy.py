@@ -0,0 +1,98 @@
+from datetime import date, time, timedelta
+
+import pytest
+
+from models import db, Booking, Table, TableSlot, UserSlot
+from utils.occupancy import SlotConflict, claim_status, occupy_slots, release_slots
+
+
+@pytest.fixture
+def coach(make_user):
+    return make_user('coach', 'coach')
+
+
+@pytest.fixture
+def tables(campus):
+    tables = [Table(table_number=f'T{i}', campus_id=campus.id) for i in (1, 2)]
+    db.session.add_all(tables)
+    db.session.commit()
+    return tables
+
+
+def book(student, coach, start, end, table=None):
+    """在当前事务中创建预约并写入占用记录，冲突时回滚并重新抛出 SlotConflict"""
+    booking = Booking(
+        student_id=student.id, coach_id=coach.id, campus_id=student.campus_id,
+        table_id=table.id if table else None,
+        booking_date=date.today() + timedelta(days=3),
+        start_time=start, end_time=end, lesson_fee=100, status='pending'
+    )
+    db.session.add(booking)
+    db.session.flush()
+    try:
+        occupy_slots(booking)
+    except SlotConflict:
+        db.session.rollback()
+        raise
+    db.session.commit()
+    return booking
+
+
+def test_overlapping_table_rejected(make_user, tables):
+    coach_a, coach_b = make_user('coach_a', 'coach'), make_user('coach_b', 'coach')
+    student_a, student_b = make_user('student_a', 'student'), make_user('student_b', 'student')
+    book(student_a, coach_a, time(9), time(10), tables[0])
+
+    with pytest.raises(SlotConflict) as conflict:
+        book(student_b, coach_b, time(9, 45), time(10, 45), tables[0])
+    assert conflict.value.resource == 'table'
+    assert Booking.query.count() == 1
+
+    # 换一张球台即可
+    book(student_b, coach_b, time(9, 45), time(10, 45), tables[1])
+
+
+def test_overlapping_coach_rejected(make_user, coach, tables):
+    student_a, student_b = make_user('student_a', 'student'), make_user('student_b', 'student')
+    book(student_a, coach, time(14), time(15, 30), tables[0])
+
+    with pytest.raises(SlotConflict) as conflict:
+        book(student_b, coach, time(15), time(16), tables[1])
+    assert conflict.value.resource == 'schedule'
+    assert Booking.query.count() == 1
+    assert TableSlot.query.filter_by(table_id=tables[1].id).count() == 0
+
+
+def test_back_to_back_bookings_allowed(make_user, coach, tables):
+    student = make_user('student', 'student')
+    first = book(student, coach, time(9), time(9, 45), tables[0])
+    second = book(student, coach, time(9, 45), time(10, 15), tables[0])
+    third = book(student, coach, time(10, 15), time(11), tables[0])
+
+    assert Booking.query.count() == 3
+    slots = [slot for (slot,) in db.session.query(TableSlot.slot).order_by(TableSlot.slot)]
+    assert slots == list(range(36, 44))
+    assert {booking.id for booking in (first, second, third)} == {
+        booking_id for (booking_id,) in db.session.query(TableSlot.booking_id).distinct()}
+
+
+def test_released_slots_can_be_booked_again(make_user, coach, tables):
+    student_a, student_b = make_user('student_a', 'student'), make_user('student_b', 'student')
+    booking = book(student_a, coach, time(9), time(10), tables[0])
+    claim_status(booking, 'pending', 'cancelled')
+    release_slots(booking.id)
+    db.session.commit()
+    assert UserSlot.query.count() == 0
+
+    book(student_b, coach, time(9), time(10), tables[0])
+
+
+def test_claim_status_succeeds_once(make_user, coach):
+    student = make_user('student', 'student')
+    booking = book(student, coach, time(9), time(10))
+
+    assert claim_status(booking, ['pending', 'confirmed'], 'cancelled')
+    assert booking.status == 'cancelled'
+    assert not claim_status(booking, ['pending', 'confirmed'], 'completed')
+    db.session.commit()
+    assert db.session.get(Booking, booking.id).status == 'cancelled'
@@ -0,0 +1,76 @@
+from decimal import Decimal
+
+import pytest
+
+from models import db, GatewayCallback, Transaction
+from utils.accounts import credit, get_balance
+from utils.payment_gateway import close_expired_orders, process_callbacks, sign
+
+
+@pytest.fixture
+def student(make_user):
+    return make_user('student', 'student')
+
+
+@pytest.fixture
+def closed_order(app, student):
+    """已超时关闭的在线充值订单"""
+    order = credit(student.id, Decimal('50.00'), 'wechat充值', transaction_type='deposit',
+                   payment_method='wechat', status='pending')
+    db.session.commit()
+    app.config['PAYMENT_ORDER_TIMEOUT_MINUTES'] = 0
+    assert close_expired_orders()['closed'] == 1
+    return order
+
+
+def notify(client, order, notify_id, trade_status='success'):
+    params = {
+        'notify_id': notify_id,
+        'out_trade_no': str(order.id),
+        'trade_no': 'T' + str(order.id),
+        'amount': str(order.amount),
+        'trade_status': trade_status
+    }
+    params['sign'] = sign(params)
+    response = client.post('/api/payment/gateway/notify', json=params)
+    return response.get_data(as_text=True)
+
+
+def late_credits(order):
+    return Transaction.query.filter(
+        Transaction.description == f'wechat充值（订单{order.id}关闭后支付）').all()
+
+
+@pytest.mark.parametrize('batch_size', [1, 500])
+def test_late_payment_credited_once(client, student, closed_order, batch_size):
+    # 网关重试和重复通知：同一通知投递两次，另有一个不同 notify_id 的成功通知
+    assert notify(client, closed_order, 'n1') == 'success'
+    assert notify(client, closed_order, 'n1') == 'success'
+    assert notify(client, closed_order, 'n2') == 'success'
+
+    totals = process_callbacks(batch_size)
+    assert totals['credited'] == 1
+    assert totals['ignored'] == 1
+
+    # 之后再到达的成功回调也不再补入账
+    assert notify(client, closed_order, 'n3') == 'success'
+    assert process_callbacks(batch_size)['credited'] == 0
+
+    db.session.expire_all()
+    assert len(late_credits(closed_order)) == 1
+    assert db.session.get(Transaction, closed_order.id).status == 'failed'
+    assert get_balance(student.id) == Decimal('50.00')
+    assert GatewayCallback.query.filter_by(result='credited').count() == 1
+    assert GatewayCallback.query.filter_by(result='pending').count() == 0
+
+
+def test_processed_callback_result_not_overwritten(client, closed_order):
+    assert notify(client, closed_order, 'n1') == 'success'
+    process_callbacks()
+    processed_at = GatewayCallback.query.filter_by(notify_id='n1').one().processed_at
+
+    # 再次处理不会改动已处理的回调
+    assert process_callbacks() == {'credited': 0, 'failed': 0, 'ignored': 0, 'rejected': 0}
+    callback = GatewayCallback.query.filter_by(notify_id='n1').one()
+    assert callback.result == 'credited'
+    assert callback.processed_at == processed_at
@@ -0,0 +1,44 @@
+from datetime import date, timedelta
+
+from utils.schedule_cache import CoachScheduleCache
+
+
+def test_schedule_range_limited(app, client, auth_headers, make_user):
+    coach = make_user('coach', 'coach')
+    start = date.today()
+    end = start + timedelta(days=app.config['SCHEDULE_MAX_DAYS'])
+    response = client.get(f'/api/booking/schedule/{coach.id}',
+                          query_string={'start_date': start.isoformat(), 'end_date': end.isoformat()},
+                          headers=auth_headers(coach))
+    assert response.status_code == 400
+
+    end -= timedelta(days=1)
+    response = client.get(f'/api/booking/schedule/{coach.id}',
+                          query_string={'start_date': start.isoformat(), 'end_date': end.isoformat()},
+                          headers=auth_headers(coach))
+    assert response.status_code == 200
+    assert len(response.get_json()['data']['schedule']) == app.config['SCHEDULE_MAX_DAYS']
+
+
+def test_cache_size_bounded(app):
+    app.config['SCHEDULE_CACHE_MAX_WEEKS'] = 10
+    cache = CoachScheduleCache()
+    monday = date(2026, 1, 5)
+    for coach_id in range(1, 6):
+        cache.get_range(coach_id, monday, monday + timedelta(weeks=8))
+        cache.invalidate(coach_id)
+        cache.get_range(coach_id, monday, monday + timedelta(weeks=8))
+    assert len(cache._weeks) <= 10
+    assert len(cache._generations) <= 10
+
+
+def test_expired_weeks_dropped(app):
+    cache = CoachScheduleCache()
+    monday = date(2026, 1, 5)
+    cache.get_range(1, monday, monday + timedelta(weeks=4))
+    # 让已缓存的周超过有效期
+    ttl = app.config['SCHEDULE_CACHE_TTL']
+    for key, (built_at, days, digest) in list(cache._weeks.items()):
+        cache._weeks[key] = (built_at - ttl - 1, days, digest)
+    cache.get_range(2, monday, monday)
+    assert list(cache._weeks) == [(2, monday)]
@@ -0,0 +1,27 @@
+from datetime import date, time, timedelta
+
+from models import db, Table
+from utils.table_index import TableOccupancyIndex
+
+
+def test_past_and_expired_days_dropped(app, campus):
+    db.session.add(Table(table_number='T1', campus_id=campus.id))
+    db.session.commit()
+    index = TableOccupancyIndex()
+    today = date.today()
+    index.free_tables(campus.id, today - timedelta(days=1), time(9), time(10))
+    assert len(index._days) == 1
+
+    # 加载其他日期时丢弃今天之前的日期
+    for n in range(3):
+        index.free_tables(campus.id, today + timedelta(days=n), time(9), time(10))
+    assert sorted(day for _, day in index._days) == [today + timedelta(days=n) for n in range(3)]
+
+    # 已过期的条目也一并丢弃，校区没有已加载的日期后不再记录球台所属校区
+    for day in index._days.values():
+        day.built_at -= app.config['TABLE_INDEX_TTL'] + 1
+    other = date(2099, 1, 1)
+    index.free_tables(campus.id, other, time(9), time(10))
+    assert list(index._days) == [(campus.id, other)]
+    index.invalidate()
+    assert index._days == {} and index._table_campus == {} and index._locations == {}
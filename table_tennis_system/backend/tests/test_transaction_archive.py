@@ -0,0 +1,66 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert
+
+from models import db, Transaction, TransactionArchive
+from utils.accounts import compact_balances, get_balance
+from utils.payment_stats import rollup_payment_stats
+from utils.transaction_archive import archive_transactions, user_transactions_page, verify_archive
+
+
+@pytest.fixture
+def student(app, make_user):
+    """两年前起每月一笔充值的学员，交易均已计入汇总和余额快照"""
+    student = make_user('student', 'student')
+    start = datetime.utcnow().replace(day=1) - timedelta(days=730)
+    db.session.execute(insert(Transaction), [{
+        'user_id': student.id,
+        'transaction_type': 'deposit',
+        'amount': 10,
+        'payment_method': 'offline',
+        'status': 'completed',
+        'description': '测试充值',
+        'created_at': start + timedelta(days=31 * i)
+    } for i in range(24)])
+    db.session.commit()
+    app.config.update(PAYMENT_STATS_LAG_SECONDS=0, LEDGER_COMPACTION_LAG_SECONDS=0)
+    rollup_payment_stats()
+    compact_balances()
+    return student
+
+
+def test_archive_keeps_history_readable(app, student):
+    result = archive_transactions()
+    assert result['archived']
+    # 再次运行不会重复归档同一个月
+    assert archive_transactions()['archived'] == []
+
+    archives = TransactionArchive.query.all()
+    assert len(archives) == len(result['archived'])
+    assert all(verify_archive(archive) and os.path.isabs(archive.file_path) for archive in archives)
+    assert not [name for name in os.listdir(app.config['ARCHIVE_DIR']) if name.endswith('.tmp')]
+
+    page = user_transactions_page(student.id, per_page=100)
+    assert page['total'] == 24
+    assert len({item['id'] for item in page['items']}) == 24
+    assert get_balance(student.id) == 240
+
+
+def test_damaged_archive_stops_purge(app, student):
+    archive_transactions(max_months=1)
+    archive = TransactionArchive.query.one()
+    with open(archive.file_path, 'ab') as archive_file:
+        archive_file.write(b'x')
+
+    with pytest.raises(RuntimeError):
+        archive_transactions()
+    assert TransactionArchive.query.count() == 1
+
+
+def test_relative_archive_dir_rejected(app, student):
+    app.config['ARCHIVE_DIR'] = 'archives'
+    with pytest.raises(RuntimeError):
+        archive_transactions()
+    assert Transaction.query.count() == 24
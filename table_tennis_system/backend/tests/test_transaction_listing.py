@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert
+
+from models import db, Transaction, User
+from utils.statement_budget import statement_budget
+
+TRANSACTION_COUNT = 150
+
+
+@pytest.fixture
+def admin(make_user):
+    return make_user('admin', 'super_admin')
+
+
+@pytest.fixture
+def transactions(make_user):
+    """三个学员的交易，交易时间各不相同"""
+    students = [make_user(f'student{i}', 'student') for i in range(3)]
+    start = datetime(2026, 1, 1)
+    db.session.execute(insert(Transaction), [{
+        'user_id': students[i % len(students)].id,
+        'transaction_type': 'deposit',
+        'amount': 10,
+        'payment_method': 'offline',
+        'status': 'completed',
+        'description': '测试充值',
+        'created_at': start + timedelta(minutes=i)
+    } for i in range(TRANSACTION_COUNT)])
+    db.session.commit()
+
+
+@pytest.mark.parametrize('per_page', [1, 100])
+def test_page_mode_within_statement_budget(client, auth_headers, admin, transactions, per_page):
+    # 超出 statement_budget(2) 时接口在测试模式下抛出 AssertionError
+    for page in (1, 2):
+        response = client.get('/api/payment/admin/transactions',
+                              query_string={'per_page': per_page, 'page': page}, headers=auth_headers(admin))
+        assert response.status_code == 200
+        data = response.get_json()['data']
+        assert len(data['items']) == min(per_page, TRANSACTION_COUNT - (page - 1) * per_page)
+        assert data['total'] == TRANSACTION_COUNT
+        assert all(item['user']['username'].startswith('student') for item in data['items'])
+
+
+@pytest.mark.parametrize('per_page', [1, 100])
+def test_cursor_mode_within_statement_budget(client, auth_headers, admin, transactions, per_page):
+    seen = []
+    after = ''
+    for _ in range(2):
+        response = client.get('/api/payment/admin/transactions',
+                              query_string={'per_page': per_page, 'after': after}, headers=auth_headers(admin))
+        assert response.status_code == 200
+        data = response.get_json()['data']
+        assert data['items'] and all('user' in item for item in data['items'])
+        seen.extend(item['id'] for item in data['items'])
+        after = data['next_cursor']
+    assert len(seen) == len(set(seen)) == min(2 * per_page, TRANSACTION_COUNT)
+
+
+def test_statement_budget_rejects_per_row_queries(app, transactions):
+    @statement_budget(2)
+    def list_with_lazy_users():
+        return [db.session.get(User, transaction.user_id).username
+                for transaction in Transaction.query.limit(5)]
+
+    with app.test_request_context():
+        db.session.expire_all()
+        with pytest.raises(AssertionError):
+            list_with_lazy_users()
+
+
+
+def test_statement_budget_listener_scoped_to_call(app):
+    def listener_count():
+        return len(db.engine.dispatch.before_cursor_execute)
+
+    before = listener_count()
+
+    @statement_budget(2)
+    def count_during_call():
+        return listener_count()
+
+    with app.test_request_context():
+        assert count_during_call() == before + 1
+        assert listener_count() == before
+
+        # 非测试模式不注册监听
+        app.testing = False
+        try:
+            assert count_during_call() == before
+        finally:
+            app.testing = True
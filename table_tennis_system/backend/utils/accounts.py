@@ -0,0 +1,220 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from flask import current_app
+from sqlalchemy import inspect, insert, text, update
+from models import Account, Transaction, db, signed_amount
+
+
+class InsufficientBalance(Exception):
+    """账户不存在或余额不足，balance 为失败时的当前余额"""
+
+    def __init__(self, balance=None):
+        super().__init__(balance)
+        self.balance = balance if balance is not None else Decimal('0')
+
+
+class LedgerNotMigrated(Exception):
+    """账户仍是升级前的数据：余额已包含全部历史交易，但 ledger_position 为 0"""
+
+    def __init__(self, message='账户余额数据尚未升级，请先运行 flask upgrade-ledger'):
+        super().__init__(message)
+
+
+def _legacy_criteria():
+    """升级前的账户：ledger_position 为 0、没有快照时间且已有交易，此时实时余额会重复计入历史交易"""
+    return [
+        Account.ledger_position == 0,
+        Account.snapshot_at.is_(None),
+        db.session.query(Transaction.id).filter(Transaction.user_id == Account.user_id).exists()
+    ]
+
+
+def ensure_ledger_migrated(account):
+    """账户尚未升级时抛出 LedgerNotMigrated，避免返回重复计入历史交易的余额"""
+    if account is not None and account.ledger_position == 0 and account.snapshot_at is None:
+        if db.session.query(Transaction.id).filter(Transaction.user_id == account.user_id).first():
+            raise LedgerNotMigrated()
+
+
+def upgrade_ledger():
+    """把升级前的账户接入交易流水余额
+
+    旧版本的 balance 已包含全部历史交易，因此把 ledger_position 设为当前最大交易 id。
+    必须在新代码对外提供余额之前执行一次；缺少新列时先添加。返回升级的账户数。
+    """
+    columns = {column['name'] for column in inspect(db.engine).get_columns('accounts')}
+    if 'ledger_position' not in columns:
+        db.session.execute(text('ALTER TABLE accounts ADD COLUMN ledger_position INT NOT NULL DEFAULT 0'))
+    if 'snapshot_at' not in columns:
+        db.session.execute(text('ALTER TABLE accounts ADD COLUMN snapshot_at DATETIME NULL'))
+    db.session.commit()
+
+    position = db.session.query(db.func.coalesce(db.func.max(Transaction.id), 0)).scalar()
+    upgraded = Account.query.filter(
+        Account.ledger_position == 0, Account.snapshot_at.is_(None)
+    ).update({'ledger_position': position, 'snapshot_at': datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    return upgraded
+
+
+def _ledger_delta(user_id, after_position, lock=False):
+    """快照位置之后该用户已完成交易的合计"""
+    query = db.session.query(db.func.coalesce(db.func.sum(signed_amount), 0)).filter(
+        Transaction.user_id == user_id,
+        Transaction.id > after_position,
+        Transaction.status == 'completed'
+    )
+    if lock:
+        # 加共享锁的读取总是读最新已提交数据，不受可重复读隔离级别下旧快照的影响
+        query = query.with_for_update(read=True)
+    return query.scalar()
+
+
+def get_balance(user_id, lock=False):
+    """实时余额 = 余额快照 + 快照之后的交易合计，账户不存在时返回 None
+
+    lock 为真时对账户行加排他锁、对快照之后的交易加共享锁，直到当前事务结束：
+    账户行锁让同一用户的扣款依次执行，共享锁保证读到其他事务刚提交的扣款。
+    """
+    query = db.session.query(Account.user_id, Account.balance, Account.ledger_position,
+                             Account.snapshot_at).filter(Account.user_id == user_id)
+    if lock:
+        query = query.with_for_update()
+    row = query.first()
+    if row is None:
+        return None
+    ensure_ledger_migrated(row)
+    return row.balance + _ledger_delta(user_id, row.ledger_position, lock=lock)
+
+
+def _record(user_id, transaction_type, amount, description, payment_method, related_booking_id, status):
+    transaction = Transaction(
+        user_id=user_id,
+        transaction_type=transaction_type,
+        amount=amount,
+        payment_method=payment_method,
+        status=status,
+        description=description,
+        related_booking_id=related_booking_id
+    )
+    db.session.add(transaction)
+    return transaction
+
+
+def debit(user_id, amount, description, related_booking_id=None, payment_method='system'):
+    """在当前事务中扣款：只追加一条扣款交易，不修改账户行，但仍要锁账户行
+
+    同一用户的两笔扣款若都按未锁定的余额判断，会一起通过检查而扣成负数，因此扣款
+    先对账户行加排他锁（SELECT ... FOR UPDATE）并对快照之后的交易加共享锁，再计算
+    实时余额。同一用户的扣款之间、以及扣款与该用户的加款之间仍会互相等待，直到扣款
+    事务结束；不同用户的扣款互不影响。余额不足时抛出 InsufficientBalance，调用方负责回滚。
+    """
+    amount = Decimal(str(amount))
+    balance = get_balance(user_id, lock=True)
+    if balance is None or balance < amount:
+        raise InsufficientBalance(balance)
+    return _record(user_id, 'withdraw', amount, description, payment_method, related_booking_id, 'completed')
+
+
+def credit(user_id, amount, description, transaction_type='refund', payment_method='system',
+           related_booking_id=None, status='completed', create_missing=False):
+    """在当前事务中加款：只追加一条交易，不锁也不修改账户行
+
+    该用户有未结束的扣款事务时，插入会等待扣款持有的交易共享锁释放。
+
+    账户不存在时，create_missing 为真则创建余额为 0 的账户，否则不加款并返回 None。
+    """
+    amount = Decimal(str(amount))
+    exists = db.session.query(Account.id).filter(Account.user_id == user_id).first()
+    if not exists:
+        if not create_missing:
+            return None
+        db.session.add(Account(user_id=user_id, balance=0))
+    return _record(user_id, transaction_type, amount, description, payment_method, related_booking_id, status)
+
+
+def credit_many(entries, transaction_type='refund', payment_method='system'):
+    """批量加款：一条 executemany INSERT 写入全部交易
+
+    entries 为 [{'user_id', 'amount', 'description', 'related_booking_id'}]。
+    没有账户的用户会被跳过，返回实际写入的交易数。
+    """
+    if not entries:
+        return 0
+
+    existing = {user_id for (user_id,) in db.session.query(Account.user_id).filter(
+        Account.user_id.in_({entry['user_id'] for entry in entries}))}
+    if not existing:
+        return 0
+
+    now = datetime.utcnow()
+    rows = [{
+        'user_id': entry['user_id'],
+        'transaction_type': transaction_type,
+        'amount': entry['amount'],
+        'payment_method': payment_method,
+        'status': 'completed',
+        'description': entry['description'],
+        'related_booking_id': entry.get('related_booking_id'),
+        'created_at': now
+    } for entry in entries if entry['user_id'] in existing]
+    db.session.execute(insert(Transaction), rows)
+    return len(rows)
+
+
+def compact_balances(batch_size=None):
+    """把快照位置之后的交易合并进余额快照，缩短实时余额需要累加的交易范围
+
+    水位只取 LEDGER_COMPACTION_LAG_SECONDS 秒之前写入的交易，避免 id 较小但尚未提交的交易
+    在合并后才提交而被跳过；也不越过最早的待处理交易（它以后可能变为已完成）。
+    每批按 user_id 升序锁住账户后一次性更新并提交，返回合并的账户数和水位。
+    """
+    if db.session.query(Account.id).filter(*_legacy_criteria()).first():
+        raise LedgerNotMigrated()
+
+    config = current_app.config
+    batch_size = batch_size or config['LEDGER_COMPACTION_BATCH_SIZE']
+    cutoff = datetime.utcnow() - timedelta(seconds=config['LEDGER_COMPACTION_LAG_SECONDS'])
+    watermark = db.session.query(db.func.max(Transaction.id)).filter(Transaction.created_at <= cutoff).scalar() or 0
+    first_pending = db.session.query(db.func.min(Transaction.id)).filter(Transaction.status == 'pending').scalar()
+    if first_pending is not None:
+        watermark = min(watermark, first_pending - 1)
+
+    compacted = 0
+    last_user_id = 0
+    while True:
+        user_ids = [user_id for (user_id,) in db.session.query(Account.user_id).filter(
+            Account.user_id > last_user_id,
+            Account.ledger_position < watermark,
+            db.session.query(Transaction.id).filter(
+                Transaction.user_id == Account.user_id,
+                Transaction.id > Account.ledger_position,
+                Transaction.id <= watermark
+            ).exists()
+        ).order_by(Account.user_id).limit(batch_size)]
+        if not user_ids:
+            break
+        last_user_id = user_ids[-1]
+
+        db.session.query(Account.id).filter(Account.user_id.in_(user_ids)).order_by(
+            Account.user_id).with_for_update().all()
+        delta = db.select(db.func.coalesce(db.func.sum(signed_amount), 0)).where(
+            Transaction.user_id == Account.user_id,
+            Transaction.id > Account.ledger_position,
+            Transaction.id <= watermark,
+            Transaction.status == 'completed'
+        ).correlate(Account).scalar_subquery()
+        # 余额要用旧的 ledger_position 计算，因此必须先于 ledger_position 赋值
+        db.session.execute(
+            # 多个进程同时合并时，水位较低的一方不能把快照位置往回拨
+            update(Account).where(Account.user_id.in_(user_ids), Account.ledger_position < watermark).ordered_values(
+                (Account.balance, Account.balance + delta),
+                (Account.ledger_position, watermark),
+                (Account.snapshot_at, datetime.utcnow())
+            ).execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        compacted += len(user_ids)
+
+    return {'compacted': compacted, 'watermark': watermark}
@@ -1,7 +1,11 @@
 from functools import wraps
 from flask import request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request
+from sqlalchemy import and_, or_
+from datetime import datetime
+import base64
 import bcrypt
+import json
 import re
 from models import User, SystemLog, db
 
@@ -91,15 +95,19 @@ def success_response(data=None, message="操作成功"):
         response['data'] = data
     return jsonify(response)
 
-def error_response(message="操作失败", code=400):
+def error_response(message="操作失败", code=400, data=None):
     """错误响应格式"""
-    return jsonify({
+    response = {
         'success': False,
         'message': message
-    }), code
+    }
+    if data is not None:
+        response['data'] = data
+    return jsonify(response), code
 
-def paginate_query(query, page=1, per_page=10):
-    """分页查询"""
+def paginate_query(query, page=1, per_page=10, serialize=None):
+    """分页查询，serialize 把每行转换为字典，默认调用 to_dict()"""
+    serialize = serialize or (lambda item: item.to_dict())
     try:
         page = int(page) if page else 1
         per_page = int(per_page) if per_page else 10
@@ -112,7 +120,7 @@ def paginate_query(query, page=1, per_page=10):
         )
 
         return {
-            'items': [item.to_dict() for item in paginated.items],
+            'items': [serialize(item) for item in paginated.items],
             'total': paginated.total,
             'pages': paginated.pages,
             'current_page': page,
@@ -130,4 +138,59 @@ def paginate_query(query, page=1, per_page=10):
             'per_page': per_page,
             'has_next': False,
             'has_prev': False
-        }
\ No newline at end of file
+        }
+
+def encode_cursor(created_at, item_id):
+    """把排序键 (created_at, id) 编码为不透明的游标"""
+    payload = json.dumps([created_at.isoformat() if created_at else None, item_id])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """解析游标，格式不正确时抛出 ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return (datetime.fromisoformat(created_at) if created_at else None), int(item_id)
+    except Exception:
+        raise ValueError('无效的分页游标')
+
+def cursor_paginate(query, model, after=None, per_page=10, serialize=None):
+    """游标分页：按 (created_at, id) 倒序，用上一页最后一条的排序键定位
+
+    不使用 OFFSET，也不执行 COUNT 查询；after 为空时返回第一页。query 也可以是列投影查询，
+    此时需包含 created_at 和 id 列，并用 serialize 把每行转换为字典。
+    """
+    serialize = serialize or (lambda item: item.to_dict())
+    per_page = min(int(per_page) if per_page else 10, 100)
+    query = query.order_by(None).order_by(model.created_at.desc(), model.id.desc())
+
+    if after:
+        created_at, item_id = decode_cursor(after)
+        if created_at is None:
+            query = query.filter(model.created_at.is_(None), model.id < item_id)
+        else:
+            query = query.filter(or_(
+                model.created_at < created_at,
+                model.created_at.is_(None),
+                and_(model.created_at == created_at, model.id < item_id)
+            ))
+
+    rows = query.limit(per_page + 1).all()
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    last = rows[-1] if rows else None
+
+    return {
+        'items': [serialize(item) for item in rows],
+        'per_page': per_page,
+        'has_next': has_next,
+        'next_cursor': encode_cursor(last.created_at, last.id) if has_next else None
+    }
+
+def paginate_request(query, model, default_per_page=10, serialize=None):
+    """按请求参数选择分页方式：带 after 参数（可为空）时使用游标分页，否则按页码分页"""
+    per_page = request.args.get('per_page', default_per_page, type=int)
+    if 'after' in request.args:
+        return cursor_paginate(query, model, request.args.get('after'), per_page, serialize)
+    return paginate_query(query, request.args.get('page', 1, type=int), per_page, serialize)
+
@@ -0,0 +1,141 @@
+from datetime import time, timedelta
+
+from sqlalchemy import case, insert, literal, or_, select
+from sqlalchemy.exc import IntegrityError
+from models import BlockoutCancellation, Booking, CoachBlockout, SlotHold, User, UserSlot, WaitlistEntry, db
+from utils.occupancy import SlotConflict, booking_slots, release_slots
+from utils.refunds import refund_in_chunks
+from utils.slot_holds import delete_holds
+
+# 未指定时间时请假覆盖全天
+DAY_START = time(0, 0)
+DAY_END = time(23, 59, 59)
+
+
+def overlapping_blockouts(coach_id, start_date, end_date, start_time, end_time):
+    """与日期范围和每日时间段重叠的有效请假"""
+    return CoachBlockout.query.filter(
+        CoachBlockout.coach_id == coach_id,
+        CoachBlockout.status == 'active',
+        CoachBlockout.start_date <= end_date,
+        CoachBlockout.end_date >= start_date,
+        CoachBlockout.start_time < end_time,
+        CoachBlockout.end_time > start_time
+    )
+
+
+def blocked_dates(coach_id, dates, start_time, end_time):
+    """dates 中教练在该时间段请假的日期"""
+    if not dates:
+        return []
+    blockouts = overlapping_blockouts(coach_id, min(dates), max(dates), start_time, end_time).all()
+    return sorted({day for day in dates
+                   for blockout in blockouts if blockout.start_date <= day <= blockout.end_date})
+
+
+def blockout_busy_rows(coach_id, start_date, end_date):
+    """日期范围内教练请假占用的 (日期, 开始时间, 结束时间)，与预约一起计算空闲时间"""
+    rows = []
+    for blockout in overlapping_blockouts(coach_id, start_date, end_date, DAY_START, DAY_END):
+        day = max(blockout.start_date, start_date)
+        while day <= min(blockout.end_date, end_date):
+            rows.append((day, blockout.start_time, blockout.end_time))
+            day += timedelta(days=1)
+    return rows
+
+
+def apply_blockout(blockout):
+    """在当前事务中登记请假：批量取消重叠的预约、保留和候补，并占用教练的时间片
+
+    被取消的预约写入 blockout_cancellations，已扣费的（已确认，或系列预约在待确认时已预付）
+    标记为待退款，由 refund_blockout() 退款。时间片占用保证之后的预约、保留和候补转正
+    都无法落在请假时段内；与并发提交的新预约冲突时抛出 SlotConflict，调用方回滚后重试。
+    返回 (被取消的预约行, 被删除的保留行)。
+    """
+    overlap = [
+        Booking.coach_id == blockout.coach_id,
+        Booking.booking_date >= blockout.start_date,
+        Booking.booking_date <= blockout.end_date,
+        Booking.start_time < blockout.end_time,
+        Booking.end_time > blockout.start_time,
+        Booking.status.in_(['pending', 'confirmed'])
+    ]
+    bookings = db.session.query(
+        Booking.id, Booking.coach_id, Booking.booking_date
+    ).filter(*overlap).with_for_update().all()
+    booking_ids = [row.id for row in bookings]
+
+    if booking_ids:
+        refundable = or_(Booking.status == 'confirmed', Booking.series_id.isnot(None))
+        db.session.execute(insert(BlockoutCancellation).from_select(
+            ['blockout_id', 'booking_id', 'refund_status'],
+            select(literal(blockout.id), Booking.id, case((refundable, 'pending'), else_='none'))
+            .where(Booking.id.in_(booking_ids))
+        ))
+        Booking.query.filter(Booking.id.in_(booking_ids)).update(
+            {'status': 'cancelled'}, synchronize_session=False)
+        release_slots(booking_ids)
+
+    holds = db.session.query(SlotHold.id, SlotHold.campus_id, SlotHold.booking_date).filter(
+        SlotHold.coach_id == blockout.coach_id,
+        SlotHold.booking_date >= blockout.start_date,
+        SlotHold.booking_date <= blockout.end_date,
+        SlotHold.start_time < blockout.end_time,
+        SlotHold.end_time > blockout.start_time
+    ).all()
+    delete_holds([row.id for row in holds])
+
+    WaitlistEntry.query.filter(
+        WaitlistEntry.coach_id == blockout.coach_id,
+        WaitlistEntry.booking_date >= blockout.start_date,
+        WaitlistEntry.booking_date <= blockout.end_date,
+        WaitlistEntry.window_start < blockout.end_time,
+        WaitlistEntry.window_end > blockout.start_time,
+        WaitlistEntry.status == 'waiting'
+    ).update({'status': 'cancelled'}, synchronize_session=False)
+
+    slots = booking_slots(blockout.start_time, blockout.end_time)
+    rows = []
+    day = blockout.start_date
+    while day <= blockout.end_date:
+        rows.extend({'user_id': blockout.coach_id, 'slot_date': day, 'slot': slot,
+                     'booking_id': None, 'hold_id': None, 'block_id': blockout.id} for slot in slots)
+        day += timedelta(days=1)
+    try:
+        db.session.execute(insert(UserSlot), rows)
+    except IntegrityError:
+        raise SlotConflict('schedule')
+
+    return bookings, holds
+
+
+def refund_blockout(blockout_id=None, progress=None):
+    """为请假取消的预约退还课时费，不指定请假时处理所有待退款记录
+
+    通过 refund_in_chunks 分批写入退款交易并标记已退款，中断后再次调用会继续。
+    """
+    source = select(
+        BlockoutCancellation.id.label('key'),
+        Booking.student_id.label('user_id'),
+        Booking.lesson_fee.label('amount'),
+        (literal('预约取消退费 - 教练: ') + User.real_name + literal(' (教练请假)')).label('description'),
+        Booking.id.label('related_booking_id')
+    ).join(
+        Booking, Booking.id == BlockoutCancellation.booking_id
+    ).join(
+        User, User.id == Booking.coach_id
+    ).where(BlockoutCancellation.refund_status == 'pending')
+    if blockout_id is not None:
+        source = source.where(BlockoutCancellation.blockout_id == blockout_id)
+
+    def mark_refunded(keys):
+        BlockoutCancellation.query.filter(BlockoutCancellation.id.in_(keys)).update(
+            {'refund_status': 'refunded'}, synchronize_session=False)
+
+    return refund_in_chunks(source, mark_refunded, progress=progress)
+
+
+def lift_blockout(blockout):
+    """在当前事务中撤销请假，释放教练的时间片；已取消的预约不会恢复"""
+    blockout.status = 'lifted'
+    UserSlot.query.filter_by(block_id=blockout.id).delete(synchronize_session=False)
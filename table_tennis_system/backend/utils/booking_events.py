@@ -0,0 +1,16 @@
+from utils.table_index import table_index
+from utils.schedule_cache import schedule_cache
+
+
+def booking_changed(booking):
+    """预约创建或状态变化（确认、取消、完成）提交后，同步进程内的索引和缓存"""
+    table_index.sync(booking)
+    schedule_cache.invalidate(booking.coach_id, booking.booking_date)
+
+
+def bookings_changed(rows):
+    """批量更新预约状态后使相关索引和缓存失效，rows 需包含 coach_id 和 booking_date"""
+    for booking_date in {row.booking_date for row in rows}:
+        table_index.invalidate(booking_date=booking_date)
+    for coach_id, booking_date in {(row.coach_id, row.booking_date) for row in rows}:
+        schedule_cache.invalidate(coach_id, booking_date)
@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, or_, insert
+from models import Booking, SystemLog, db
+from utils.accounts import credit_many
+from utils.booking_events import bookings_changed
+from utils.occupancy import release_slots
+from utils.slot_holds import reclaim_expired_holds, holds_released
+
+
+def _bulk_log(action, rows, describe):
+    """一条多行 INSERT 写入批量任务的系统日志"""
+    now = datetime.utcnow()
+    db.session.execute(insert(SystemLog), [{
+        'user_id': row.student_id,
+        'action': action,
+        'description': describe(row),
+        'ip_address': None,
+        'created_at': now
+    } for row in rows])
+
+
+def _refund_prepaid(rows, description):
+    """退还系列预约预付的课时费：按学员汇总后批量加款并批量写入退费交易"""
+    return credit_many([{
+        'user_id': row.student_id,
+        'amount': row.lesson_fee,
+        'description': description,
+        'related_booking_id': row.id
+    } for row in rows if row.series_id])
+
+
+def _select_batch(criteria, batch_size):
+    """加锁选出一批待处理的预约，跳过被其他事务锁定的行"""
+    return db.session.query(
+        Booking.id, Booking.student_id, Booking.coach_id, Booking.booking_date,
+        Booking.lesson_fee, Booking.series_id
+    ).filter(criteria).order_by(Booking.id).limit(batch_size).with_for_update(skip_locked=True).all()
+
+
+def expire_pending_bookings(batch_size=None):
+    """将超过 PENDING_BOOKING_TTL_HOURS 未确认或已到上课时间的待确认预约批量取消
+
+    每批用一次加锁查询选出预约、一条 UPDATE 修改状态，并批量释放时间片、退还预付费用、
+    写入系统日志。返回本次处理的数量。
+    """
+    batch_size = batch_size or current_app.config['BOOKING_JOB_BATCH_SIZE']
+    ttl = timedelta(hours=current_app.config['PENDING_BOOKING_TTL_HOURS'])
+    now = datetime.now()
+
+    stale = and_(
+        Booking.status == 'pending',
+        or_(
+            Booking.created_at < datetime.utcnow() - ttl,
+            Booking.booking_date < now.date(),
+            and_(Booking.booking_date == now.date(), Booking.start_time <= now.time())
+        )
+    )
+
+    expired = refunded = batches = 0
+    while True:
+        rows = _select_batch(stale, batch_size)
+        if not rows:
+            break
+
+        booking_ids = [row.id for row in rows]
+        Booking.query.filter(Booking.id.in_(booking_ids)).update(
+            {'status': 'cancelled'}, synchronize_session=False)
+        release_slots(booking_ids)
+        refunded += _refund_prepaid(rows, '待确认预约超时退费')
+        _bulk_log('expire_booking', rows, lambda row: f'待确认预约超时自动取消: 预约{row.id}')
+        db.session.commit()
+        bookings_changed(rows)
+
+        expired += len(rows)
+        batches += 1
+        if len(rows) < batch_size:
+            break
+
+    return {'expired': expired, 'refunded': refunded, 'batches': batches}
+
+
+def complete_elapsed_bookings(batch_size=None):
+    """将已过下课时间的已确认预约分批置为已完成，并写入一条汇总日志
+
+    返回本次完成的数量、批次数和涉及的教练数。
+    """
+    batch_size = batch_size or current_app.config['BOOKING_JOB_BATCH_SIZE']
+    now = datetime.now()
+
+    elapsed = and_(
+        Booking.status == 'confirmed',
+        or_(
+            Booking.booking_date < now.date(),
+            and_(Booking.booking_date == now.date(), Booking.end_time <= now.time())
+        )
+    )
+
+    completed = batches = 0
+    coaches = set()
+    while True:
+        rows = _select_batch(elapsed, batch_size)
+        if not rows:
+            break
+
+        booking_ids = [row.id for row in rows]
+        Booking.query.filter(Booking.id.in_(booking_ids)).update(
+            {'status': 'completed'}, synchronize_session=False)
+        release_slots(booking_ids)
+        db.session.commit()
+        bookings_changed(rows)
+
+        completed += len(rows)
+        batches += 1
+        coaches.update(row.coach_id for row in rows)
+        if len(rows) < batch_size:
+            break
+
+    summary = {'completed': completed, 'batches': batches, 'coaches': len(coaches)}
+    if completed:
+        db.session.add(SystemLog(
+            action='auto_complete_bookings',
+            description=f'自动完成已结束课程: {completed}节, 涉及教练{len(coaches)}人, 共{batches}批'
+        ))
+        db.session.commit()
+    return summary
+
+
+def sweep_expired_holds():
+    """回收已过期的时间片保留，释放其占用的时间片"""
+    rows = reclaim_expired_holds()
+    db.session.commit()
+    holds_released(rows)
+    return {'reclaimed': len(rows)}
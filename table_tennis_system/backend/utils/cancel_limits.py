@@ -0,0 +1,85 @@
+import threading
+import time as _time
+from datetime import date, datetime
+
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from models import CancellationLimit, db
+
+
+def current_year_month():
+    return date.today().strftime('%Y-%m')
+
+
+class CancellationLimiter:
+    """学员每月取消次数限制
+
+    计数保存在 cancellation_limits 表中，取消事务内用一条 upsert 原子加一并取回新值；
+    进程内缓存已知的计数，本月次数已用完的用户无需访问数据库即可直接拒绝。
+    计数只增不减，缓存条目超过 CANCEL_LIMIT_CACHE_TTL 秒后丢弃，以便管理员清零后生效。
+    """
+
+    def __init__(self):
+        self._counts = {}   # (user_id, year_month) -> (cached_at, count)
+        self._lock = threading.Lock()
+
+    def limit(self):
+        return current_app.config['MONTHLY_CANCEL_LIMIT']
+
+    def cached_count(self, user_id, year_month=None):
+        """缓存中的本月取消次数，未命中返回 None"""
+        key = (user_id, year_month or current_year_month())
+        with self._lock:
+            entry = self._counts.get(key)
+        if entry is None or _time.monotonic() - entry[0] > current_app.config['CANCEL_LIMIT_CACHE_TTL']:
+            return None
+        return entry[1]
+
+    def is_exhausted(self, user_id, year_month=None):
+        """根据缓存判断本月取消次数是否已用完，未命中时交由 consume() 裁决"""
+        count = self.cached_count(user_id, year_month)
+        return count is not None and count >= self.limit()
+
+    def remember(self, user_id, year_month, count):
+        with self._lock:
+            self._counts[(user_id, year_month)] = (_time.monotonic(), count)
+
+    def invalidate(self, user_id=None):
+        """丢弃缓存的计数（管理员清零后调用），不传参数时清空全部"""
+        with self._lock:
+            for key in list(self._counts):
+                if user_id is None or key[0] == user_id:
+                    del self._counts[key]
+
+    def consume(self, user_id, year_month=None):
+        """在当前事务中把本月取消次数加一，返回加一后的次数
+
+        upsert 会锁住该用户当月的计数行，并发取消依次执行；调用方发现超过上限时回滚整个事务。
+        """
+        year_month = year_month or current_year_month()
+        now = datetime.utcnow()
+        values = {'user_id': user_id, 'year_month': year_month, 'cancellation_count': 1,
+                  'created_at': now, 'updated_at': now}
+        dialect = db.session.get_bind().dialect.name
+
+        if dialect == 'mysql':
+            # LAST_INSERT_ID(expr) 让新计数随 OK 包返回，插入时影响行数为 1，更新时为 2
+            stmt = mysql.insert(CancellationLimit).values(**values).on_duplicate_key_update(
+                cancellation_count=func.last_insert_id(CancellationLimit.cancellation_count + 1),
+                updated_at=now
+            )
+            result = db.session.execute(stmt)
+            return 1 if result.rowcount == 1 else result.lastrowid
+
+        dialect_insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = dialect_insert(CancellationLimit).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'year_month'],
+            set_={'cancellation_count': CancellationLimit.cancellation_count + 1, 'updated_at': now}
+        ).returning(CancellationLimit.cancellation_count)
+        return db.session.execute(stmt).scalar()
+
+
+# 进程内共享的取消次数限制实例
+cancel_limiter = CancellationLimiter()
@@ -0,0 +1,118 @@
+import csv
+import io
+import json
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+from models import Booking, Table, Transaction, User, db
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8'
+}
+
+
+def _format_value(value):
+    """把数据库值转换为可序列化的基础类型"""
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def booking_export_query(campus_id=None, status=None, start_date=None, end_date=None):
+    """预约导出的列投影查询"""
+    student = aliased(User)
+    coach = aliased(User)
+    stmt = select(
+        Booking.id, Booking.campus_id, Booking.booking_date, Booking.start_time, Booking.end_time,
+        Booking.status, Booking.lesson_fee, Booking.series_id,
+        Booking.student_id, student.real_name.label('student_name'),
+        Booking.coach_id, coach.real_name.label('coach_name'),
+        Table.table_number, Booking.created_at, Booking.confirm_time
+    ).outerjoin(
+        student, student.id == Booking.student_id
+    ).outerjoin(
+        coach, coach.id == Booking.coach_id
+    ).outerjoin(
+        Table, Table.id == Booking.table_id
+    )
+    if campus_id:
+        stmt = stmt.where(Booking.campus_id == campus_id)
+    if status:
+        stmt = stmt.where(Booking.status == status)
+    if start_date:
+        stmt = stmt.where(Booking.booking_date >= start_date)
+    if end_date:
+        stmt = stmt.where(Booking.booking_date <= end_date)
+    return stmt.order_by(Booking.id)
+
+
+def transaction_export_query(campus_id=None, transaction_type=None, start_date=None, end_date=None):
+    """交易导出的列投影查询，start_date、end_date 为日期，按交易时间筛选且都包含在内"""
+    stmt = select(
+        Transaction.id, Transaction.user_id, User.username, User.real_name, User.campus_id,
+        Transaction.transaction_type, Transaction.amount, Transaction.payment_method,
+        Transaction.status, Transaction.description, Transaction.related_booking_id,
+        Transaction.created_at
+    ).outerjoin(User, User.id == Transaction.user_id)
+    if campus_id:
+        stmt = stmt.where(User.campus_id == campus_id)
+    if transaction_type:
+        stmt = stmt.where(Transaction.transaction_type == transaction_type)
+    if start_date:
+        stmt = stmt.where(Transaction.created_at >= datetime.combine(start_date, time.min))
+    if end_date:
+        stmt = stmt.where(Transaction.created_at < datetime.combine(end_date + timedelta(days=1), time.min))
+    return stmt.order_by(Transaction.id)
+
+
+def user_export_query(campus_id=None, user_type=None, status=None):
+    """用户导出的列投影查询（不含密码）"""
+    stmt = select(
+        User.id, User.username, User.real_name, User.gender, User.age, User.phone, User.email,
+        User.user_type, User.campus_id, User.status, User.created_at
+    )
+    if campus_id:
+        stmt = stmt.where(User.campus_id == campus_id)
+    if user_type:
+        stmt = stmt.where(User.user_type == user_type)
+    if status:
+        stmt = stmt.where(User.status == status)
+    return stmt.order_by(User.id)
+
+
+def stream_export(stmt, fmt='csv', batch_size=1000):
+    """以服务端游标逐批读取查询结果，生成 CSV 或 NDJSON 文本块
+
+    先输出表头，之后每读取一批写出一块，内存占用与导出总行数无关。
+    """
+    result = db.session.execute(stmt.execution_options(stream_results=True, yield_per=batch_size))
+    columns = list(result.keys())
+    try:
+        if fmt == 'ndjson':
+            for rows in result.partitions():
+                yield ''.join(
+                    json.dumps(dict(zip(columns, map(_format_value, row))), ensure_ascii=False) + '\n'
+                    for row in rows
+                )
+        else:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            # BOM 便于 Excel 正确识别中文
+            buffer.write('\ufeff')
+            writer.writerow(columns)
+            yield buffer.getvalue()
+            for rows in result.partitions():
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows(
+                    ['' if value is None else _format_value(value) for value in row]
+                    for row in rows
+                )
+                yield buffer.getvalue()
+    finally:
+        result.close()
@@ -0,0 +1,117 @@
+import hashlib
+import json
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import current_app, make_response, request
+from sqlalchemy.exc import IntegrityError
+from models import IdempotencyKey, db
+from utils.auth import error_response
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 64
+
+
+def request_fingerprint():
+    """请求方法、路径和请求体的摘要；JSON 请求体按键排序后计算，字段顺序不同视为同一请求"""
+    payload = request.get_json(silent=True)
+    body = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8') \
+        if payload is not None else request.get_data()
+    digest = hashlib.sha256(f'{request.method} {request.path}\n'.encode('utf-8'))
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def _replay(record):
+    response = current_app.response_class(record.response_body, status=record.status_code,
+                                          mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _reserve(user_id, key, fingerprint):
+    """登记一个处理中的幂等键；已存在未过期的记录时返回该记录，登记成功返回 None"""
+    now = datetime.utcnow()
+    expires_at = now + timedelta(hours=current_app.config['IDEMPOTENCY_KEY_TTL_HOURS'])
+    existing = IdempotencyKey.query.filter_by(user_id=user_id, idempotency_key=key).first()
+    if existing and existing.expires_at > now:
+        return existing
+    if existing:
+        # 过期但尚未清理的记录直接复用
+        existing.fingerprint = fingerprint
+        existing.status_code = None
+        existing.response_body = None
+        existing.created_at = now
+        existing.expires_at = expires_at
+    else:
+        db.session.add(IdempotencyKey(user_id=user_id, idempotency_key=key,
+                                      fingerprint=fingerprint, expires_at=expires_at))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # 并发的相同请求已抢先登记
+        db.session.rollback()
+        return IdempotencyKey.query.filter_by(user_id=user_id, idempotency_key=key).first()
+    return None
+
+
+def _release(user_id, key):
+    db.session.rollback()
+    IdempotencyKey.query.filter_by(user_id=user_id, idempotency_key=key).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def idempotent(f):
+    """支持 Idempotency-Key 请求头的接口装饰器，放在 require_auth 之后
+
+    同一用户带相同键的重复请求直接返回第一次的成功响应，不再执行接口；
+    请求体不同则拒绝。只缓存成功响应，失败的请求会释放键以便客户端修正后重试。
+    """
+    @wraps(f)
+    def decorated_function(current_user, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return f(current_user, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return error_response(f'{IDEMPOTENCY_HEADER} 长度不能超过{MAX_KEY_LENGTH}个字符')
+
+        fingerprint = request_fingerprint()
+        existing = _reserve(current_user.id, key, fingerprint)
+        if existing is not None:
+            if existing.fingerprint != fingerprint:
+                return error_response('该幂等键已用于其他请求', 422)
+            if existing.status_code is None:
+                return error_response('相同的请求正在处理中，请稍后重试', 409)
+            return _replay(existing)
+
+        try:
+            response = make_response(f(current_user, *args, **kwargs))
+        except Exception:
+            _release(current_user.id, key)
+            raise
+
+        if 200 <= response.status_code < 300:
+            IdempotencyKey.query.filter_by(user_id=current_user.id, idempotency_key=key).update({
+                'status_code': response.status_code,
+                'response_body': response.get_data(as_text=True)
+            }, synchronize_session=False)
+            db.session.commit()
+        else:
+            _release(current_user.id, key)
+        return response
+    return decorated_function
+
+
+def purge_expired_keys(batch_size=None):
+    """分批删除已过期的幂等键"""
+    batch_size = batch_size or current_app.config['BOOKING_JOB_BATCH_SIZE']
+    purged = 0
+    while True:
+        ids = [key_id for (key_id,) in db.session.query(IdempotencyKey.id).filter(
+            IdempotencyKey.expires_at <= datetime.utcnow()).limit(batch_size)]
+        if not ids:
+            break
+        IdempotencyKey.query.filter(IdempotencyKey.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        purged += len(ids)
+    return {'purged': purged}
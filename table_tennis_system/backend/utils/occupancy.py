@@ -0,0 +1,137 @@
+from flask import current_app
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
+from models import Booking, SlotHold, TableSlot, UserSlot, db
+from utils.table_index import to_seconds
+
+
+class SlotConflict(Exception):
+    """时间片已被占用，resource 为 'schedule'（教练/学员）或 'table'（球台）"""
+
+    def __init__(self, resource):
+        super().__init__(resource)
+        self.resource = resource
+
+
+def booking_slots(start_time, end_time, slot_minutes=None):
+    """预约覆盖的时间片编号（部分覆盖也算占用）"""
+    slot_minutes = slot_minutes or current_app.config['OCCUPANCY_SLOT_MINUTES']
+    slot_seconds = slot_minutes * 60
+    first = to_seconds(start_time) // slot_seconds
+    last = -(-to_seconds(end_time) // slot_seconds)
+    return range(first, last)
+
+
+def on_slot_boundary(*times):
+    """时间是否都落在时间片边界上
+
+    新建预约、保留、候补和请假的起止时间必须对齐时间片，否则首尾相接的两个预约会共用一个
+    部分覆盖的时间片而被误判为冲突。
+    """
+    slot_seconds = current_app.config['OCCUPANCY_SLOT_MINUTES'] * 60
+    return all(to_seconds(value) % slot_seconds == 0 for value in times)
+
+
+def slot_boundary_error():
+    """起止时间未对齐时间片时的提示"""
+    return f'开始和结束时间必须是{current_app.config["OCCUPANCY_SLOT_MINUTES"]}分钟的整数倍'
+
+
+def occupy_slots(bookings, schedule=True, table=True):
+    """在当前事务中写入预约的时间片占用记录，由唯一键拒绝冲突
+
+    bookings 可以是单个预约（或时间片保留）或其列表，需已 flush 取得 id；schedule/table
+    控制写入教练学员占用还是球台占用。冲突时抛出 SlotConflict，调用方负责回滚。
+    """
+    if isinstance(bookings, (Booking, SlotHold)):
+        bookings = [bookings]
+
+    user_rows, table_rows = [], []
+    for booking in bookings:
+        if isinstance(booking, SlotHold):
+            owner = {'booking_id': None, 'hold_id': booking.id}
+        else:
+            owner = {'booking_id': booking.id, 'hold_id': None}
+        slots = booking_slots(booking.start_time, booking.end_time)
+        for slot in slots:
+            for user_id in (booking.coach_id, booking.student_id):
+                user_rows.append({'user_id': user_id, 'slot_date': booking.booking_date,
+                                  'slot': slot, **owner})
+            if booking.table_id:
+                table_rows.append({'table_id': booking.table_id, 'slot_date': booking.booking_date,
+                                   'slot': slot, **owner})
+
+    if schedule and user_rows:
+        try:
+            db.session.execute(insert(UserSlot), user_rows)
+        except IntegrityError:
+            raise SlotConflict('schedule')
+
+    if table and table_rows:
+        try:
+            db.session.execute(insert(TableSlot), table_rows)
+        except IntegrityError:
+            raise SlotConflict('table')
+
+
+def release_slots(booking_ids, schedule=True, table=True):
+    """释放预约占用的时间片（取消、完成后调用）"""
+    if isinstance(booking_ids, int):
+        booking_ids = [booking_ids]
+    if not booking_ids:
+        return
+    if schedule:
+        UserSlot.query.filter(UserSlot.booking_id.in_(booking_ids)).delete(synchronize_session=False)
+    if table:
+        TableSlot.query.filter(TableSlot.booking_id.in_(booking_ids)).delete(synchronize_session=False)
+
+
+def transfer_hold_slots(hold_id, booking_id):
+    """把时间片保留占用的记录转给预约，返回转移的球台时间片数"""
+    UserSlot.query.filter_by(hold_id=hold_id).update(
+        {'booking_id': booking_id, 'hold_id': None}, synchronize_session=False)
+    return TableSlot.query.filter_by(hold_id=hold_id).update(
+        {'booking_id': booking_id, 'hold_id': None}, synchronize_session=False)
+
+
+def claim_status(booking, from_statuses, to_status, **values):
+    """条件更新预约状态，只有当前状态仍在 from_statuses 中时才会成功
+
+    用于替代“先查询状态再修改”，并发请求中只有一个能拿到该预约。
+    """
+    if isinstance(from_statuses, str):
+        from_statuses = [from_statuses]
+    values['status'] = to_status
+    claimed = Booking.query.filter(
+        Booking.id == booking.id,
+        Booking.status.in_(from_statuses)
+    ).update(values, synchronize_session=False)
+    if claimed:
+        for key, value in values.items():
+            set_committed_value(booking, key, value)
+    return bool(claimed)
+
+
+def rebuild_slots():
+    """按现有待确认、已确认预约重建时间片占用表（上线或数据修复时执行）
+
+    时间片保留和教练请假的占用记录保持不变。返回因冲突无法写入的预约 id 列表。
+    """
+    db.session.query(UserSlot).filter(
+        UserSlot.hold_id.is_(None), UserSlot.block_id.is_(None)).delete(synchronize_session=False)
+    db.session.query(TableSlot).filter(TableSlot.hold_id.is_(None)).delete(synchronize_session=False)
+    db.session.commit()
+
+    conflicts = []
+    bookings = Booking.query.filter(
+        Booking.status.in_(['pending', 'confirmed'])
+    ).order_by(Booking.id).all()
+    for booking in bookings:
+        try:
+            with db.session.begin_nested():
+                occupy_slots(booking)
+        except SlotConflict:
+            conflicts.append(booking.id)
+    db.session.commit()
+    return conflicts
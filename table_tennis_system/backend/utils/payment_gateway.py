@@ -0,0 +1,185 @@
+import hashlib
+import hmac
+import json
+import urllib.request
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from models import GatewayCallback, Transaction, db
+from utils.accounts import credit
+from utils.payment_stats import add_late_transactions, lock_stats_watermark
+
+# 走支付网关异步入账的支付方式
+ONLINE_METHODS = ('wechat', 'alipay')
+CALLBACK_FIELDS = ('notify_id', 'out_trade_no', 'trade_no', 'amount', 'trade_status')
+
+
+class GatewayError(Exception):
+    """调用支付网关失败或网关响应无效"""
+
+
+def sign(params, secret=None):
+    """按键排序拼接 key=value 后计算 HMAC-SHA256，sign 字段和空值不参与签名"""
+    secret = secret or current_app.config['PAYMENT_GATEWAY_SECRET']
+    message = '&'.join(f'{key}={params[key]}' for key in sorted(params)
+                       if key != 'sign' and params[key] not in (None, ''))
+    return hmac.new(secret.encode('utf-8'), message.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def verify(params, secret=None):
+    return hmac.compare_digest(str(params.get('sign', '')), sign(params, secret))
+
+
+def create_order(transaction):
+    """向网关为待支付的充值交易下单，返回网关交易号和支付链接"""
+    config = current_app.config
+    params = {
+        'out_trade_no': str(transaction.id),
+        'amount': str(transaction.amount),
+        'channel': transaction.payment_method,
+        'notify_url': config['PAYMENT_NOTIFY_URL'],
+        'nonce': uuid.uuid4().hex
+    }
+    params['sign'] = sign(params)
+    req = urllib.request.Request(config['PAYMENT_GATEWAY_URL'].rstrip('/') + '/orders',
+                                 data=json.dumps(params).encode('utf-8'),
+                                 headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=config['PAYMENT_GATEWAY_TIMEOUT']) as response:
+            order = json.loads(response.read())
+    except (OSError, ValueError) as e:
+        raise GatewayError(str(e))
+    if not isinstance(order, dict) or not verify(order):
+        raise GatewayError('网关响应签名无效')
+    return order
+
+
+def record_callback(params):
+    """保存一条已验签的回调，返回是否为新回调；同一 notify_id 重复投递时只保存第一次
+
+    回调接口只做这一次插入，入账由 process_callbacks() 批量完成，回调风暴不会放大为对账户的并发写。
+    """
+    try:
+        transaction_id = int(params['out_trade_no'])
+        amount = Decimal(str(params['amount']))
+    except (KeyError, TypeError, ValueError, InvalidOperation):
+        raise ValueError('回调参数无效')
+    if params.get('trade_status') not in ('success', 'failed') or not params.get('notify_id'):
+        raise ValueError('回调参数无效')
+
+    db.session.add(GatewayCallback(
+        notify_id=params['notify_id'],
+        transaction_id=transaction_id,
+        gateway_trade_no=params.get('trade_no'),
+        trade_status=params['trade_status'],
+        amount=amount,
+        payload=json.dumps(params, ensure_ascii=False)
+    ))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    return True
+
+
+def process_callbacks(batch_size=None):
+    """批量处理待处理的回调，把支付成功的充值交易改为已完成
+
+    余额由交易流水得出，入账只是把待支付交易的状态改为 completed。每批锁住涉及的交易后逐条判定，
+    同一交易的多条回调只有第一条生效，已完成的交易不会重复入账。增量汇总在交易仍待支付时
+    跳过了它们，所以先锁住收支汇总水位，再把水位以内的新完成交易补进每日汇总。
+
+    订单超时关闭或下单失败后用户仍可能完成支付。这类成功回调不改写已关闭的交易（余额快照可能已越过它），
+    而是追加一笔新的已完成充值入账，每个订单只补入一次。
+
+    每个进程都会运行本任务：水位行锁让各进程依次处理，拿到锁后用加锁读按主键重新认领仍待处理的回调，
+    判断订单是否已补入账也用加锁读，可重复读隔离级别下不会因读到旧快照而重复入账。
+    """
+    batch_size = batch_size or current_app.config['PAYMENT_CALLBACK_BATCH_SIZE']
+    totals = {'credited': 0, 'failed': 0, 'ignored': 0, 'rejected': 0}
+    while True:
+        candidates = [callback_id for (callback_id,) in db.session.query(GatewayCallback.id).filter(
+            GatewayCallback.result == 'pending').order_by(GatewayCallback.id).limit(batch_size)]
+        if not candidates:
+            break
+
+        mark = lock_stats_watermark()
+        callbacks = db.session.query(
+            GatewayCallback.id, GatewayCallback.transaction_id, GatewayCallback.trade_status, GatewayCallback.amount
+        ).filter(GatewayCallback.id.in_(candidates), GatewayCallback.result == 'pending').order_by(
+            GatewayCallback.id).with_for_update().all()
+        if not callbacks:
+            # 已被其他进程处理
+            db.session.commit()
+            continue
+
+        transactions = {row.id: row for row in db.session.query(
+            Transaction.id, Transaction.user_id, Transaction.transaction_type, Transaction.payment_method,
+            Transaction.amount, Transaction.status
+        ).filter(Transaction.id.in_({callback.transaction_id for callback in callbacks})).with_for_update()}
+        # 已关闭后补入过的订单
+        late_paid = {transaction_id for (transaction_id,) in db.session.query(GatewayCallback.transaction_id).filter(
+            GatewayCallback.transaction_id.in_([row.id for row in transactions.values() if row.status == 'failed']),
+            GatewayCallback.trade_status == 'success',
+            GatewayCallback.result == 'credited').with_for_update()}
+
+        results = {key: [] for key in totals}
+        settled = {'credited': set(), 'failed': set()}
+        for callback in callbacks:
+            transaction = transactions.get(callback.transaction_id)
+            if (transaction is None or transaction.transaction_type != 'deposit'
+                    or transaction.payment_method not in ONLINE_METHODS
+                    or Decimal(callback.amount) != Decimal(transaction.amount)):
+                results['rejected'].append(callback.id)
+            elif (transaction.status == 'failed' and callback.trade_status == 'success'
+                    and transaction.id not in late_paid):
+                late_paid.add(transaction.id)
+                credit(transaction.user_id, transaction.amount,
+                       f'{transaction.payment_method}充值（订单{transaction.id}关闭后支付）',
+                       transaction_type='deposit', payment_method=transaction.payment_method, create_missing=True)
+                current_app.logger.warning(f'充值订单 {transaction.id} 已关闭后收到支付成功回调，已补入账')
+                results['credited'].append(callback.id)
+            elif transaction.status != 'pending' or transaction.id in settled['credited'] | settled['failed']:
+                results['ignored'].append(callback.id)
+            else:
+                outcome = 'credited' if callback.trade_status == 'success' else 'failed'
+                settled[outcome].add(transaction.id)
+                results[outcome].append(callback.id)
+
+        for outcome, status in (('credited', 'completed'), ('failed', 'failed')):
+            if settled[outcome]:
+                Transaction.query.filter(
+                    Transaction.id.in_(settled[outcome]), Transaction.status == 'pending'
+                ).update({'status': status}, synchronize_session=False)
+        add_late_transactions(mark.position, settled['credited'])
+
+        now = datetime.utcnow()
+        for outcome, ids in results.items():
+            if ids:
+                GatewayCallback.query.filter(
+                    GatewayCallback.id.in_(ids), GatewayCallback.result == 'pending'
+                ).update({'result': outcome, 'processed_at': now}, synchronize_session=False)
+                totals[outcome] += len(ids)
+        db.session.commit()
+    return totals
+
+
+def close_expired_orders():
+    """关闭超过 PAYMENT_ORDER_TIMEOUT_MINUTES 分钟仍未支付的在线充值
+
+    待处理交易会阻止余额快照合并越过它，超时的订单需要及时关闭。关闭后才到达的支付成功回调
+    由 process_callbacks() 另行补入账。
+    """
+    cutoff = datetime.utcnow() - timedelta(minutes=current_app.config['PAYMENT_ORDER_TIMEOUT_MINUTES'])
+    closed = Transaction.query.filter(
+        Transaction.status == 'pending',
+        Transaction.transaction_type == 'deposit',
+        Transaction.payment_method.in_(ONLINE_METHODS),
+        Transaction.created_at < cutoff
+    ).update({'status': 'failed'}, synchronize_session=False)
+    db.session.commit()
+    return {'closed': closed}
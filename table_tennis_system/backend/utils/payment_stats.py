@@ -0,0 +1,310 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from flask import current_app
+from sqlalchemy import and_, case, func, select
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from models import AggregateWatermark, Booking, PaymentDailyStat, Transaction, TransactionArchive, User, db
+
+STATS_WATERMARK = 'payment_daily_stats'
+STAT_KEYS = ('stat_date', 'campus_id', 'transaction_type', 'payment_method')
+
+
+def _to_date(value):
+    """SQLite 的 DATE() 返回字符串，统一转换为 date"""
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _campus_column():
+    return func.coalesce(User.campus_id, 0)
+
+
+def _aggregate_transactions(*criteria):
+    """按日期、校区、交易类型和支付方式汇总已完成交易，校区取交易用户当前所属校区"""
+    stat_date = func.date(Transaction.created_at)
+    campus_id = _campus_column()
+    stmt = select(
+        stat_date, campus_id, Transaction.transaction_type, Transaction.payment_method,
+        func.sum(Transaction.amount), func.count(Transaction.id)
+    ).select_from(Transaction).join(User, User.id == Transaction.user_id).where(
+        Transaction.status == 'completed', *criteria
+    ).group_by(stat_date, campus_id, Transaction.transaction_type, Transaction.payment_method)
+
+    now = datetime.utcnow()
+    return [{
+        'stat_date': _to_date(day),
+        'campus_id': campus,
+        'transaction_type': transaction_type,
+        'payment_method': payment_method,
+        'total_amount': total,
+        'transaction_count': count,
+        'updated_at': now
+    } for day, campus, transaction_type, payment_method, total, count in db.session.execute(stmt)]
+
+
+def apply_daily_stats(rows):
+    """把汇总结果累加进 payment_daily_stats，同一键的行已存在时相加"""
+    if not rows:
+        return
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'mysql':
+        stmt = mysql.insert(PaymentDailyStat)
+        stmt = stmt.on_duplicate_key_update(
+            total_amount=PaymentDailyStat.total_amount + stmt.inserted.total_amount,
+            transaction_count=PaymentDailyStat.transaction_count + stmt.inserted.transaction_count,
+            updated_at=stmt.inserted.updated_at
+        )
+    else:
+        stmt = (postgresql.insert if dialect == 'postgresql' else sqlite.insert)(PaymentDailyStat)
+        stmt = stmt.on_conflict_do_update(index_elements=list(STAT_KEYS), set_={
+            'total_amount': PaymentDailyStat.total_amount + stmt.excluded.total_amount,
+            'transaction_count': PaymentDailyStat.transaction_count + stmt.excluded.transaction_count,
+            'updated_at': stmt.excluded.updated_at
+        })
+    db.session.execute(stmt, rows)
+
+
+def lock_watermark(name):
+    """锁住指定名称的水位行（不存在时创建），锁随当前事务提交或回滚释放"""
+    mark = AggregateWatermark.query.filter_by(name=name).with_for_update().first()
+    if mark is None:
+        db.session.add(AggregateWatermark(name=name, position=0))
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+        mark = AggregateWatermark.query.filter_by(name=name).with_for_update().first()
+    return mark
+
+
+def lock_stats_watermark():
+    """锁住汇总水位行，保证多个进程不会重复汇总同一批交易"""
+    return lock_watermark(STATS_WATERMARK)
+
+
+def add_late_transactions(position, transaction_ids):
+    """在当前事务中把刚变为已完成、但 id 不超过汇总水位的交易补进每日汇总
+
+    这些交易在增量汇总时仍是待处理而被跳过；水位之后的交易以后由增量汇总处理。
+    调用方需在更新交易状态之前用 lock_stats_watermark() 锁住水位，position 为锁住时的水位。
+    """
+    late = [transaction_id for transaction_id in transaction_ids if transaction_id <= position]
+    if late:
+        apply_daily_stats(_aggregate_transactions(Transaction.id.in_(late)))
+    return len(late)
+
+
+def rollup_payment_stats(batch_size=None):
+    """把水位之后的新交易分批累加进每日汇总，每批在同一事务中更新汇总和水位
+
+    只处理 PAYMENT_STATS_LAG_SECONDS 秒之前写入的交易，避免 id 较小但尚未提交的交易被跳过；
+    更新的交易由 payment_statistics() 在查询时实时累加。
+    """
+    config = current_app.config
+    batch_size = batch_size or config['PAYMENT_STATS_BATCH_SIZE']
+    cutoff = datetime.utcnow() - timedelta(seconds=config['PAYMENT_STATS_LAG_SECONDS'])
+
+    processed = 0
+    while True:
+        mark = lock_stats_watermark()
+        pending = db.session.query(Transaction.id).filter(
+            Transaction.id > mark.position, Transaction.created_at <= cutoff)
+        boundary = pending.order_by(Transaction.id).offset(batch_size - 1).limit(1).scalar()
+        last_batch = boundary is None
+        if last_batch:
+            boundary = pending.with_entities(func.max(Transaction.id)).scalar()
+        if boundary is None:
+            db.session.commit()
+            break
+
+        rows = _aggregate_transactions(Transaction.id > mark.position, Transaction.id <= boundary)
+        apply_daily_stats(rows)
+        processed += sum(row['transaction_count'] for row in rows)
+        mark.position = boundary
+        db.session.commit()
+        if last_batch:
+            break
+
+    position = db.session.query(AggregateWatermark.position).filter_by(name=STATS_WATERMARK).scalar() or 0
+    return {'transactions': processed, 'watermark': position}
+
+
+def rebuild_payment_stats(start_date=None, end_date=None):
+    """回填每日汇总
+
+    不指定日期时清空汇总并从第一条交易重新累计；指定日期范围时只重算这些日期中
+    水位以内的交易，用于修正历史数据。已归档月份的交易不在交易表中，它们的汇总保持不变。
+    """
+    mark = lock_stats_watermark()
+    archived_month = db.session.query(func.max(TransactionArchive.month)).scalar()
+    hot_start = next_bucket(archived_month, 'month') if archived_month else None
+    if start_date is None and end_date is None:
+        query = PaymentDailyStat.query
+        if hot_start:
+            query = query.filter(PaymentDailyStat.stat_date >= hot_start)
+        query.delete(synchronize_session=False)
+        mark.position = 0
+        db.session.commit()
+        return rollup_payment_stats()
+
+    if hot_start:
+        start_date = max(start_date, hot_start) if start_date else hot_start
+        if end_date and end_date < start_date:
+            db.session.commit()
+            return {'transactions': 0, 'watermark': mark.position}
+
+    criteria = [Transaction.id <= mark.position]
+    stat_criteria = []
+    if start_date:
+        criteria.append(Transaction.created_at >= datetime.combine(start_date, datetime.min.time()))
+        stat_criteria.append(PaymentDailyStat.stat_date >= start_date)
+    if end_date:
+        criteria.append(Transaction.created_at < datetime.combine(end_date + timedelta(days=1), datetime.min.time()))
+        stat_criteria.append(PaymentDailyStat.stat_date <= end_date)
+    PaymentDailyStat.query.filter(*stat_criteria).delete(synchronize_session=False)
+    rows = _aggregate_transactions(*criteria)
+    apply_daily_stats(rows)
+    position = mark.position
+    db.session.commit()
+    return {'transactions': sum(row['transaction_count'] for row in rows), 'watermark': position}
+
+
+def payment_statistics(campus_id=None, today=None):
+    """按校区和交易类型统计总额、今日额和本月额
+
+    已汇总部分读 payment_daily_stats，水位之后的新交易按主键范围实时累加，结果与直接扫描交易表一致。
+    返回 {(campus_id, transaction_type): {'total', 'today', 'month'}}。
+    """
+    today = today or datetime.now().date()
+    month_start = today.replace(day=1)
+    position = db.session.query(AggregateWatermark.position).filter_by(name=STATS_WATERMARK).scalar() or 0
+
+    stats_query = db.session.query(
+        PaymentDailyStat.campus_id,
+        PaymentDailyStat.transaction_type,
+        func.sum(PaymentDailyStat.total_amount),
+        func.sum(case((PaymentDailyStat.stat_date == today, PaymentDailyStat.total_amount), else_=0)),
+        func.sum(case((PaymentDailyStat.stat_date >= month_start, PaymentDailyStat.total_amount), else_=0))
+    ).group_by(PaymentDailyStat.campus_id, PaymentDailyStat.transaction_type)
+    if campus_id is not None:
+        stats_query = stats_query.filter(PaymentDailyStat.campus_id == campus_id)
+
+    today_start = datetime.combine(today, datetime.min.time())
+    tail_campus = _campus_column()
+    tail_query = db.session.query(
+        tail_campus,
+        Transaction.transaction_type,
+        func.sum(Transaction.amount),
+        func.sum(case((and_(Transaction.created_at >= today_start,
+                            Transaction.created_at < today_start + timedelta(days=1)), Transaction.amount), else_=0)),
+        func.sum(case((Transaction.created_at >= datetime.combine(month_start, datetime.min.time()),
+                       Transaction.amount), else_=0))
+    ).join(User, User.id == Transaction.user_id).filter(
+        Transaction.id > position, Transaction.status == 'completed'
+    ).group_by(tail_campus, Transaction.transaction_type)
+    if campus_id is not None:
+        tail_query = tail_query.filter(User.campus_id == campus_id)
+
+    totals = defaultdict(lambda: {'total': Decimal('0'), 'today': Decimal('0'), 'month': Decimal('0')})
+    for campus, transaction_type, total, today_total, month_total in stats_query.all() + tail_query.all():
+        entry = totals[(campus, transaction_type)]
+        entry['total'] += Decimal(total or 0)
+        entry['today'] += Decimal(today_total or 0)
+        entry['month'] += Decimal(month_total or 0)
+    return totals
+
+
+SERIES_TYPES = ('deposit', 'refund', 'withdraw')
+
+
+def daily_totals(start_date, end_date, campus_id=None):
+    """日期范围内每天各交易类型的金额，返回 {(日期, 交易类型): 金额}
+
+    已汇总部分读 payment_daily_stats，水位之后的新交易实时累加。
+    """
+    position = db.session.query(AggregateWatermark.position).filter_by(name=STATS_WATERMARK).scalar() or 0
+
+    stats_query = db.session.query(
+        PaymentDailyStat.stat_date, PaymentDailyStat.transaction_type, func.sum(PaymentDailyStat.total_amount)
+    ).filter(
+        PaymentDailyStat.stat_date >= start_date, PaymentDailyStat.stat_date <= end_date
+    ).group_by(PaymentDailyStat.stat_date, PaymentDailyStat.transaction_type)
+    if campus_id is not None:
+        stats_query = stats_query.filter(PaymentDailyStat.campus_id == campus_id)
+
+    day = func.date(Transaction.created_at)
+    tail_query = db.session.query(day, Transaction.transaction_type, func.sum(Transaction.amount)).join(
+        User, User.id == Transaction.user_id
+    ).filter(
+        Transaction.id > position,
+        Transaction.status == 'completed',
+        Transaction.created_at >= datetime.combine(start_date, datetime.min.time()),
+        Transaction.created_at < datetime.combine(end_date + timedelta(days=1), datetime.min.time())
+    ).group_by(day, Transaction.transaction_type)
+    if campus_id is not None:
+        tail_query = tail_query.filter(User.campus_id == campus_id)
+
+    totals = defaultdict(Decimal)
+    for stat_date, transaction_type, amount in stats_query.all() + tail_query.all():
+        totals[(_to_date(stat_date), transaction_type)] += Decimal(amount or 0)
+    return totals
+
+
+def coach_daily_totals(start_date, end_date, coach_id, campus_id=None):
+    """某教练课程相关交易（课时费和退款）每天各类型的金额，一条分组查询完成"""
+    day = func.date(Transaction.created_at)
+    query = db.session.query(day, Transaction.transaction_type, func.sum(Transaction.amount)).join(
+        Booking, Booking.id == Transaction.related_booking_id
+    ).filter(
+        Booking.coach_id == coach_id,
+        Transaction.status == 'completed',
+        Transaction.created_at >= datetime.combine(start_date, datetime.min.time()),
+        Transaction.created_at < datetime.combine(end_date + timedelta(days=1), datetime.min.time())
+    ).group_by(day, Transaction.transaction_type)
+    if campus_id is not None:
+        query = query.filter(Booking.campus_id == campus_id)
+
+    totals = defaultdict(Decimal)
+    for stat_date, transaction_type, amount in query:
+        totals[(_to_date(stat_date), transaction_type)] += Decimal(amount or 0)
+    return totals
+
+
+def bucket_start(day, bucket):
+    """日期所在时间桶的第一天：周以周一开始，月以 1 日开始"""
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(day, bucket):
+    if bucket == 'week':
+        return day + timedelta(days=7)
+    if bucket == 'month':
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return day + timedelta(days=1)
+
+
+def revenue_series(totals, start_date, end_date, bucket):
+    """把每日金额按时间桶累计为列式数组，没有交易的时间桶补 0"""
+    starts = []
+    current = bucket_start(start_date, bucket)
+    while current <= end_date:
+        starts.append(current)
+        current = next_bucket(current, bucket)
+
+    positions = {day: index for index, day in enumerate(starts)}
+    columns = {transaction_type: [Decimal('0')] * len(starts) for transaction_type in SERIES_TYPES}
+    for (day, transaction_type), amount in totals.items():
+        index = positions.get(bucket_start(day, bucket))
+        if index is not None and transaction_type in columns:
+            columns[transaction_type][index] += amount
+
+    series = {'bucket': bucket, 'timestamps': [day.isoformat() for day in starts]}
+    for transaction_type, values in columns.items():
+        series[transaction_type] = [float(value) for value in values]
+    return series
@@ -0,0 +1,162 @@
+import csv
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time
+
+from flask import current_app
+from sqlalchemy import and_, case, func, select
+from models import Account, ReconciliationRun, Transaction, TransactionArchiveSegment, db, signed_amount
+from utils.transaction_archive import hot_start
+
+REPORT_COLUMNS = ['user_id', 'issue', 'snapshot_balance', 'ledger_position', 'ledger_sum', 'difference', 'live_balance']
+
+
+def _check_chunk(app, criterion):
+    """核对一批账户：余额快照应等于 ledger_position 之前已完成交易的合计，实时余额不能为负
+
+    已归档的交易按归档分段中记录的合计计入。每批只执行一条不加锁的聚合查询，
+    读完即结束事务，不会长时间占用锁或快照。返回 (核对账户数, 差异列表)。
+    """
+    with app.app_context():
+        try:
+            join_criteria = [Transaction.user_id == Account.user_id, Transaction.status == 'completed']
+            boundary = hot_start()
+            if boundary:
+                join_criteria.append(Transaction.created_at >= datetime.combine(boundary, time.min))
+            archived = select(
+                func.coalesce(func.sum(TransactionArchiveSegment.net_amount), 0)
+            ).where(TransactionArchiveSegment.user_id == Account.user_id).correlate(Account).scalar_subquery()
+            stmt = select(
+                Account.user_id,
+                Account.balance,
+                Account.ledger_position,
+                func.coalesce(func.sum(case((Transaction.id <= Account.ledger_position, signed_amount), else_=0)), 0),
+                func.coalesce(func.sum(case((Transaction.id > Account.ledger_position, signed_amount), else_=0)), 0),
+                archived
+            ).select_from(Account).outerjoin(Transaction, and_(*join_criteria)).where(
+                criterion
+            ).group_by(Account.id, Account.user_id, Account.balance, Account.ledger_position)
+            rows = db.session.execute(stmt).all()
+        finally:
+            db.session.remove()
+
+    mismatches = []
+    for user_id, balance, position, hot_sum, delta, archived_sum in rows:
+        ledger_sum = hot_sum + archived_sum
+        live = balance + delta
+        issue = None
+        if balance != ledger_sum:
+            issue = 'snapshot_drift'
+        elif live < 0:
+            issue = 'negative_balance'
+        if issue:
+            mismatches.append({
+                'user_id': user_id,
+                'issue': issue,
+                'snapshot_balance': balance,
+                'ledger_position': position,
+                'ledger_sum': ledger_sum,
+                'difference': balance - ledger_sum,
+                'live_balance': live
+            })
+    return len(rows), mismatches
+
+
+def _full_chunks(chunk_size):
+    """按账户主键划分区间，每个区间一个对账任务"""
+    low, high = db.session.query(func.min(Account.id), func.max(Account.id)).one()
+    if low is None:
+        return
+    for start in range(low - 1, high, chunk_size):
+        yield and_(Account.id > start, Account.id <= start + chunk_size)
+
+
+def _touched_user_ids(after_transaction_id, watermark, since, chunk_size):
+    """上次对账之后有新交易或账户行有变化的用户
+
+    交易表按主键分块顺序读取，每块一条短查询。
+    """
+    user_ids = set()
+    last_id = after_transaction_id
+    while last_id < watermark:
+        rows = db.session.query(Transaction.id, Transaction.user_id).filter(
+            Transaction.id > last_id, Transaction.id <= watermark
+        ).order_by(Transaction.id).limit(chunk_size).all()
+        if not rows:
+            break
+        user_ids.update(user_id for _, user_id in rows)
+        last_id = rows[-1][0]
+
+    user_ids.update(user_id for (user_id,) in db.session.query(Account.user_id).filter(Account.updated_at >= since))
+    return sorted(user_ids)
+
+
+def _incremental_chunks(user_ids, chunk_size):
+    for start in range(0, len(user_ids), chunk_size):
+        yield Account.user_id.in_(user_ids[start:start + chunk_size])
+
+
+def _write_report(run, mismatches):
+    report_dir = current_app.config['RECONCILIATION_REPORT_DIR']
+    os.makedirs(report_dir, exist_ok=True)
+    path = os.path.join(report_dir, f'reconciliation_{run.id}_{run.started_at:%Y%m%d%H%M%S}.csv')
+    with open(path, 'w', newline='', encoding='utf-8-sig') as report:
+        writer = csv.DictWriter(report, fieldnames=REPORT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(sorted(mismatches, key=lambda row: row['user_id']))
+    return path
+
+
+def reconcile_accounts(incremental=False, workers=None, chunk_size=None):
+    """核对账户余额与交易流水，把差异写入 CSV 报告并返回本次对账记录
+
+    全量模式按账户主键分块；增量模式只核对上一次完成的对账之后有新交易或账户有变化的用户，
+    没有可用的上一次记录时退回全量。各块由线程池并行核对，每个线程使用独立的数据库连接。
+    """
+    config = current_app.config
+    workers = workers or config['RECONCILIATION_WORKERS']
+    chunk_size = chunk_size or config['RECONCILIATION_CHUNK_SIZE']
+
+    previous = None
+    if incremental:
+        previous = ReconciliationRun.query.filter_by(status='completed').order_by(
+            ReconciliationRun.id.desc()).first()
+
+    run = ReconciliationRun(
+        mode='incremental' if previous else 'full',
+        transaction_watermark=db.session.query(func.max(Transaction.id)).scalar() or 0,
+        started_at=datetime.utcnow()
+    )
+    db.session.add(run)
+    db.session.commit()
+
+    try:
+        if previous:
+            user_ids = _touched_user_ids(previous.transaction_watermark, run.transaction_watermark,
+                                         previous.started_at, chunk_size)
+            chunks = _incremental_chunks(user_ids, chunk_size)
+        else:
+            chunks = _full_chunks(chunk_size)
+        db.session.commit()
+
+        app = current_app._get_current_object()
+        checked = 0
+        mismatches = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for count, found in pool.map(lambda criterion: _check_chunk(app, criterion), chunks):
+                checked += count
+                mismatches.extend(found)
+
+        run.report_path = _write_report(run, mismatches)
+        run.accounts_checked = checked
+        run.mismatch_count = len(mismatches)
+        run.status = 'completed'
+    except Exception:
+        db.session.rollback()
+        run.status = 'failed'
+        raise
+    finally:
+        run.finished_at = datetime.utcnow()
+        db.session.commit()
+
+    return run
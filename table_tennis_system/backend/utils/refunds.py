@@ -0,0 +1,50 @@
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import func, insert, literal, select
+from models import Account, Transaction, db
+
+
+def refund_in_chunks(source, mark_refunded, chunk_size=None, progress=None,
+                     transaction_type='refund', payment_method='system'):
+    """按集合批量退款，每批在一个短事务中完成
+
+    source 为待退款行的查询，需要提供带标签的列 key（递增的行 id）、user_id、amount、
+    description 和 related_booking_id，并且只包含尚未退款的行。每批先取出一段 key，
+    用一条 INSERT ... SELECT 为有账户的用户写入退款交易（余额由交易流水得出，无需更新账户行），
+    再调用 mark_refunded(keys) 把这批行标记为已退款，然后提交。中途失败时已提交的批次不会重复退款，
+    重新调用即可继续。progress(已处理行数, 总行数) 在每批提交后调用。
+    """
+    chunk_size = chunk_size or current_app.config['REFUND_CHUNK_SIZE']
+    rows = source.subquery()
+    total = db.session.execute(select(func.count()).select_from(rows)).scalar()
+
+    processed = refunded = 0
+    last_key = None
+    while True:
+        key_query = select(rows.c.key).order_by(rows.c.key).limit(chunk_size)
+        if last_key is not None:
+            key_query = key_query.where(rows.c.key > last_key)
+        keys = db.session.execute(key_query).scalars().all()
+        if not keys:
+            break
+
+        now = datetime.utcnow()
+        result = db.session.execute(insert(Transaction).from_select(
+            ['user_id', 'transaction_type', 'amount', 'payment_method', 'status',
+             'description', 'related_booking_id', 'created_at'],
+            select(
+                rows.c.user_id, literal(transaction_type), rows.c.amount, literal(payment_method),
+                literal('completed'), rows.c.description, rows.c.related_booking_id, literal(now)
+            ).join(Account, Account.user_id == rows.c.user_id).where(rows.c.key.in_(keys))
+        ))
+        mark_refunded(keys)
+        db.session.commit()
+
+        processed += len(keys)
+        refunded += max(result.rowcount, 0)
+        last_key = keys[-1]
+        if progress:
+            progress(processed, total)
+
+    return {'rows': processed, 'refunded': refunded, 'total': total}
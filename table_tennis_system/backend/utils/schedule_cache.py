@@ -0,0 +1,151 @@
+import hashlib
+import json
+import threading
+import time as _time
+from collections import OrderedDict
+from datetime import timedelta
+
+from flask import current_app
+from models import Booking, Table, User, db
+
+
+def week_start(day):
+    """所在周的周一"""
+    return day - timedelta(days=day.weekday())
+
+
+class CoachScheduleCache:
+    """按 (教练, 周) 物化的课表缓存
+
+    每周条目保存当周每天的课程列表及其摘要；预约状态变化后调用 invalidate()，
+    条目超过 SCHEDULE_CACHE_TTL 秒后重新加载，以兼容多进程部署。条目按加载顺序保存，
+    写入时丢弃已过期的条目，总数超过 SCHEDULE_CACHE_MAX_WEEKS 时丢弃最早加载的。
+    """
+
+    def __init__(self):
+        self._weeks = OrderedDict()   # (coach_id, monday) -> (built_at, {date: [entry]}, digest)
+        # (coach_id, monday) -> 最近一次失效的序号，防止加载期间的失效被覆盖；
+        # 丢弃的序号记入 _floor，没有记录的周按 _floor 比较
+        self._generations = OrderedDict()
+        self._counter = 0
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def _ttl(self):
+        return current_app.config.get('SCHEDULE_CACHE_TTL', 60)
+
+    def _max_weeks(self):
+        return current_app.config.get('SCHEDULE_CACHE_MAX_WEEKS', 5000)
+
+    def _generation(self, key):
+        return self._generations.get(key, self._floor)
+
+    def _prune(self, now):
+        """丢弃过期和超出上限的条目，调用方持有锁"""
+        ttl, max_weeks = self._ttl(), self._max_weeks()
+        while self._weeks:
+            key, week = next(iter(self._weeks.items()))
+            if len(self._weeks) <= max_weeks and now - week[0] <= ttl:
+                break
+            del self._weeks[key]
+        while len(self._generations) > max_weeks:
+            _, generation = self._generations.popitem(last=False)
+            self._floor = max(self._floor, generation)
+
+    def _load_weeks(self, coach_id, mondays):
+        """一次查询加载多周课表，按日期分组"""
+        first, last = min(mondays), max(mondays) + timedelta(days=6)
+        rows = db.session.query(
+            Booking.id, Booking.booking_date, Booking.start_time, Booking.end_time,
+            Booking.status, User.real_name, Table.table_number
+        ).outerjoin(
+            User, User.id == Booking.student_id
+        ).outerjoin(
+            Table, Table.id == Booking.table_id
+        ).filter(
+            Booking.coach_id == coach_id,
+            Booking.booking_date >= first,
+            Booking.booking_date <= last,
+            Booking.status.in_(['pending', 'confirmed'])
+        ).order_by(Booking.booking_date, Booking.start_time).all()
+
+        days = {}
+        for row in rows:
+            days.setdefault(row.booking_date, []).append({
+                'booking_id': row.id,
+                'start_time': row.start_time.isoformat(),
+                'end_time': row.end_time.isoformat(),
+                'status': row.status,
+                'student_name': row.real_name,
+                'table_number': row.table_number
+            })
+
+        now = _time.monotonic()
+        loaded = {}
+        for monday in mondays:
+            week_days = {
+                monday + timedelta(days=i): days.get(monday + timedelta(days=i), [])
+                for i in range(7)
+            }
+            payload = json.dumps(
+                {day.isoformat(): entries for day, entries in week_days.items()},
+                sort_keys=True, ensure_ascii=False
+            )
+            digest = hashlib.md5(payload.encode('utf-8')).hexdigest()
+            loaded[monday] = (now, week_days, digest)
+        return loaded
+
+    def get_range(self, coach_id, start_date, end_date):
+        """返回 ({date_str: [entry]}, etag)，包含范围内每一天"""
+        mondays = []
+        monday = week_start(start_date)
+        while monday <= end_date:
+            mondays.append(monday)
+            monday += timedelta(days=7)
+
+        now = _time.monotonic()
+        ttl = self._ttl()
+        with self._lock:
+            weeks = {m: self._weeks.get((coach_id, m)) for m in mondays}
+            generations = {m: self._generation((coach_id, m)) for m in mondays}
+        stale = [m for m, week in weeks.items() if week is None or now - week[0] > ttl]
+
+        if stale:
+            loaded = self._load_weeks(coach_id, stale)
+            with self._lock:
+                for m, week in loaded.items():
+                    if self._generation((coach_id, m)) == generations[m]:
+                        self._weeks.pop((coach_id, m), None)
+                        self._weeks[(coach_id, m)] = week
+                self._prune(_time.monotonic())
+            weeks.update(loaded)
+
+        schedule = {}
+        current = start_date
+        while current <= end_date:
+            schedule[current.isoformat()] = weeks[week_start(current)][1][current]
+            current += timedelta(days=1)
+
+        digest = hashlib.md5()
+        digest.update(f'{coach_id}:{start_date}:{end_date}'.encode('utf-8'))
+        for m in mondays:
+            digest.update(weeks[m][2].encode('utf-8'))
+        return schedule, digest.hexdigest()
+
+    def invalidate(self, coach_id, booking_date=None):
+        """丢弃教练某天所在周的缓存，不传日期时丢弃该教练全部缓存"""
+        with self._lock:
+            if booking_date is not None:
+                keys = [(coach_id, week_start(booking_date))]
+            else:
+                keys = [key for key in self._weeks if key[0] == coach_id]
+            for key in keys:
+                self._weeks.pop(key, None)
+                self._counter += 1
+                self._generations.pop(key, None)
+                self._generations[key] = self._counter
+            self._prune(_time.monotonic())
+
+
+# 进程内共享的课表缓存实例
+schedule_cache = CoachScheduleCache()
@@ -0,0 +1,100 @@
+import threading
+from datetime import datetime
+
+from models import db
+
+
+class PeriodicJob:
+    """按固定间隔在后台线程中执行的任务，记录最近一次运行结果"""
+
+    def __init__(self, name, func, interval):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.runs = 0
+        self.last_run = None
+        self.last_result = None
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def run_once(self, app):
+        """在应用上下文中执行一次任务，同一任务不会并发执行"""
+        with self._lock, app.app_context():
+            started = datetime.utcnow()
+            try:
+                self.last_result = self.func()
+                self.last_error = None
+            except Exception as e:
+                db.session.rollback()
+                self.last_error = str(e)
+                app.logger.error(f"后台任务 {self.name} 执行失败: {str(e)}")
+            finally:
+                db.session.remove()
+            self.runs += 1
+            self.last_run = started
+            return self.last_result
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'interval': self.interval,
+            'runs': self.runs,
+            'last_run': self.last_run.isoformat() if self.last_run else None,
+            'last_result': self.last_result,
+            'last_error': self.last_error
+        }
+
+
+class JobScheduler:
+    """进程内的后台任务调度器，每个任务一个守护线程
+
+    各进程的调度器互不知晓，只应在一个进程中启动（见 config.py 中的 BACKGROUND_JOBS_ENABLED）。
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self._stop = threading.Event()
+        self._threads = []
+
+    def register(self, name, func, interval):
+        self.jobs[name] = PeriodicJob(name, func, interval)
+        return self.jobs[name]
+
+    def start(self, app):
+        if self._threads:
+            return
+        for job in self.jobs.values():
+            thread = threading.Thread(target=self._loop, args=(app, job), name=f'job-{job.name}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _loop(self, app, job):
+        while not self._stop.wait(job.interval):
+            job.run_once(app)
+
+    def run_forever(self, app):
+        """启动全部任务并阻塞当前线程，直到 stop() 或收到中断信号"""
+        self.start(app)
+        try:
+            while not self._stop.wait(60):
+                pass
+        except KeyboardInterrupt:
+            self.stop()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, app, name):
+        """立即执行指定任务，任务不存在时返回 None"""
+        job = self.jobs.get(name)
+        if job is None:
+            return None
+        job.run_once(app)
+        return job
+
+    def status(self):
+        return [job.to_dict() for job in self.jobs.values()]
+
+
+# 进程内共享的调度器实例
+scheduler = JobScheduler()
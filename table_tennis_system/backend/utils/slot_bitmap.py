@@ -0,0 +1,81 @@
+from datetime import time, timedelta
+
+from utils.table_index import to_seconds
+
+
+def interval_mask(start_seconds, end_seconds, slot_minutes):
+    """[start, end) 覆盖到的时间片位图（部分覆盖也算占用）"""
+    slot_seconds = slot_minutes * 60
+    first = start_seconds // slot_seconds
+    last = -(-end_seconds // slot_seconds)  # 向上取整
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def hours_mask(open_hour, close_hour, slot_minutes):
+    """营业时间内的时间片位图"""
+    return interval_mask(open_hour * 3600, close_hour * 3600, slot_minutes)
+
+
+def popcount(mask):
+    """位图中置位的数量"""
+    return bin(mask).count('1')
+
+
+def build_busy_masks(rows, slot_minutes):
+    """按日期汇总占用位图，rows 为 (booking_date, start_time, end_time)"""
+    masks = {}
+    for booking_date, start_time, end_time in rows:
+        mask = interval_mask(to_seconds(start_time), to_seconds(end_time), slot_minutes)
+        masks[booking_date] = masks.get(booking_date, 0) | mask
+    return masks
+
+
+def feasible_starts(free_mask, slots_needed):
+    """返回可作为起点的时间片位图：从该位起连续 slots_needed 个时间片均空闲
+
+    通过倍增移位与运算，只需 O(log n) 次位运算。
+    """
+    if slots_needed <= 0:
+        return 0
+    result = free_mask
+    covered = 1
+    while covered < slots_needed:
+        step = min(covered, slots_needed - covered)
+        result &= result >> step
+        covered += step
+    return result
+
+
+def iter_bits(mask):
+    """按从低到高的顺序遍历置位的下标"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def slot_to_time(slot, slot_minutes):
+    minutes = slot * slot_minutes
+    return time(minutes // 60, minutes % 60)
+
+
+def find_free_starts(busy_masks, start_date, end_date, duration_minutes,
+                     slot_minutes, open_hour, close_hour):
+    """计算日期范围内每天所有可行的开始时间
+
+    返回 {date: [time, ...]}，没有可行时间的日期不出现在结果中。
+    """
+    slots_needed = -(-duration_minutes // slot_minutes)
+    opening = hours_mask(open_hour, close_hour, slot_minutes)
+
+    result = {}
+    current = start_date
+    while current <= end_date:
+        free = opening & ~busy_masks.get(current, 0)
+        starts = feasible_starts(free, slots_needed)
+        if starts:
+            result[current] = [slot_to_time(slot, slot_minutes) for slot in iter_bits(starts)]
+        current += timedelta(days=1)
+    return result
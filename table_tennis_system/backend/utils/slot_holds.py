@@ -0,0 +1,95 @@
+import secrets
+from datetime import datetime, timedelta
+
+from flask import current_app
+from models import SlotHold, TableSlot, UserSlot, db
+from utils.occupancy import SlotConflict, occupy_slots
+from utils.table_index import table_index
+
+
+class HoldError(Exception):
+    """时间片保留不可用（不存在、不属于当前学员或已过期）"""
+
+
+def reclaim_expired_holds(now=None):
+    """在当前事务中删除已过期的保留及其时间片占用，返回被回收的保留行"""
+    now = now or datetime.utcnow()
+    rows = db.session.query(
+        SlotHold.id, SlotHold.campus_id, SlotHold.booking_date
+    ).filter(SlotHold.expires_at <= now).with_for_update(skip_locked=True).all()
+    if not rows:
+        return []
+
+    delete_holds([row.id for row in rows])
+    return rows
+
+
+def delete_holds(hold_ids):
+    """在当前事务中批量删除保留及其时间片占用"""
+    if not hold_ids:
+        return
+    UserSlot.query.filter(UserSlot.hold_id.in_(hold_ids)).delete(synchronize_session=False)
+    TableSlot.query.filter(TableSlot.hold_id.in_(hold_ids)).delete(synchronize_session=False)
+    SlotHold.query.filter(SlotHold.id.in_(hold_ids)).delete(synchronize_session=False)
+
+
+def holds_released(rows):
+    """保留被批量回收后使球台索引失效"""
+    for campus_id, booking_date in {(row.campus_id, row.booking_date) for row in rows}:
+        table_index.invalidate(campus_id, booking_date)
+
+
+def occupy_reclaiming(item, **kwargs):
+    """写入时间片占用；与尚未回收的过期保留冲突时，先回收过期保留再重试一次"""
+    try:
+        with db.session.begin_nested():
+            occupy_slots(item, **kwargs)
+    except SlotConflict:
+        rows = reclaim_expired_holds()
+        if not rows:
+            raise
+        holds_released(rows)
+        with db.session.begin_nested():
+            occupy_slots(item, **kwargs)
+
+
+def create_hold(student_id, coach_id, campus_id, booking_date, start_time, end_time, table_id=None):
+    """在当前事务中创建保留并占用教练、学员和球台的时间片
+
+    冲突时抛出 SlotConflict，调用方负责回滚。
+    """
+    hold = SlotHold(
+        token=secrets.token_urlsafe(24),
+        student_id=student_id,
+        coach_id=coach_id,
+        campus_id=campus_id,
+        table_id=table_id,
+        booking_date=booking_date,
+        start_time=start_time,
+        end_time=end_time,
+        expires_at=datetime.utcnow() + timedelta(seconds=current_app.config['SLOT_HOLD_TTL_SECONDS'])
+    )
+    db.session.add(hold)
+    db.session.flush()
+    occupy_reclaiming(hold)
+    return hold
+
+
+def find_hold(token, student_id, lock=False):
+    """按令牌查找学员本人未过期的保留，lock 为真时加行锁"""
+    query = SlotHold.query.filter_by(token=token)
+    if lock:
+        query = query.with_for_update()
+    hold = query.first()
+    if not hold or hold.student_id != student_id:
+        raise HoldError('保留不存在')
+    if hold.expires_at <= datetime.utcnow():
+        raise HoldError('保留已过期，请重新选择时间')
+    return hold
+
+
+def release_hold(hold):
+    """在当前事务中删除保留及其时间片占用"""
+    UserSlot.query.filter_by(hold_id=hold.id).delete(synchronize_session=False)
+    TableSlot.query.filter_by(hold_id=hold.id).delete(synchronize_session=False)
+    db.session.delete(hold)
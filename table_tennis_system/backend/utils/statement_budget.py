@@ -0,0 +1,39 @@
+import threading
+from functools import wraps
+
+from flask import current_app
+from sqlalchemy import event
+from models import db
+
+
+def statement_budget(limit):
+    """限制接口执行的 SQL 语句数，放在 require_auth 之后
+
+    测试模式（app.testing）下在接口函数执行期间给当前应用的 engine 挂上计数监听，只统计本线程
+    执行的语句，结束后移除；超过 limit 时抛出 AssertionError，用于发现随每页行数增长的 N+1 查询。
+    非测试模式不注册监听，也不做统计。
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not current_app.testing:
+                return f(*args, **kwargs)
+
+            thread_id = threading.get_ident()
+            count = 0
+
+            def count_statement(conn, cursor, statement, parameters, context, executemany):
+                nonlocal count
+                if threading.get_ident() == thread_id:
+                    count += 1
+
+            engine = db.engine
+            event.listen(engine, 'before_cursor_execute', count_statement)
+            try:
+                response = f(*args, **kwargs)
+            finally:
+                event.remove(engine, 'before_cursor_execute', count_statement)
+            assert count <= limit, f'{f.__name__} 执行了 {count} 条 SQL 语句，超过上限 {limit}'
+            return response
+        return decorated_function
+    return decorator
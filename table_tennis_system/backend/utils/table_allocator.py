@@ -0,0 +1,106 @@
+from models import Booking, SlotHold, Table, db
+from utils.occupancy import SlotConflict, occupy_slots, release_slots
+from utils.table_index import TableTimeline, table_index, to_seconds
+
+
+def first_fit_table(timelines, start, end):
+    """从按 id 排序的 [(table_id, TableTimeline)] 中选出第一张 [start, end) 空闲的球台"""
+    for table_id, timeline in timelines:
+        if timeline.is_free(start, end):
+            return table_id
+    return None
+
+
+def assign_table(booking, max_attempts=3):
+    """在当前事务中为未指定球台的预约自动分配球台
+
+    候选球台由内存索引按首次适配给出（id 最小的空闲球台），时间片占用表的唯一键做最终裁决；
+    候选已被并发占用时换下一张，全部失败或无空闲球台时返回 None。
+    """
+    start, end = to_seconds(booking.start_time), to_seconds(booking.end_time)
+    tried = set()
+
+    for _ in range(max_attempts):
+        table_id = table_index.with_timelines(
+            booking.campus_id, booking.booking_date,
+            lambda timelines: first_fit_table(
+                [(tid, tl) for tid, tl in timelines if tid not in tried], start, end))
+        if table_id is None:
+            return None
+        try:
+            with db.session.begin_nested():
+                booking.table_id = table_id
+                db.session.flush()
+                occupy_slots(booking, schedule=False)
+            return table_id
+        except SlotConflict:
+            booking.table_id = None
+            tried.add(table_id)
+    return None
+
+
+def repack_assignments(fixed, movable, table_ids):
+    """重新分配一天的球台
+
+    fixed: [(booking_id, table_id, start, end)] 保持原球台的预约或保留；
+    movable: [(booking_id, start, end)] 待分配的预约，按开始时间依次首次适配。没有 fixed 时
+    按开始时间排序的首次适配所需球台数已是最少（等于同一时刻最多重叠的预约数）。
+    返回 {booking_id: table_id 或 None}。
+    """
+    timelines = {table_id: TableTimeline() for table_id in sorted(table_ids)}
+    for booking_id, table_id, start, end in fixed:
+        if table_id in timelines:
+            timelines[table_id].add(start, end, booking_id)
+
+    assignments = {}
+    for booking_id, start, end in sorted(movable, key=lambda item: (item[1], -(item[2] - item[1]), item[0])):
+        table_id = first_fit_table(timelines.items(), start, end)
+        if table_id is not None:
+            timelines[table_id].add(start, end, booking_id)
+        assignments[booking_id] = table_id
+    return assignments
+
+
+def repack_campus_day(campus_id, booking_date, include_assigned=False):
+    """重新分配某校区某天待确认、已确认预约的球台并重写球台时间片占用
+
+    include_assigned 为假时只为未分配球台的预约分配，已分配的保持不动。时间片保留占用的球台
+    （包括尚未回收的过期保留）保持不动，预约不会被移到保留的时段上。
+    返回 {booking_id: table_id 或 None}，调用方负责提交事务。
+    """
+    table_ids = [row.id for row in db.session.query(Table.id).filter(
+        Table.campus_id == campus_id, Table.status == 'available')]
+
+    bookings = Booking.query.filter(
+        Booking.campus_id == campus_id,
+        Booking.booking_date == booking_date,
+        Booking.status.in_(['pending', 'confirmed'])
+    ).with_for_update().all()
+
+    holds = db.session.query(
+        SlotHold.id, SlotHold.table_id, SlotHold.start_time, SlotHold.end_time
+    ).filter(
+        SlotHold.campus_id == campus_id,
+        SlotHold.booking_date == booking_date,
+        SlotHold.table_id.isnot(None)
+    ).all()
+
+    # 保留以负 id 放入时间线，与预约 id 区分
+    fixed = [(-hold.id, hold.table_id, to_seconds(hold.start_time), to_seconds(hold.end_time)) for hold in holds]
+    movable = []
+    for booking in bookings:
+        interval = (to_seconds(booking.start_time), to_seconds(booking.end_time))
+        if include_assigned or not booking.table_id or booking.table_id not in table_ids:
+            movable.append((booking.id,) + interval)
+        else:
+            fixed.append((booking.id, booking.table_id) + interval)
+
+    assignments = repack_assignments(fixed, movable, table_ids)
+
+    moved = [booking for booking in bookings if booking.id in assignments]
+    release_slots([booking.id for booking in moved], schedule=False)
+    for booking in moved:
+        booking.table_id = assignments[booking.id]
+    db.session.flush()
+    occupy_slots([booking for booking in moved if booking.table_id], schedule=False)
+    return assignments
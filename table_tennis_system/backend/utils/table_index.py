@@ -0,0 +1,266 @@
+import threading
+import time as _time
+from bisect import bisect_left
+
+from datetime import date, datetime
+
+from flask import current_app
+from models import Booking, SlotHold, Table, db
+
+# 占用球台的预约状态（与预约冲突检查保持一致）
+BLOCKING_STATUSES = ('pending', 'confirmed')
+
+
+def hold_key(hold_id):
+    """时间片保留在索引中的键，取负数以区别于预约 id"""
+    return -hold_id
+
+
+def to_seconds(t):
+    """time 对象转换为当天秒数"""
+    return t.hour * 3600 + t.minute * 60 + t.second
+
+
+class TableTimeline:
+    """单张球台当天的占用区间，按开始时间排序"""
+
+    __slots__ = ('items', 'starts', 'max_ends')
+
+    def __init__(self):
+        self.items = []      # (start, end, booking_id)
+        self.starts = []
+        self.max_ends = []   # 前缀最大结束时间，用于 O(log n) 判断重叠
+
+    def _refresh_from(self, idx):
+        running = self.max_ends[idx - 1] if idx > 0 else -1
+        del self.max_ends[idx:]
+        for _, end, _ in self.items[idx:]:
+            running = max(running, end)
+            self.max_ends.append(running)
+
+    def add(self, start, end, booking_id):
+        item = (start, end, booking_id)
+        idx = bisect_left(self.items, item)
+        self.items.insert(idx, item)
+        self.starts.insert(idx, start)
+        self._refresh_from(idx)
+
+    def remove(self, booking_id):
+        for idx, item in enumerate(self.items):
+            if item[2] == booking_id:
+                del self.items[idx]
+                del self.starts[idx]
+                self._refresh_from(idx)
+                return True
+        return False
+
+    def is_free(self, start, end):
+        """[start, end) 是否与已有区间无重叠"""
+        idx = bisect_left(self.starts, end)
+        return idx == 0 or self.max_ends[idx - 1] <= start
+
+    def booking_ids(self):
+        return {item[2] for item in self.items}
+
+
+class DayIndex:
+    """某校区某一天的球台占用情况"""
+
+    __slots__ = ('tables', 'timelines', 'built_at')
+
+    def __init__(self, tables, built_at):
+        self.tables = tables     # [(table_id, table_dict)]，按 id 排序
+        self.timelines = {table_id: TableTimeline() for table_id, _ in tables}
+        self.built_at = built_at
+
+
+class TableOccupancyIndex:
+    """按 (校区, 日期) 懒加载的球台占用内存索引
+
+    未过期的时间片保留以 hold_key() 作为键一并计入占用。预约状态变化后调用 sync() 同步；条目超过 TABLE_INDEX_TTL 秒后重新从数据库加载，
+    以兼容多进程部署下其他进程写入的预约。每次从数据库加载时丢弃今天之前和已过期的条目，索引只保留近期查询过的日期。
+    """
+
+    def __init__(self):
+        self._days = {}        # (campus_id, date) -> DayIndex
+        self._locations = {}   # booking_id -> (campus_id, date, table_id)
+        self._table_campus = {}  # table_id -> campus_id
+        self._lock = threading.RLock()
+
+    def _ttl(self):
+        return current_app.config.get('TABLE_INDEX_TTL', 60)
+
+    def load_day(self, campus_id, booking_date, tables, rows):
+        """用给定的球台和预约区间构建某天的索引
+
+        tables: [(table_id, table_dict)]；rows: [(booking_id, table_id, start_time, end_time)]
+        """
+        day = DayIndex(sorted(tables, key=lambda item: item[0]), _time.monotonic())
+        with self._lock:
+            self._drop_day((campus_id, booking_date))
+            for table_id, _ in tables:
+                self._table_campus[table_id] = campus_id
+            for booking_id, table_id, start_time, end_time in rows:
+                timeline = day.timelines.get(table_id)
+                if timeline is None:
+                    continue
+                timeline.add(to_seconds(start_time), to_seconds(end_time), booking_id)
+                self._locations[booking_id] = (campus_id, booking_date, table_id)
+            self._days[(campus_id, booking_date)] = day
+        return day
+
+    def _query_day(self, campus_id, booking_date):
+        tables = Table.query.filter_by(campus_id=campus_id, status='available').all()
+        table_ids = [table.id for table in tables]
+        rows = []
+        if table_ids:
+            rows = db.session.query(
+                Booking.id, Booking.table_id, Booking.start_time, Booking.end_time
+            ).filter(
+                Booking.table_id.in_(table_ids),
+                Booking.booking_date == booking_date,
+                Booking.status.in_(BLOCKING_STATUSES)
+            ).all()
+            holds = db.session.query(
+                SlotHold.id, SlotHold.table_id, SlotHold.start_time, SlotHold.end_time
+            ).filter(
+                SlotHold.table_id.in_(table_ids),
+                SlotHold.booking_date == booking_date,
+                SlotHold.expires_at > datetime.utcnow()
+            ).all()
+            rows = list(rows) + [(hold_key(hold.id), hold.table_id, hold.start_time, hold.end_time)
+                                 for hold in holds]
+        return [(table.id, table.to_dict()) for table in tables], rows
+
+    def _drop_day(self, key):
+        day = self._days.pop(key, None)
+        if day is None:
+            return
+        for timeline in day.timelines.values():
+            for booking_id in timeline.booking_ids():
+                self._locations.pop(booking_id, None)
+        # 该校区没有其他已加载的日期时，球台所属校区也不再需要
+        if not any(campus_id == key[0] for campus_id, _ in self._days):
+            for table_id, _ in day.tables:
+                if self._table_campus.get(table_id) == key[0]:
+                    del self._table_campus[table_id]
+
+    def _prune(self, now):
+        """丢弃今天之前的日期和已过期的条目（过期条目下次查询时会重新加载）"""
+        today = date.today()
+        ttl = self._ttl()
+        for key, day in list(self._days.items()):
+            if key[1] < today or now - day.built_at > ttl:
+                self._drop_day(key)
+
+    def _get_day(self, campus_id, booking_date):
+        key = (campus_id, booking_date)
+        with self._lock:
+            day = self._days.get(key)
+            now = _time.monotonic()
+            if day is None or now - day.built_at > self._ttl():
+                self._prune(now)
+                tables, rows = self._query_day(campus_id, booking_date)
+                day = self.load_day(campus_id, booking_date, tables, rows)
+            return day
+
+    def free_tables(self, campus_id, booking_date, start_time, end_time):
+        """返回 [start_time, end_time) 内空闲的球台（table.to_dict() 结果）"""
+        start, end = to_seconds(start_time), to_seconds(end_time)
+        day = self._get_day(campus_id, booking_date)
+        with self._lock:
+            return [
+                table_dict for table_id, table_dict in day.tables
+                if day.timelines[table_id].is_free(start, end)
+            ]
+
+    def is_table_free(self, campus_id, booking_date, table_id, start_time, end_time):
+        """单张球台在 [start_time, end_time) 内是否空闲"""
+        day = self._get_day(campus_id, booking_date)
+        with self._lock:
+            timeline = day.timelines.get(table_id)
+            return timeline is not None and timeline.is_free(
+                to_seconds(start_time), to_seconds(end_time))
+
+    def with_timelines(self, campus_id, booking_date, func):
+        """在索引锁内以 [(table_id, TableTimeline)] 调用 func 并返回其结果，供分配球台等只读计算使用"""
+        day = self._get_day(campus_id, booking_date)
+        with self._lock:
+            return func([(table_id, day.timelines[table_id]) for table_id, _ in day.tables])
+
+    def _place(self, key, item, active):
+        """把预约或保留按 key 移出原位置，active 为真时放入当前球台的时间线"""
+        with self._lock:
+            location = self._locations.pop(key, None)
+            if location:
+                day = self._days.get(location[:2])
+                if day and location[2] in day.timelines:
+                    day.timelines[location[2]].remove(key)
+
+            if not active or not item.table_id:
+                return
+
+            # 按球台所属校区定位；当天索引尚未加载时无需处理，首次查询会从数据库读取
+            campus_id = self._table_campus.get(item.table_id, item.campus_id)
+            day = self._days.get((campus_id, item.booking_date))
+            if day is None or item.table_id not in day.timelines:
+                return
+            day.timelines[item.table_id].add(
+                to_seconds(item.start_time), to_seconds(item.end_time), key)
+            self._locations[key] = (campus_id, item.booking_date, item.table_id)
+
+    def sync(self, booking):
+        """预约创建或状态变化（确认、取消、完成）后同步索引"""
+        self._place(booking.id, booking, booking.status in BLOCKING_STATUSES)
+
+    def sync_hold(self, hold, active=True):
+        """时间片保留创建（active）或释放、兑换为预约后同步索引"""
+        self._place(hold_key(hold.id), hold, active)
+
+    def invalidate(self, campus_id=None, booking_date=None):
+        """丢弃索引条目（批量更新预约后调用），不传参数时清空全部"""
+        with self._lock:
+            for key in list(self._days):
+                if campus_id is not None and key[0] != campus_id:
+                    continue
+                if booking_date is not None and key[1] != booking_date:
+                    continue
+                self._drop_day(key)
+
+    def check_consistency(self, campus_id, booking_date, repair=True):
+        """对比索引与数据库中的占用情况，返回差异；repair 为真时用数据库结果重建索引"""
+        tables, rows = self._query_day(campus_id, booking_date)
+        expected = {table_id: set() for table_id, _ in tables}
+        for booking_id, table_id, _, _ in rows:
+            expected[table_id].add(booking_id)
+
+        with self._lock:
+            day = self._days.get((campus_id, booking_date))
+            # 未加载的日期以数据库为准，视为一致
+            indexed = expected
+            if day is not None:
+                indexed = {table_id: timeline.booking_ids() for table_id, timeline in day.timelines.items()}
+
+        missing, extra = [], []
+        for table_id in set(expected) | set(indexed):
+            db_ids = expected.get(table_id, set())
+            index_ids = indexed.get(table_id, set())
+            missing.extend({'table_id': table_id, 'booking_id': bid} for bid in sorted(db_ids - index_ids))
+            extra.extend({'table_id': table_id, 'booking_id': bid} for bid in sorted(index_ids - db_ids))
+
+        consistent = not missing and not extra
+        if not consistent and repair:
+            self.load_day(campus_id, booking_date, tables, rows)
+
+        return {
+            'campus_id': campus_id,
+            'date': booking_date.isoformat(),
+            'loaded': day is not None,
+            'consistent': consistent,
+            'missing': missing,
+            'extra': extra
+        }
+
+
+# 进程内共享的索引实例
+table_index = TableOccupancyIndex()
@@ -0,0 +1,376 @@
+import gzip
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from itertools import groupby
+
+from flask import current_app
+from sqlalchemy import func, insert, select
+from models import (Account, AggregateWatermark, GatewayCallback, SystemLog, Transaction, TransactionArchive,
+                    TransactionArchiveSegment, db)
+from utils.payment_stats import STATS_WATERMARK, lock_watermark, next_bucket
+
+TRANSACTION_TYPES = ('deposit', 'withdraw', 'refund')
+# 归档锁行（aggregate_watermarks 中的一行），position 为最后归档的交易 id
+ARCHIVE_LOCK = 'transaction_archive'
+ARCHIVE_COLUMNS = ('id', 'user_id', 'transaction_type', 'amount', 'payment_method', 'status',
+                   'description', 'related_booking_id', 'created_at')
+
+
+def hot_start():
+    """交易表中最早未归档月份的第一天，还没有归档时返回 None"""
+    last = db.session.query(func.max(TransactionArchive.month)).scalar()
+    return next_bucket(last, 'month') if last else None
+
+
+def archive_dir():
+    """归档目录，必须配置为绝对路径，避免文件落在进程的当前目录下"""
+    directory = current_app.config.get('ARCHIVE_DIR')
+    if not directory or not os.path.isabs(directory):
+        raise RuntimeError('ARCHIVE_DIR 必须配置为绝对路径')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def _lock_archive():
+    """结束当前事务后锁住归档锁行，各进程的归档依次执行，锁随下一次提交释放
+
+    加锁是新事务的第一条语句，之后的读取都能看到先前持锁进程提交的结果。
+    """
+    db.session.commit()
+    return lock_watermark(ARCHIVE_LOCK)
+
+
+def _file_digest(path):
+    """文件大小和 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as archive_file:
+        for block in iter(lambda: archive_file.read(1 << 20), b''):
+            digest.update(block)
+    return os.path.getsize(path), digest.hexdigest()
+
+
+def verify_archive(archive):
+    """归档文件是否存在且大小、校验和与登记一致"""
+    if not os.path.exists(archive.file_path):
+        return False
+    return _file_digest(archive.file_path) == (archive.file_size, archive.checksum)
+
+
+def _month_cutoff(hot_months, today=None):
+    """保留最近 hot_months 个整月，返回可归档月份的上界（不含）"""
+    month = (today or datetime.utcnow().date()).replace(day=1)
+    for _ in range(hot_months):
+        month = (month - timedelta(days=1)).replace(day=1)
+    return month
+
+
+def _month_range(month):
+    return [Transaction.created_at >= datetime.combine(month, time.min),
+            Transaction.created_at < datetime.combine(next_bucket(month, 'month'), time.min)]
+
+
+def _blocker(month):
+    """该月交易不能归档的原因，可以归档时返回 None
+
+    归档的交易必须已是最终状态，并且已计入每日收支汇总和各账户的余额快照，
+    这样余额、收费统计和增量对账都不再需要读取它们。
+    """
+    in_month = _month_range(month)
+    if db.session.query(Transaction.id).filter(*in_month, Transaction.status == 'pending').first():
+        return '存在待处理的交易'
+    position = db.session.query(AggregateWatermark.position).filter_by(name=STATS_WATERMARK).scalar() or 0
+    if db.session.query(func.max(Transaction.id)).filter(*in_month).scalar() > position:
+        return '尚未全部计入每日收支汇总'
+    if db.session.query(Transaction.id).join(Account, Account.user_id == Transaction.user_id).filter(
+            *in_month, Transaction.id > Account.ledger_position).first():
+        return '尚未全部合并进余额快照'
+    return None
+
+
+def _serialize(row):
+    item = dict(zip(ARCHIVE_COLUMNS, row))
+    item['amount'] = str(item['amount'])
+    item['created_at'] = item['created_at'].isoformat() if item['created_at'] else None
+    return json.dumps(item, ensure_ascii=False) + '\n'
+
+
+def _write_archive(month, path, batch_size):
+    """以服务端游标按用户顺序读取一个月的交易，每个用户写成一段独立的 gzip 数据
+
+    段内按时间倒序排列，与交易记录接口的顺序一致。先写临时文件，落盘后再改名。
+    返回文件信息和各分段的位置、计数。
+    """
+    stmt = select(*(getattr(Transaction, column) for column in ARCHIVE_COLUMNS)).where(
+        *_month_range(month)
+    ).order_by(Transaction.user_id, Transaction.created_at.desc(), Transaction.id.desc())
+    result = db.session.execute(stmt.execution_options(stream_results=True, yield_per=batch_size))
+
+    segments = []
+    digest = hashlib.sha256()
+    ids = []
+    temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    try:
+        with open(temp_path, 'wb') as archive_file:
+            for user_id, rows in groupby(result, key=lambda row: row.user_id):
+                rows = list(rows)
+                counts = {transaction_type: 0 for transaction_type in TRANSACTION_TYPES}
+                net_amount = Decimal('0')
+                for row in rows:
+                    counts[row.transaction_type] += 1
+                    if row.status == 'completed':
+                        net_amount += -row.amount if row.transaction_type == 'withdraw' else row.amount
+                    ids.append(row.id)
+
+                data = gzip.compress(''.join(_serialize(row) for row in rows).encode('utf-8'))
+                segments.append({
+                    'user_id': user_id,
+                    'byte_offset': archive_file.tell(),
+                    'byte_length': len(data),
+                    'row_count': len(rows),
+                    'deposit_count': counts['deposit'],
+                    'withdraw_count': counts['withdraw'],
+                    'refund_count': counts['refund'],
+                    'net_amount': net_amount
+                })
+                archive_file.write(data)
+                digest.update(data)
+            archive_file.flush()
+            os.fsync(archive_file.fileno())
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    finally:
+        result.close()
+    os.replace(temp_path, path)
+
+    return {
+        'file_size': os.path.getsize(path),
+        'checksum': digest.hexdigest(),
+        'row_count': len(ids),
+        'first_transaction_id': min(ids) if ids else None,
+        'last_transaction_id': max(ids) if ids else None,
+        'segments': segments
+    }
+
+
+def _purge_archived(boundary, batch_size):
+    """分批删除交易表中早于 boundary 的交易（它们已全部写入归档），连同其支付回调"""
+    deleted = 0
+    while True:
+        ids = [transaction_id for (transaction_id,) in db.session.query(Transaction.id).filter(
+            Transaction.created_at < datetime.combine(boundary, time.min)
+        ).order_by(Transaction.id).limit(batch_size)]
+        if not ids:
+            break
+        GatewayCallback.query.filter(GatewayCallback.transaction_id.in_(ids)).delete(synchronize_session=False)
+        Transaction.query.filter(Transaction.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(ids)
+    return deleted
+
+
+def archive_month(month, batch_size=None):
+    """把一个月的交易写入压缩文件并登记归档，然后从交易表中分批删除
+
+    调用方需持有归档锁（_lock_archive()），登记提交时释放。文件先写到唯一的临时文件再改名，
+    落盘的文件大小和校验和核对无误后才登记；登记提交后，读取方就以 hot_start() 为界区分交易表和归档，
+    删除过程中不会重复读到同一笔交易。删除中断时，下次归档会先核对文件再继续删除。
+    """
+    batch_size = batch_size or current_app.config['ARCHIVE_BATCH_SIZE']
+    path = os.path.join(archive_dir(), f'transactions-{month:%Y-%m}.jsonl.gz')
+    if db.session.query(TransactionArchive.id).filter_by(month=month).first():
+        raise RuntimeError(f'{month:%Y-%m} 已归档')
+
+    info = _write_archive(month, path, batch_size)
+    segments = info.pop('segments')
+    if _file_digest(path) != (info['file_size'], info['checksum']):
+        raise RuntimeError(f'{month:%Y-%m} 归档文件校验失败')
+
+    archive = TransactionArchive(month=month, file_path=path, **info)
+    db.session.add(archive)
+    db.session.flush()
+    if segments:
+        db.session.execute(insert(TransactionArchiveSegment),
+                           [dict(segment, archive_id=archive.id) for segment in segments])
+    mark = AggregateWatermark.query.filter_by(name=ARCHIVE_LOCK).first()
+    if info['last_transaction_id']:
+        mark.position = max(mark.position, info['last_transaction_id'])
+    db.session.commit()
+
+    _purge_archived(next_bucket(month, 'month'), batch_size)
+    return archive
+
+
+def archive_transactions(max_months=None):
+    """从最早的月份开始，依次归档早于 TRANSACTION_HOT_MONTHS 个月的整月交易
+
+    遇到不能归档的月份就停止，保证已归档的月份连续，交易表只保留 hot_start() 之后的交易。
+    每个月在归档锁下判定和写入，多个进程同时运行时同一个月只会归档一次。
+    """
+    config = current_app.config
+    archive_dir()
+    cutoff = _month_cutoff(config['TRANSACTION_HOT_MONTHS'])
+
+    _lock_archive()
+    boundary = hot_start()
+    if boundary:
+        last = TransactionArchive.query.order_by(TransactionArchive.month.desc()).first()
+        if not verify_archive(last):
+            db.session.commit()
+            raise RuntimeError(f'{last.month:%Y-%m} 归档文件缺失或校验失败，停止删除已归档的交易')
+    db.session.commit()
+    if boundary:
+        _purge_archived(boundary, config['ARCHIVE_BATCH_SIZE'])
+
+    archived = []
+    while max_months is None or len(archived) < max_months:
+        _lock_archive()
+        # 其他进程刚归档、尚未删完的月份不再处理
+        boundary = hot_start()
+        query = db.session.query(func.min(Transaction.created_at))
+        if boundary:
+            query = query.filter(Transaction.created_at >= datetime.combine(boundary, time.min))
+        first = query.scalar()
+        if first is None or first.date().replace(day=1) >= cutoff:
+            break
+        month = first.date().replace(day=1)
+        reason = _blocker(month)
+        if reason:
+            current_app.logger.warning(f'{month:%Y-%m} 的交易暂不能归档: {reason}')
+            break
+        try:
+            archive_month(month)
+        except Exception:
+            db.session.rollback()
+            raise
+        archived.append(f'{month:%Y-%m}')
+    db.session.commit()
+
+    boundary = hot_start()
+    return {'archived': archived, 'hot_start': boundary.isoformat() if boundary else None}
+
+
+def archive_system_logs(batch_size=None):
+    """把早于 SYSTEM_LOG_HOT_MONTHS 个月的系统日志按月追加到压缩文件后删除
+
+    每批在归档锁下先写文件并落盘再删除，多个进程不会追加同一批日志；删除前中断时，
+    重跑可能在文件中留下少量重复日志，但不会丢失。
+    """
+    config = current_app.config
+    batch_size = batch_size or config['ARCHIVE_BATCH_SIZE']
+    cutoff = datetime.combine(_month_cutoff(config['SYSTEM_LOG_HOT_MONTHS']), time.min)
+    directory = archive_dir()
+
+    archived = 0
+    while True:
+        _lock_archive()
+        rows = db.session.query(
+            SystemLog.id, SystemLog.user_id, SystemLog.action, SystemLog.description,
+            SystemLog.ip_address, SystemLog.created_at
+        ).filter(SystemLog.created_at < cutoff).order_by(SystemLog.id).limit(batch_size).all()
+        if not rows:
+            db.session.commit()
+            break
+        for month, month_rows in groupby(sorted(rows, key=lambda row: row.created_at.strftime('%Y-%m')),
+                                         key=lambda row: row.created_at.strftime('%Y-%m')):
+            lines = ''.join(json.dumps({
+                'id': row.id,
+                'user_id': row.user_id,
+                'action': row.action,
+                'description': row.description,
+                'ip_address': row.ip_address,
+                'created_at': row.created_at.isoformat()
+            }, ensure_ascii=False) + '\n' for row in month_rows)
+            # gzip 允许多段拼接，追加的一段解压时与前面的内容连在一起
+            with open(os.path.join(directory, f'system_logs-{month}.jsonl.gz'), 'ab') as log_file:
+                log_file.write(gzip.compress(lines.encode('utf-8')))
+                log_file.flush()
+                os.fsync(log_file.fileno())
+        SystemLog.query.filter(SystemLog.id.in_([row.id for row in rows])).delete(synchronize_session=False)
+        db.session.commit()
+        archived += len(rows)
+    return {'archived': archived}
+
+
+def archive_history():
+    """归档旧交易和系统日志"""
+    result = archive_transactions()
+    result['system_logs'] = archive_system_logs()['archived']
+    return result
+
+
+def read_segment(archive, segment):
+    """按偏移量读取并解压归档文件中的一个分段，返回与 Transaction.to_dict() 相同格式的记录"""
+    with open(archive.file_path, 'rb') as archive_file:
+        archive_file.seek(segment.byte_offset)
+        data = archive_file.read(segment.byte_length)
+    items = [json.loads(line) for line in gzip.decompress(data).decode('utf-8').splitlines()]
+    for item in items:
+        item['amount'] = float(item['amount'])
+    return items
+
+
+def _segment_count(segment, transaction_type):
+    if not transaction_type:
+        return segment.row_count
+    if transaction_type not in TRANSACTION_TYPES:
+        return 0
+    return getattr(segment, f'{transaction_type}_count')
+
+
+def user_transactions_page(user_id, transaction_type=None, page=1, per_page=10):
+    """按时间倒序分页读取用户的交易记录，翻到交易表之外时透明地读取归档
+
+    归档的月份都早于交易表中的交易，排在交易表之后。总数和页面所在的分段由归档分段表的计数
+    算出，只解压页面覆盖到的分段。返回格式与 paginate_query() 相同。
+    """
+    page = max(int(page or 1), 1)
+    per_page = min(int(per_page or 10), 100)
+    start, end = (page - 1) * per_page, page * per_page
+
+    query = Transaction.query.filter(Transaction.user_id == user_id)
+    if transaction_type:
+        query = query.filter(Transaction.transaction_type == transaction_type)
+    boundary = hot_start()
+    if boundary:
+        # 归档后尚未删完的交易以归档为准
+        query = query.filter(Transaction.created_at >= datetime.combine(boundary, time.min))
+    hot_total = query.count()
+
+    segments = db.session.query(TransactionArchiveSegment, TransactionArchive).join(
+        TransactionArchive, TransactionArchive.id == TransactionArchiveSegment.archive_id
+    ).filter(TransactionArchiveSegment.user_id == user_id).order_by(TransactionArchive.month.desc()).all()
+    total = hot_total + sum(_segment_count(segment, transaction_type) for segment, _ in segments)
+
+    items = []
+    if start < hot_total:
+        items = [transaction.to_dict() for transaction in query.order_by(
+            Transaction.created_at.desc(), Transaction.id.desc()).offset(start).limit(per_page)]
+
+    position = hot_total
+    for segment, archive in segments:
+        if position >= end:
+            break
+        count = _segment_count(segment, transaction_type)
+        if count and position + count > start:
+            rows = read_segment(archive, segment)
+            if transaction_type:
+                rows = [row for row in rows if row['transaction_type'] == transaction_type]
+            items.extend(rows[max(start - position, 0):end - position])
+        position += count
+
+    pages = -(-total // per_page)
+    return {
+        'items': items,
+        'total': total,
+        'pages': pages,
+        'current_page': page,
+        'per_page': per_page,
+        'has_next': page < pages,
+        'has_prev': page > 1
+    }
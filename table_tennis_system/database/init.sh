@@ -48,6 +48,16 @@ else
     exit 1
 fi
 
+# 为示例预约写入时间片占用记录
+echo "🗓️ 重建预约时间片占用..."
+(cd "$(dirname "$0")/../backend" && flask --app app rebuild-slots)
+if [ $? -eq 0 ]; then
+    echo "✅ 时间片占用重建成功"
+else
+    echo "❌ 时间片占用重建失败，请在 backend 目录下执行 flask --app app rebuild-slots"
+    exit 1
+fi
+
 echo "🎉 数据库初始化完成！"
 echo ""
 echo "📋 测试账号信息："
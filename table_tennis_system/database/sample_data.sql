@@ -87,6 +87,9 @@ INSERT INTO transactions (user_id, transaction_type, amount, payment_method, des
 (7, 'withdraw', 200.00, 'system', '课时费扣除'),
 (8, 'withdraw', 200.00, 'system', '课时费扣除');
 
+-- 账户余额已包含以上交易，快照位置指向最后一条交易
+UPDATE accounts SET ledger_position = (SELECT MAX(id) FROM transactions), snapshot_at = NOW();
+
 -- 插入比赛数据
 INSERT INTO matches (name, match_date, registration_start, registration_end, registration_fee, status) VALUES
 ('2025年1月月赛', '2025-01-28', '2025-01-01 00:00:00', '2025-01-25 23:59:59', 30.00, 'registration'),
@@ -18,7 +18,8 @@ CREATE TABLE users (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     INDEX idx_username (username),
     INDEX idx_user_type (user_type),
-    INDEX idx_campus_id (campus_id)
+    INDEX idx_campus_id (campus_id),
+    INDEX idx_created_at (created_at)
 );
 
 -- 校区表
@@ -80,6 +81,28 @@ CREATE TABLE tables (
     INDEX idx_status (status)
 );
 
+-- 系列预约表（每周固定时间的多次课程，创建时一次性预付）
+CREATE TABLE booking_series (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    student_id INT NOT NULL,
+    coach_id INT NOT NULL,
+    campus_id INT NOT NULL,
+    table_id INT DEFAULT NULL,
+    weekday TINYINT NOT NULL,
+    start_time TIME NOT NULL,
+    end_time TIME NOT NULL,
+    first_date DATE NOT NULL,
+    occurrences INT NOT NULL,
+    total_fee DECIMAL(10,2) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (student_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (coach_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (campus_id) REFERENCES campus(id) ON DELETE CASCADE,
+    FOREIGN KEY (table_id) REFERENCES tables(id) ON DELETE SET NULL,
+    INDEX idx_student_id (student_id),
+    INDEX idx_coach_id (coach_id)
+);
+
 -- 预约表
 CREATE TABLE bookings (
     id INT PRIMARY KEY AUTO_INCREMENT,
@@ -92,23 +115,137 @@ CREATE TABLE bookings (
     end_time TIME NOT NULL,
     lesson_fee DECIMAL(10,2) NOT NULL,
     status ENUM('pending', 'confirmed', 'cancelled', 'completed') DEFAULT 'pending',
+    series_id INT DEFAULT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     confirm_time TIMESTAMP NULL DEFAULT NULL,
     FOREIGN KEY (student_id) REFERENCES users(id) ON DELETE CASCADE,
     FOREIGN KEY (coach_id) REFERENCES users(id) ON DELETE CASCADE,
     FOREIGN KEY (campus_id) REFERENCES campus(id) ON DELETE CASCADE,
     FOREIGN KEY (table_id) REFERENCES tables(id) ON DELETE SET NULL,
+    FOREIGN KEY (series_id) REFERENCES booking_series(id) ON DELETE SET NULL,
     INDEX idx_student_id (student_id),
     INDEX idx_coach_id (coach_id),
     INDEX idx_booking_date (booking_date),
-    INDEX idx_status (status)
+    INDEX idx_status (status),
+    INDEX idx_series_id (series_id),
+    INDEX idx_created_at (created_at)
+);
+
+-- 候补表（时间窗口已约满时排队，有预约取消后按先后顺序自动转为预约）
+CREATE TABLE booking_waitlist (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    student_id INT NOT NULL,
+    coach_id INT NOT NULL,
+    campus_id INT NOT NULL,
+    booking_date DATE NOT NULL,
+    window_start TIME NOT NULL,
+    window_end TIME NOT NULL,
+    duration_minutes INT NOT NULL,
+    status ENUM('waiting', 'promoted', 'cancelled') DEFAULT 'waiting',
+    booking_id INT DEFAULT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    promoted_at TIMESTAMP NULL DEFAULT NULL,
+    FOREIGN KEY (student_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (coach_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (campus_id) REFERENCES campus(id) ON DELETE CASCADE,
+    FOREIGN KEY (booking_id) REFERENCES bookings(id) ON DELETE SET NULL,
+    INDEX idx_student_id (student_id),
+    INDEX idx_waitlist_coach_date (coach_id, booking_date, status)
+);
+
+-- 时间片保留表（预约向导中短时间锁定时间段，过期由后台任务回收）
+CREATE TABLE slot_holds (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    token VARCHAR(64) UNIQUE NOT NULL,
+    student_id INT NOT NULL,
+    coach_id INT NOT NULL,
+    campus_id INT NOT NULL,
+    table_id INT DEFAULT NULL,
+    booking_date DATE NOT NULL,
+    start_time TIME NOT NULL,
+    end_time TIME NOT NULL,
+    expires_at DATETIME NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (student_id) REFERENCES users(id),
+    FOREIGN KEY (coach_id) REFERENCES users(id),
+    FOREIGN KEY (campus_id) REFERENCES campus(id),
+    FOREIGN KEY (table_id) REFERENCES tables(id),
+    INDEX idx_expires_at (expires_at)
+);
+
+-- 教练请假表（日期范围内每天 start_time 至 end_time 不可预约）
+CREATE TABLE coach_blockouts (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    coach_id INT NOT NULL,
+    campus_id INT DEFAULT NULL,
+    start_date DATE NOT NULL,
+    end_date DATE NOT NULL,
+    start_time TIME NOT NULL,
+    end_time TIME NOT NULL,
+    reason VARCHAR(255) DEFAULT NULL,
+    status ENUM('active', 'lifted') DEFAULT 'active',
+    created_by INT DEFAULT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (coach_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (campus_id) REFERENCES campus(id) ON DELETE SET NULL,
+    FOREIGN KEY (created_by) REFERENCES users(id) ON DELETE SET NULL,
+    INDEX idx_blockout_coach_date (coach_id, start_date, end_date)
+);
+
+-- 请假取消的预约（记录退款状态，退款分批进行）
+CREATE TABLE blockout_cancellations (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    blockout_id INT NOT NULL,
+    booking_id INT NOT NULL,
+    refund_status ENUM('none', 'pending', 'refunded') DEFAULT 'none',
+    FOREIGN KEY (blockout_id) REFERENCES coach_blockouts(id) ON DELETE CASCADE,
+    FOREIGN KEY (booking_id) REFERENCES bookings(id) ON DELETE CASCADE,
+    UNIQUE KEY unique_booking (booking_id),
+    INDEX idx_blockout_id (blockout_id)
 );
 
--- 账户表
+-- 球台时间片占用表（唯一键保证并发预约不会重复占用同一球台）
+CREATE TABLE table_slots (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    table_id INT NOT NULL,
+    slot_date DATE NOT NULL,
+    slot SMALLINT NOT NULL,
+    booking_id INT DEFAULT NULL,
+    hold_id INT DEFAULT NULL,
+    FOREIGN KEY (table_id) REFERENCES tables(id) ON DELETE CASCADE,
+    FOREIGN KEY (booking_id) REFERENCES bookings(id) ON DELETE CASCADE,
+    FOREIGN KEY (hold_id) REFERENCES slot_holds(id) ON DELETE CASCADE,
+    UNIQUE KEY unique_table_slot (table_id, slot_date, slot),
+    INDEX idx_booking_id (booking_id),
+    INDEX idx_hold_id (hold_id)
+);
+
+-- 用户时间片占用表（教练、学员同一时间片只能有一个预约）
+CREATE TABLE user_slots (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    user_id INT NOT NULL,
+    slot_date DATE NOT NULL,
+    slot SMALLINT NOT NULL,
+    booking_id INT DEFAULT NULL,
+    hold_id INT DEFAULT NULL,
+    block_id INT DEFAULT NULL,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (booking_id) REFERENCES bookings(id) ON DELETE CASCADE,
+    FOREIGN KEY (hold_id) REFERENCES slot_holds(id) ON DELETE CASCADE,
+    FOREIGN KEY (block_id) REFERENCES coach_blockouts(id) ON DELETE CASCADE,
+    UNIQUE KEY unique_user_slot (user_id, slot_date, slot),
+    INDEX idx_booking_id (booking_id),
+    INDEX idx_hold_id (hold_id),
+    INDEX idx_block_id (block_id)
+);
+
+-- 账户表（balance 为余额快照，只包含 id 不超过 ledger_position 的交易；实时余额 = 快照 + 之后已完成交易的合计）
 CREATE TABLE accounts (
     id INT PRIMARY KEY AUTO_INCREMENT,
     user_id INT UNIQUE NOT NULL,
     balance DECIMAL(10,2) DEFAULT 0.00,
+    ledger_position INT NOT NULL DEFAULT 0,
+    snapshot_at TIMESTAMP NULL DEFAULT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
@@ -133,6 +270,72 @@ CREATE TABLE transactions (
     INDEX idx_created_at (created_at)
 );
 
+-- 每日收支汇总表（按日期、校区、交易类型和支付方式累计已完成交易，campus_id 为 0 表示未分配校区）
+CREATE TABLE payment_daily_stats (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    stat_date DATE NOT NULL,
+    campus_id INT NOT NULL DEFAULT 0,
+    transaction_type ENUM('deposit', 'withdraw', 'refund') NOT NULL,
+    payment_method ENUM('wechat', 'alipay', 'offline', 'system') NOT NULL,
+    total_amount DECIMAL(12,2) NOT NULL DEFAULT 0.00,
+    transaction_count INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    UNIQUE KEY unique_daily_stat (stat_date, campus_id, transaction_type, payment_method),
+    INDEX idx_campus_id (campus_id)
+);
+
+-- 汇总水位表（记录各汇总任务已处理到的最大交易 id）
+CREATE TABLE aggregate_watermarks (
+    name VARCHAR(50) PRIMARY KEY,
+    position INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+-- 交易归档表（整月的旧交易移到磁盘上的压缩文件，交易表只保留之后的月份）
+CREATE TABLE transaction_archives (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    month DATE NOT NULL UNIQUE,
+    file_path VARCHAR(255) NOT NULL,
+    file_size BIGINT NOT NULL,
+    checksum VARCHAR(64) NOT NULL,
+    row_count INT NOT NULL DEFAULT 0,
+    first_transaction_id INT DEFAULT NULL,
+    last_transaction_id INT DEFAULT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 交易归档分段表（归档文件中每个用户的交易是一段独立的 gzip 数据）
+CREATE TABLE transaction_archive_segments (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    archive_id INT NOT NULL,
+    user_id INT NOT NULL,
+    byte_offset BIGINT NOT NULL,
+    byte_length INT NOT NULL,
+    row_count INT NOT NULL,
+    deposit_count INT NOT NULL DEFAULT 0,
+    withdraw_count INT NOT NULL DEFAULT 0,
+    refund_count INT NOT NULL DEFAULT 0,
+    net_amount DECIMAL(12,2) NOT NULL DEFAULT 0.00,
+    FOREIGN KEY (archive_id) REFERENCES transaction_archives(id) ON DELETE CASCADE,
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    UNIQUE KEY unique_archive_user (archive_id, user_id),
+    INDEX idx_segment_user (user_id, archive_id)
+);
+
+-- 对账记录表（核对账户余额快照与交易流水）
+CREATE TABLE reconciliation_runs (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    mode ENUM('full', 'incremental') NOT NULL,
+    status ENUM('running', 'completed', 'failed') DEFAULT 'running',
+    transaction_watermark INT NOT NULL DEFAULT 0,
+    accounts_checked INT DEFAULT 0,
+    mismatch_count INT DEFAULT 0,
+    report_path VARCHAR(255) DEFAULT NULL,
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP NULL DEFAULT NULL,
+    INDEX idx_status (status)
+);
+
 -- 比赛表
 CREATE TABLE matches (
     id INT PRIMARY KEY AUTO_INCREMENT,
@@ -141,8 +344,11 @@ CREATE TABLE matches (
     registration_start TIMESTAMP NOT NULL,
     registration_end TIMESTAMP NOT NULL,
     registration_fee DECIMAL(10,2) DEFAULT 30.00,
-    status ENUM('upcoming', 'registration', 'ongoing', 'completed') DEFAULT 'upcoming',
+    campus_id INT DEFAULT NULL,
+    status ENUM('upcoming', 'registration', 'ongoing', 'completed', 'cancelled') DEFAULT 'upcoming',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (campus_id) REFERENCES campus(id) ON DELETE SET NULL,
+    INDEX idx_campus_id (campus_id),
     INDEX idx_match_date (match_date),
     INDEX idx_status (status)
 );
@@ -154,7 +360,7 @@ CREATE TABLE match_registrations (
     student_id INT NOT NULL,
     group_name ENUM('group_a', 'group_b', 'group_c') NOT NULL,
     registration_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    payment_status ENUM('pending', 'paid') DEFAULT 'pending',
+    payment_status ENUM('pending', 'paid', 'refunded') DEFAULT 'pending',
     FOREIGN KEY (match_id) REFERENCES matches(id) ON DELETE CASCADE,
     FOREIGN KEY (student_id) REFERENCES users(id) ON DELETE CASCADE,
     UNIQUE KEY unique_registration (match_id, student_id),
@@ -194,6 +400,37 @@ CREATE TABLE cancellation_limits (
     INDEX idx_year_month (year_month)
 );
 
+-- 幂等键表（保存带 Idempotency-Key 请求的指纹和成功响应）
+CREATE TABLE idempotency_keys (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    user_id INT NOT NULL,
+    idempotency_key VARCHAR(64) NOT NULL,
+    fingerprint VARCHAR(64) NOT NULL,
+    status_code INT DEFAULT NULL,
+    response_body TEXT DEFAULT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at DATETIME NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    UNIQUE KEY unique_user_key (user_id, idempotency_key),
+    INDEX idx_expires_at (expires_at)
+);
+
+-- 支付网关回调表（notify_id 唯一，重复投递的回调只保存一次，由后台任务批量入账）
+CREATE TABLE gateway_callbacks (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    notify_id VARCHAR(64) NOT NULL UNIQUE,
+    transaction_id INT NOT NULL,
+    gateway_trade_no VARCHAR(64) DEFAULT NULL,
+    trade_status ENUM('success', 'failed') NOT NULL,
+    amount DECIMAL(10,2) NOT NULL,
+    payload TEXT DEFAULT NULL,
+    result ENUM('pending', 'credited', 'failed', 'ignored', 'rejected') DEFAULT 'pending',
+    received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    processed_at DATETIME DEFAULT NULL,
+    FOREIGN KEY (transaction_id) REFERENCES transactions(id),
+    INDEX idx_callback_result (result, id)
+);
+
 -- 系统日志表
 CREATE TABLE system_logs (
     id INT PRIMARY KEY AUTO_INCREMENT,